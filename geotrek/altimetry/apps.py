@@ -5,3 +5,6 @@ from django.utils.translation import gettext_lazy as _
 class AltimetryConfig(AppConfig):
     name = 'geotrek.altimetry'
     verbose_name = _("Altimetry")
+
+    def ready(self):
+        import geotrek.altimetry.signals  # NOQA
@@ -1,18 +1,92 @@
 import logging
+import math
+import threading
+from collections import OrderedDict
+from itertools import accumulate
 
-from django.contrib.gis.geos import GEOSGeometry
+from django.apps import apps
+from django.contrib.gis.geos import Polygon
 from django.utils import translation
 from django.utils.translation import gettext as _
 from django.contrib.gis.geos import LineString
 from django.conf import settings
 from django.db import connection
 
+import numpy as np
 import pygal
 from pygal.style import LightSolarizedStyle
 
+from geotrek.common.versions import get_version
+
 logger = logging.getLogger(__name__)
 
 
+class DemTiles:
+    """ Values of DEM tiles, read as NumPy arrays once per tile and kept in memory with LRU eviction.
+    Tiles are dropped when the DEM version changes (e.g. DEM loaded again). """
+    max_tiles = 256
+
+    def __init__(self):
+        self.tiles = OrderedDict()
+        self.version = None
+        self.lock = threading.Lock()
+
+    def get_tiles(self, extent):
+        """ Returns tiles intersecting extent, as (upper left x, upper left y, scale x, scale y, values) tuples """
+        version = get_version(apps.get_model('altimetry', 'Dem'))
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT rid FROM altimetry_dem WHERE ST_Intersects(rast, ST_MakeEnvelope(%s, %s, %s, %s, %s))",
+                           list(extent) + [settings.SRID])
+            rids = [rid for rid, in cursor.fetchall()]
+            with self.lock:
+                if self.version != version:
+                    self.tiles.clear()
+                    self.version = version
+                # Kept here, other threads may evict them meanwhile
+                tiles = {rid: self.tiles[rid] for rid in rids if rid in self.tiles}
+            missing = [rid for rid in rids if rid not in tiles]
+            if missing:
+                # Nodata pixels are dumped as NULL, hence NaN
+                cursor.execute("""
+                    SELECT rid, ST_UpperLeftX(rast), ST_UpperLeftY(rast), ST_ScaleX(rast), ST_ScaleY(rast),
+                           ST_DumpValues(rast, 1)
+                    FROM altimetry_dem WHERE rid = ANY(%s)
+                """, [missing])
+                loaded = {rid: (x, y, scale_x, scale_y, np.array(values, dtype=float))
+                          for rid, x, y, scale_x, scale_y, values in cursor.fetchall()}
+                tiles.update(loaded)
+        with self.lock:
+            if missing and self.version == version:
+                self.tiles.update(loaded)
+            for rid in rids:
+                if rid in self.tiles:
+                    self.tiles.move_to_end(rid)
+            while len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+        return [tiles[rid] for rid in rids if rid in tiles]
+
+    def sample(self, xs, ys):
+        """ Values of pixels containing points of the grid xs * ys, as a (len(ys), len(xs)) array.
+        NaN outside DEM. """
+        grid = np.full((len(ys), len(xs)), np.nan)
+        for x0, y0, scale_x, scale_y, values in self.get_tiles((xs.min(), ys.min(), xs.max(), ys.max())):
+            height, width = values.shape
+            columns = np.floor((xs - x0) / scale_x).astype(int)
+            rows = np.floor((ys - y0) / scale_y).astype(int)
+            in_columns = (columns >= 0) & (columns < width)
+            in_rows = (rows >= 0) & (rows < height)
+            if not in_columns.any() or not in_rows.any():
+                continue
+            index = np.ix_(in_rows, in_columns)
+            grid[index] = np.where(np.isnan(grid[index]),
+                                   values[np.ix_(rows[in_rows], columns[in_columns])],
+                                   grid[index])
+        return grid
+
+
+dem_tiles = DemTiles()
+
+
 class AltimetryHelper:
     @classmethod
     def elevation_profile(cls, geometry3d, precision=None, offset=0):
@@ -20,36 +94,50 @@ class AltimetryHelper:
 
         :precision:  geometry sampling in meters
         """
-        precision = precision or settings.ALTIMETRIC_PROFILE_PRECISION
-
-        if geometry3d.geom_type == 'Point':
-            return [[0, geometry3d.x, geometry3d.y, geometry3d.z]]
-
-        if geometry3d.geom_type == 'MultiLineString':
-            profile = []
-            for subcoords in geometry3d.coords:
-                subline = LineString(subcoords, srid=geometry3d.srid)
-                offset += subline.length
-                subprofile = AltimetryHelper.elevation_profile(subline, precision, offset)
-                profile.extend(subprofile)
-            return profile
-
-        # Add measure to 2D version of geometry3d
-        # Get distance from origin for each vertex
-        sql = """
-        WITH line2d AS (SELECT ST_Force2D('%(ewkt)s'::geometry) AS geom),
-             line_measure AS (SELECT ST_Addmeasure(geom, 0, ST_length(geom)) AS geom FROM line2d),
-             points2dm AS (SELECT (ST_DumpPoints(geom)).geom AS point FROM line_measure)
-        SELECT (%(offset)s + ST_M(point)) FROM points2dm;
-        """ % {'offset': offset, 'ewkt': geometry3d.ewkt}
-        cursor = connection.cursor()
-        cursor.execute(sql)
-        pointsm = cursor.fetchall()
+        return cls.elevation_profiles([geometry3d], precision, offset)[0]
+
+    @classmethod
+    def elevation_profiles(cls, geometries3d, precision=None, offset=0):
+        """Extract elevation profiles from many 3D geometries at once.
+
+        Distances from origin are computed from the coordinates in memory, and
+        vertices of all geometries are transformed to API_SRID in a single call.
+
+        :precision:  geometry sampling in meters
+        """
+        profiles = [[] for geometry3d in geometries3d]
+        # Sub-lines of each geometry, with their offset
+        lines = []
+        for index, geometry3d in enumerate(geometries3d):
+            if geometry3d.geom_type == 'Point':
+                profiles[index] = [[0, geometry3d.x, geometry3d.y, geometry3d.z]]
+            elif geometry3d.geom_type == 'MultiLineString':
+                subline_offset = offset
+                for subcoords in geometry3d.coords:
+                    subline = LineString(subcoords, srid=geometry3d.srid)
+                    subline_offset += subline.length
+                    lines.append((index, subline_offset, subline))
+            else:
+                lines.append((index, offset, geometry3d))
+
+        # Transform all vertices of a same SRID at once
+        transformed = {}
+        for srid in {line.srid for index, line_offset, line in lines}:
+            coords = [xyz for index, line_offset, line in lines if line.srid == srid for xyz in line.coords]
+            transformed[srid] = iter(LineString(coords, srid=srid).transform(settings.API_SRID, clone=True).coords)
+
         # Join (offset+distance, x, y, z) together
-        geom3dapi = geometry3d.transform(settings.API_SRID, clone=True)
-        assert len(pointsm) == len(geom3dapi.coords), 'Cannot map distance to xyz'
-        dxyz = [pointsm[i] + v for i, v in enumerate(geom3dapi.coords)]
-        return dxyz
+        for index, line_offset, line in lines:
+            line_coords = line.coords
+            distances = accumulate(
+                (math.hypot(b[0] - a[0], b[1] - a[1]) for a, b in zip(line_coords, line_coords[1:])),
+                initial=0.0
+            )
+            profiles[index].extend(
+                (line_offset + distance, ) + tuple(xyz)
+                for distance, xyz in zip(distances, transformed[line.srid])
+            )
+        return profiles
 
     @classmethod
     def altimetry_limits(cls, profile):
@@ -139,74 +227,22 @@ class AltimetryHelper:
         if height < precision or width < precision:
             precision = min([height, width])
 
-        sql = """
-            -- Author: Celian Garcia
-            WITH columns AS (
-                    SELECT generate_series({xmin}::int, {xmax}::int, {precision}) AS x
-                ),
-                lines AS (
-                    SELECT generate_series({ymin}::int, {ymax}::int, {precision}) AS y
-                ),
-                resolution AS (
-                    SELECT x, y
-                    FROM (SELECT COUNT(x) AS x FROM columns) AS col,
-                         (SELECT COUNT(y) AS y FROM lines)   AS lin
-                ),
-                points2d AS (
-                    SELECT row_number() OVER (ORDER BY lines.y, columns.x) AS id,
-                           ST_SetSRID(ST_MakePoint(x, y), {srid}) AS geom,
-                           ST_Transform(ST_SetSRID(ST_MakePoint(x, y), {srid}), 4326) AS geomll
-                    FROM columns, lines
-                ),
-                draped AS (
-                    SELECT id, CASE WHEN ST_Value(altimetry_dem.rast, p.geom)::int = -99999 THEN 0 ELSE ST_Value(altimetry_dem.rast, p.geom)::int END AS altitude
-                    FROM altimetry_dem, points2d AS p
-                    WHERE ST_Intersects(altimetry_dem.rast, p.geom)
-                ),
-                all_draped AS (
-                    SELECT geomll, geom, altitude
-                    FROM points2d LEFT JOIN draped ON (points2d.id = draped.id)
-                    ORDER BY points2d.id
-                ),
-                extent_latlng AS (
-                    SELECT ST_Envelope(ST_Union(geom)) AS extent,
-                           MIN(altitude) AS min_z,
-                           MAX(altitude) AS max_z,
-                           AVG(altitude) AS center_z
-                    FROM all_draped
-                )
-            SELECT extent,
-                   ST_transform(extent, 4326),
-                   center_z,
-                   min_z,
-                   max_z,
-                   resolution.x AS resolution_w,
-                   resolution.y AS resolution_h,
-                   altitude
-            FROM extent_latlng, resolution, all_draped;
-        """.format(xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax,
-                   srid=settings.SRID, precision=precision)
-        cursor = connection.cursor()
-        cursor.execute(sql)
-        result = cursor.fetchall()
-        first = result[0]
-        envelop_native, envelop, center_z, min_z, max_z, resolution_w, resolution_h, a = first
-        envelop = GEOSGeometry(envelop, srid=4326)
-        envelop_native = GEOSGeometry(envelop_native, srid=settings.SRID)
-
-        if center_z is None:
+        xs = np.arange(xmin, xmax + 1, precision, dtype=float)
+        ys = np.arange(ymin, ymax + 1, precision, dtype=float)
+        # Rows from south to north, like ST_Value() rounded to integers
+        altitudes = np.rint(dem_tiles.sample(xs, ys))
+        altitudes[altitudes == -99999] = 0
+        draped = altitudes[~np.isnan(altitudes)]
+        if not draped.size:
             logger.warning("No DEM present")
             return {}
+        min_z, max_z, center_z = int(draped.min()), int(draped.max()), draped.mean()
+        resolution_h, resolution_w = altitudes.shape
 
-        altitudes = []
-        row = []
-        for i, record in enumerate(result):
-            if i > 0 and i % resolution_w == 0:
-                altitudes.append(row)
-                row = []
-            elevation = (record[7] or 0.0) - min_z
-            row.append(elevation)
-        altitudes.append(row)
+        envelop_native = Polygon.from_bbox((xs[0], ys[0], xs[-1], ys[-1]))
+        envelop_native.srid = settings.SRID
+        envelop = envelop_native.transform(4326, clone=True)
+        altitudes = (np.nan_to_num(altitudes, nan=0.0) - min_z).astype(int).tolist()
 
         area = {
             'center': {
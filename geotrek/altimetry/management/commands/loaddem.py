@@ -11,6 +11,7 @@ import tempfile
 
 from geotrek.altimetry.models import AltimetryMixin, Dem
 from geotrek.core.models import Topology
+from geotrek.common.versions import bump_versions
 
 
 class Command(BaseCommand):
@@ -103,6 +104,8 @@ class Command(BaseCommand):
             output.file.seek(0)
             for sql_line in output.file:
                 cur.execute(sql_line)
+        # Rows inserted by raw SQL do not send signals
+        bump_versions(Dem)
 
         output.close()
         if verbose:
@@ -115,8 +118,10 @@ class Command(BaseCommand):
                     if settings.TREKKING_TOPOLOGY_ENABLED:
                         if not issubclass(model, Topology):
                             model.objects.all().update(geom=F('geom'))
+                            bump_versions(model)
                     else:
                         model.objects.all().update(geom=F('geom'))
+                        bump_versions(model)
         return
 
     def call_command_system(self, cmd, **kwargs):
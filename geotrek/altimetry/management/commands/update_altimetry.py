@@ -0,0 +1,166 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+import os
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F
+
+from geotrek.altimetry.models import AltimetryMixin, Dem
+from geotrek.core.models import Path, Topology
+from geotrek.common.versions import bump_versions
+
+
+class Command(BaseCommand):
+    help = """Update altimetry of all 3D geometries from the DEM, by batches of objects lying on the same DEM tiles.
+Each batch is committed on its own, so that an interrupted update can be resumed with --resume."""
+    checkpoint_name = 'update_altimetry.json'
+
+    # Same computation as elevation_path_iu() and topology_elevation_iu() triggers,
+    # without updating geom, so that snapping, splitting and topologies triggers are not fired
+    drape_sql = """
+        UPDATE {table} o
+        SET geom_3d = e.draped, "length" = ST_3DLength(e.draped), slope = e.slope,
+            min_elevation = e.min_elevation, max_elevation = e.max_elevation,
+            ascent = e.positive_gain, descent = e.negative_gain
+        FROM {table} s, LATERAL ft_elevation_infos(s.geom, %s) e
+        WHERE s.{pk} = ANY(%s) AND o.{pk} = s.{pk}
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', dest='batch_size', type=int, default=100,
+                            help='Number of objects updated and committed at once')
+        parser.add_argument('--workers', dest='workers', type=int, default=1,
+                            help='Number of batches updated in parallel, each one with its own database connection')
+        parser.add_argument('--resume', action='store_true', dest='resume', default=False,
+                            help='Resume an interrupted update, without updating objects already done')
+
+    def get_models(self):
+        """ Models with a draped geometry, each table once. Paths first since topologies are built from them. """
+        models = []
+        for model in apps.get_models():
+            if not issubclass(model, AltimetryMixin) or 'geom' not in [field.name for field in model._meta.get_fields()]:
+                continue
+            model = model._meta.get_field('geom').model._meta.concrete_model
+            if model not in models:
+                models.append(model)
+        return sorted(models, key=lambda model: (model is not Path, model is not Topology))
+
+    def get_tiles_grid(self):
+        """ Origin and size of DEM tiles """
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT ST_UpperLeftX(rast), ST_UpperLeftY(rast),
+                       ST_Width(rast) * ST_ScaleX(rast), ST_Height(rast) * ST_ScaleY(rast)
+                FROM {table} LIMIT 1
+            """.format(table=Dem._meta.db_table))
+            grid = cursor.fetchone()
+        if not grid:
+            raise CommandError('No DEM loaded, use loaddem command first.')
+        return grid
+
+    def get_fingerprint(self):
+        """ Changes if DEM is loaded again """
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*), ST_Extent(ST_Envelope(rast))::text FROM {table}".format(
+                table=Dem._meta.db_table))
+            count, extent = cursor.fetchone()
+        return [count, extent, settings.ALTIMETRIC_PROFILE_STEP]
+
+    def read_checkpoint(self):
+        """ Returns pks of objects already updated by an interrupted run, by model """
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        if checkpoint.get('dem') != self.fingerprint:
+            return {}
+        return {label: set(pks) for label, pks in checkpoint.get('done', {}).items()}
+
+    def write_checkpoint(self, done):
+        with open(self.checkpoint_path + '.tmp', 'w') as f:
+            json.dump({'dem': self.fingerprint, 'done': {label: sorted(pks) for label, pks in done.items()}}, f)
+        os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
+
+    def get_batches(self, model, done):
+        """ Split objects in batches, objects being sorted by DEM tile of their centroid """
+        x0, y0, width, height = self.grid
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT {pk} FROM {table}
+                ORDER BY floor((ST_Y(ST_Centroid(geom)) - %s) / %s), floor((ST_X(ST_Centroid(geom)) - %s) / %s), {pk}
+            """.format(pk=model._meta.pk.column, table=model._meta.db_table), [y0, height, x0, width])
+            pks = [pk for pk, in cursor.fetchall() if pk not in done]
+        return [pks[i:i + self.batch_size] for i in range(0, len(pks), self.batch_size)]
+
+    def update_batch(self, model, pks):
+        """ Update altimetry of a batch of objects in its own transaction.
+        Returns number of draped points. """
+        table, pk = model._meta.db_table, model._meta.pk.column
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                if model is Topology and settings.TREKKING_TOPOLOGY_ENABLED:
+                    # Topologies are draped from their paths
+                    cursor.execute("SELECT update_geometry_of_topology(id) FROM unnest(%s::integer[]) AS id", [pks])
+                elif model in (Path, Topology):
+                    cursor.execute(self.drape_sql.format(table=table, pk=pk), [settings.ALTIMETRIC_PROFILE_STEP, pks])
+                else:
+                    model.objects.filter(pk__in=pks).update(geom=F('geom'))
+                bump_versions(model)
+                cursor.execute("SELECT COALESCE(SUM(ST_NPoints(geom_3d)), 0) FROM {table} WHERE {pk} = ANY(%s)".format(
+                    table=table, pk=pk), [pks])
+                return cursor.fetchone()[0]
+        finally:
+            if self.workers > 1:
+                # Each worker thread has its own connection
+                connection.close()
+
+    def update_model(self, model, done):
+        label = model._meta.label
+        done = done.setdefault(label, set())
+        batches = self.get_batches(model, done)
+        nb_objects = nb_points = 0
+        start = time.time()
+        executor = ThreadPoolExecutor(self.workers) if self.workers > 1 else None
+        if executor:
+            futures = {executor.submit(self.update_batch, model, batch): batch for batch in batches}
+            results = ((futures[future], future.result()) for future in as_completed(futures))
+        else:
+            results = ((batch, self.update_batch(model, batch)) for batch in batches)
+        try:
+            for i, (batch, points) in enumerate(results, 1):
+                done.update(batch)
+                self.write_checkpoint(self.done)
+                nb_objects += len(batch)
+                nb_points += points
+                if self.verbosity >= 2:
+                    self.stdout.write("{}: {}/{} batches".format(label, i, len(batches)))
+        finally:
+            if executor:
+                for future in futures:
+                    future.cancel()
+                executor.shutdown()
+        duration = max(time.time() - start, 0.001)
+        if self.verbosity >= 1:
+            self.stdout.write("{}: {} objects, {} points draped in {:.1f}s ({:.1f} objects/s, {:.0f} points/s)".format(
+                label, nb_objects, nb_points, duration, nb_objects / duration, nb_points / duration))
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        self.batch_size = options['batch_size']
+        self.workers = options['workers']
+        if self.batch_size < 1 or self.workers < 1:
+            raise CommandError('Batch size and number of workers must be positive.')
+        self.grid = self.get_tiles_grid()
+        self.fingerprint = self.get_fingerprint()
+        os.makedirs(settings.TMP_DIR, exist_ok=True)
+        self.checkpoint_path = os.path.join(settings.TMP_DIR, self.checkpoint_name)
+        self.done = self.read_checkpoint() if options['resume'] else {}
+        for model in self.get_models():
+            self.update_model(model, self.done)
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
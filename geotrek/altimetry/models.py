@@ -1,7 +1,10 @@
+import hashlib
+import json
 import os
 
 from django.conf import settings
 from django.contrib.gis.db import models
+from django.core.cache import caches
 from django.utils.translation import get_language, gettext_lazy as _
 from django.urls import reverse
 
@@ -9,6 +12,14 @@ from mapentity.helpers import is_file_uptodate, convertit_download, smart_urljoi
 from .helpers import AltimetryHelper
 
 
+def elevation_key(kind, geom_3d_hash, *parts):
+    """ Key of a value computed for a 3D geometry, valid as long as settings it depends on do not change """
+    depends = {name: getattr(settings, name) for name in dir(settings) if name.startswith('ALTIMETRIC_')}
+    depends['API_SRID'] = settings.API_SRID
+    stamp = hashlib.md5(json.dumps(depends, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return '_'.join(['altimetry', kind, stamp, str(geom_3d_hash), *map(str, parts)])
+
+
 class AltimetryMixin(models.Model):
     # Computed values (managed at DB-level with triggers)
     geom_3d = models.GeometryField(dim=3, srid=settings.SRID, spatial_index=False,
@@ -44,17 +55,102 @@ class AltimetryMixin(models.Model):
         self.slope = fromdb.slope
         return self
 
+    @property
+    def geom_3d_hash(self):
+        """ Content hash of the 3D geometry, computed values are stored under it """
+        if not self.geom_3d:
+            return None
+        return hashlib.md5(bytes(self.geom_3d.ewkb)).hexdigest()
+
+    def _get_elevation_data(self):
+        """ Profile and limits, read from persistent store or computed once per 3D geometry """
+        geom_3d_hash = self.geom_3d_hash
+        data = getattr(self, '_elevation_data', None)
+        if data and data['hash'] == geom_3d_hash:
+            return data
+        cache = caches['altimetry']
+        key = elevation_key('profile', geom_3d_hash)
+        # Nothing is stored without 3D geometry, it would be shared by all such objects
+        data = cache.get(key) if geom_3d_hash else None
+        if data is None:
+            data = self._elevation_data_of_profile(geom_3d_hash, AltimetryHelper.elevation_profile(self.geom_3d))
+            if geom_3d_hash:
+                cache.set(key, data)
+        self._elevation_data = data
+        return data
+
+    @staticmethod
+    def _elevation_data_of_profile(geom_3d_hash, profile):
+        return {
+            'hash': geom_3d_hash,
+            'profile': profile,
+            'limits': AltimetryHelper.altimetry_limits(profile),
+        }
+
+    @classmethod
+    def prefetch_elevation_data(cls, objects):
+        """ Read stored profiles of many objects at once, and compute missing ones
+        in a single batch (see ``AltimetryHelper.elevation_profiles``).
+        """
+        by_hash = {}
+        for obj in objects:
+            geom_3d_hash = obj.geom_3d_hash
+            if geom_3d_hash:
+                by_hash.setdefault(geom_3d_hash, []).append(obj)
+        if not by_hash:
+            return
+        cache = caches['altimetry']
+        keys = {geom_3d_hash: elevation_key('profile', geom_3d_hash) for geom_3d_hash in by_hash}
+        stored = cache.get_many(keys.values())
+        missing = [geom_3d_hash for geom_3d_hash, key in keys.items() if key not in stored]
+        if missing:
+            profiles = AltimetryHelper.elevation_profiles([by_hash[geom_3d_hash][0].geom_3d
+                                                           for geom_3d_hash in missing])
+            computed = {keys[geom_3d_hash]: cls._elevation_data_of_profile(geom_3d_hash, profile)
+                        for geom_3d_hash, profile in zip(missing, profiles)}
+            cache.set_many(computed)
+            stored.update(computed)
+        for geom_3d_hash, objs in by_hash.items():
+            for obj in objs:
+                obj._elevation_data = stored[keys[geom_3d_hash]]
+
     def get_elevation_profile(self):
-        return AltimetryHelper.elevation_profile(self.geom_3d)
+        return self._get_elevation_data()['profile']
 
     def get_elevation_area(self):
         return AltimetryHelper.elevation_area(self.geom)
 
     def get_elevation_limits(self):
-        return AltimetryHelper.altimetry_limits(self.get_elevation_profile())
+        return self._get_elevation_data()['limits']
 
     def get_elevation_profile_svg(self, language=None):
-        return AltimetryHelper.profile_svg(self.get_elevation_profile(), language)
+        geom_3d_hash = self.geom_3d_hash
+        if not geom_3d_hash:
+            return AltimetryHelper.profile_svg(self.get_elevation_profile(), language)
+        cache = caches['altimetry']
+        key = elevation_key('profile_svg', geom_3d_hash, language)
+        svg = cache.get(key)
+        if svg is None:
+            svg = AltimetryHelper.profile_svg(self.get_elevation_profile(), language)
+            cache.set(key, svg)
+        return svg
+
+    def refresh_elevation_profile(self):
+        """ Compute and store profile, limits and SVG charts for current 3D geometry.
+        Return False if they were already stored.
+        """
+        if not self.geom_3d:
+            return False
+        cache = caches['altimetry']
+        geom_3d_hash = self.geom_3d_hash
+        keys = [elevation_key('profile', geom_3d_hash)]
+        keys += [elevation_key('profile_svg', geom_3d_hash, language) for language in settings.MODELTRANSLATION_LANGUAGES]
+        if len(cache.get_many(keys)) == len(keys):
+            return False
+        self._get_elevation_data()
+        for language in settings.MODELTRANSLATION_LANGUAGES:
+            self.get_elevation_profile_svg(language)
+        return True
 
     def get_formatted_elevation_profile_and_limits(self, **kwargs):
         data = {}
@@ -63,14 +159,13 @@ class AltimetryMixin(models.Model):
         for step in elevation_profile:
             formatted = step[0], step[3], step[1:3]
             data.setdefault('profile', []).append(formatted)
-        data['limits'] = dict(zip(['ceil', 'floor'], AltimetryHelper.altimetry_limits(elevation_profile)))
+        data['limits'] = dict(zip(['ceil', 'floor'], self.get_elevation_limits()))
         return data
 
     def get_elevation_profile_and_limits(self, **kwargs):
         data = {}
-        elevation_profile = self.get_elevation_profile()
-        data['profile'] = elevation_profile
-        data['limits'] = dict(zip(['ceil', 'floor'], AltimetryHelper.altimetry_limits(elevation_profile)))
+        data['profile'] = self.get_elevation_profile()
+        data['limits'] = dict(zip(['ceil', 'floor'], self.get_elevation_limits()))
         return data
 
     def get_elevation_chart_url(self, language=None):
@@ -105,9 +200,15 @@ class AltimetryMixin(models.Model):
         """
         from .views import HttpSVGResponse
         path = self.get_elevation_chart_path(language)
-        # Do nothing if image is up-to-date
+        # Do nothing if image is up-to-date, or was rendered for the same 3D geometry
         if is_file_uptodate(path, self.date_update):
             return False
+        cache = caches['altimetry']
+        key = f"altimetry_profile_png_{self._meta.model_name}_{self.pk}_{language}"
+        geom_3d_hash = self.geom_3d_hash
+        rendered = elevation_key('profile_svg', geom_3d_hash, language)
+        if geom_3d_hash and os.path.exists(path) and cache.get(key) == rendered:
+            return False
         # Download converted chart as png using convertit
         source = smart_urljoin(rooturl, self.get_elevation_chart_url(language))
         convertit_download(source,
@@ -115,6 +216,8 @@ class AltimetryMixin(models.Model):
                            from_type=HttpSVGResponse.content_type,
                            to_type='image/png',
                            headers={'Accept-Language': language})
+        if geom_3d_hash:
+            cache.set(key, rendered)
         return True
 
 
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from geotrek.altimetry.models import AltimetryMixin
+from geotrek.altimetry.tasks import refresh_elevation_profile
+
+
+@receiver(post_save)
+def refresh_object_elevation_profile(sender, instance, update_fields=None, **kwargs):
+    """ after each creation / edition of geometry, refresh stored elevation profile in background """
+    if not settings.ALTIMETRIC_PROFILE_PRECOMPUTE or not isinstance(instance, AltimetryMixin):
+        return
+    if update_fields and not {'geom', 'geom_3d'} & set(update_fields):
+        return
+    app_label, model_name, pk = instance._meta.app_label, instance._meta.model_name, instance.pk
+    transaction.on_commit(lambda: refresh_elevation_profile.delay(app_label, model_name, pk))
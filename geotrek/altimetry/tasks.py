@@ -0,0 +1,14 @@
+from celery import shared_task
+from django.apps import apps
+
+
+@shared_task(name='geotrek.altimetry.refresh-elevation-profile')
+def refresh_elevation_profile(app_label, model_name, pk):
+    """
+    celery shared task - compute and store elevation profile and charts of an object
+    """
+    model = apps.get_model(app_label, model_name)
+    obj = model.objects.filter(pk=pk).first()
+    if obj is None:
+        return False
+    return obj.refresh_elevation_profile()
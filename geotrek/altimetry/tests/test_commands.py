@@ -139,3 +139,51 @@ class CommandLoadDemTest(TransactionTestCase):
         dems = Dem.objects.all().annotate(int=RasterValue('rast', Point(x=605600, y=6650000, srid=2154)))
         value = dems.first()
         self.assertAlmostEqual(value.int, 343.600006103516)
+
+
+class CommandUpdateAltimetryTest(TransactionTestCase):
+    """
+    Update altimetry command test
+    Use of TransactionTestCase since batches are committed by workers using their own connection.
+    """
+
+    def setUp(self):
+        self.filename = os.path.join(os.path.dirname(__file__), 'data', 'elevation.tif')
+
+    def test_fail_no_dem(self):
+        with self.assertRaisesRegex(CommandError, 'No DEM loaded, use loaddem command first.'):
+            call_command('update_altimetry', verbosity=0)
+
+    @skipIf(not settings.TREKKING_TOPOLOGY_ENABLED, 'Test with dynamic segmentation only')
+    def test_update_altimetry_ds(self):
+        path = PathFactory.create(geom=LineString((605600, 6650000), (605900, 6650010), srid=2154))
+        trek = TrekFactory.create(paths=[path], published=False)
+        call_command('loaddem', self.filename, verbosity=0)
+        output_stdout = StringIO()
+        call_command('update_altimetry', workers=2, batch_size=1, verbosity=1, stdout=output_stdout)
+        self.assertIn('core.Path: 1 objects', output_stdout.getvalue())
+        self.assertIn('objects/s', output_stdout.getvalue())
+        path = Path.objects.get(pk=path.pk)
+        self.assertAlmostEqual(path.geom_3d.coords[-1][-1], 188)
+        trek = Trek.objects.get(pk=trek.pk)
+        self.assertAlmostEqual(trek.geom_3d.coords[-1][-1], 188)
+        self.assertFalse(os.path.exists(os.path.join(settings.TMP_DIR, 'update_altimetry.json')))
+
+    @skipIf(settings.TREKKING_TOPOLOGY_ENABLED, 'Test without dynamic segmentation only')
+    def test_update_altimetry_nds(self):
+        trek = TrekFactory.create(geom=LineString((605600, 6650000), (605900, 6650010), srid=2154))
+        call_command('loaddem', self.filename, verbosity=0)
+        call_command('update_altimetry', workers=2, verbosity=0)
+        trek = Trek.objects.get(pk=trek.pk)
+        self.assertAlmostEqual(trek.geom_3d.coords[-1][-1], 188)
+
+    @skipIf(not settings.TREKKING_TOPOLOGY_ENABLED, 'Test with dynamic segmentation only')
+    def test_update_altimetry_resume(self):
+        path = PathFactory.create(geom=LineString((605600, 6650000), (605900, 6650010), srid=2154))
+        call_command('loaddem', self.filename, verbosity=0)
+        # Path already updated by an interrupted run
+        with mock.patch('geotrek.altimetry.management.commands.update_altimetry.Command.read_checkpoint',
+                        return_value={'core.Path': {path.pk}}):
+            call_command('update_altimetry', resume=True, verbosity=0)
+        path = Path.objects.get(pk=path.pk)
+        self.assertNotAlmostEqual(path.geom_3d.coords[-1][-1], 188)
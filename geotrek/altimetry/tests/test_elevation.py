@@ -1,14 +1,19 @@
 from django.conf import settings
-from django.test import TestCase
-from unittest import SkipTest, skipIf
+from django.test import TestCase, override_settings
+from unittest import SkipTest, skipIf, mock
 
+from django.core.cache import caches
 from django.db import connection
 from django.contrib.gis.geos import MultiLineString, LineString, Point
 from django.utils import translation
 
+import numpy as np
+
 from geotrek.core.models import Path, Topology
 from geotrek.core.tests.factories import TopologyFactory
-from geotrek.altimetry.helpers import AltimetryHelper
+from geotrek.altimetry.helpers import AltimetryHelper, DemTiles
+from geotrek.altimetry.models import elevation_key
+from geotrek.altimetry.tasks import refresh_elevation_profile
 
 
 class ElevationTest(TestCase):
@@ -95,6 +100,83 @@ class ElevationTest(TestCase):
         self.assertEqual(topo.min_elevation, 15)
         self.assertEqual(topo.max_elevation, 15)
 
+    @skipIf(not settings.TREKKING_TOPOLOGY_ENABLED, 'Test with dynamic segmentation only')
+    def test_elevation_profile_stored_by_geometry(self):
+        profile = self.path.get_elevation_profile()
+        other = Path.objects.get(pk=self.path.pk)
+        with mock.patch('geotrek.altimetry.helpers.AltimetryHelper.elevation_profile') as mocked:
+            self.assertEqual(other.get_elevation_profile(), profile)
+            self.assertEqual(other.get_elevation_limits(), (1106, -94))
+            other.get_elevation_profile_svg('en')
+            other.get_elevation_profile_svg('en')
+        mocked.assert_not_called()
+
+    @skipIf(not settings.TREKKING_TOPOLOGY_ENABLED, 'Test with dynamic segmentation only')
+    def test_prefetch_elevation_data(self):
+        other_path = Path.objects.create(geom=LineString((78, 110), (3, 17)))
+        paths = list(Path.objects.filter(pk__in=[self.path.pk, other_path.pk]))
+        with mock.patch('geotrek.altimetry.helpers.AltimetryHelper.elevation_profiles',
+                        wraps=AltimetryHelper.elevation_profiles) as mocked:
+            Path.prefetch_elevation_data(paths)
+            Path.prefetch_elevation_data(Path.objects.filter(pk__in=[self.path.pk, other_path.pk]))
+        mocked.assert_called_once()
+        for path in paths:
+            expected = AltimetryHelper.elevation_profile(path.geom_3d)
+            with mock.patch('geotrek.altimetry.helpers.AltimetryHelper.elevation_profile') as mocked_profile:
+                self.assertEqual(path.get_elevation_profile(), expected)
+            mocked_profile.assert_not_called()
+
+    @mock.patch('geotrek.altimetry.helpers.AltimetryHelper.profile_svg', return_value='<svg/>')
+    @mock.patch('geotrek.altimetry.helpers.AltimetryHelper.elevation_profile', return_value=[[0, 0, 0, 10]])
+    def test_elevation_profile_not_stored_without_3d_geometry(self, mocked_profile, mocked_svg):
+        path = Path(geom=LineString((78, 117), (3, 17)))
+        self.assertIsNone(path.geom_3d_hash)
+        self.assertEqual(path.get_elevation_profile(), [[0, 0, 0, 10]])
+        self.assertEqual(path.get_elevation_profile_svg('en'), '<svg/>')
+        cache = caches['altimetry']
+        self.assertIsNone(cache.get(elevation_key('profile', None)))
+        self.assertIsNone(cache.get(elevation_key('profile_svg', None, 'en')))
+
+    @skipIf(not settings.TREKKING_TOPOLOGY_ENABLED, 'Test with dynamic segmentation only')
+    def test_refresh_elevation_profile_task(self):
+        path = Path.objects.create(geom=LineString((78, 110), (3, 17)))
+        self.assertTrue(refresh_elevation_profile('core', 'path', path.pk))
+        self.assertFalse(refresh_elevation_profile('core', 'path', path.pk))
+        self.assertFalse(refresh_elevation_profile('core', 'path', 0))
+
+    @skipIf(not settings.TREKKING_TOPOLOGY_ENABLED, 'Test with dynamic segmentation only')
+    def test_refresh_elevation_profile_missing_chart(self):
+        path = Path.objects.create(geom=LineString((78, 100), (3, 17)))
+        self.assertTrue(path.refresh_elevation_profile())
+        caches['altimetry'].delete(elevation_key('profile_svg', path.geom_3d_hash, settings.MODELTRANSLATION_LANGUAGES[-1]))
+        self.assertTrue(path.refresh_elevation_profile())
+        self.assertFalse(path.refresh_elevation_profile())
+
+    @skipIf(not settings.TREKKING_TOPOLOGY_ENABLED, 'Test with dynamic segmentation only')
+    def test_elevation_chart_stored_by_settings(self):
+        path = Path.objects.get(pk=self.path.pk)
+        svg = path.get_elevation_profile_svg('en')
+        with override_settings(ALTIMETRIC_PROFILE_COLOR='#000000'):
+            other_svg = Path.objects.get(pk=self.path.pk).get_elevation_profile_svg('en')
+        self.assertNotEqual(svg, other_svg)
+        self.assertIn(b'#000000', other_svg)
+
+    @skipIf(not settings.TREKKING_TOPOLOGY_ENABLED, 'Test with dynamic segmentation only')
+    @override_settings(ALTIMETRIC_PROFILE_PRECOMPUTE=True)
+    @mock.patch('geotrek.altimetry.signals.refresh_elevation_profile.delay')
+    def test_refresh_elevation_profile_on_save(self, mocked):
+        with self.captureOnCommitCallbacks(execute=True):
+            path = Path.objects.create(geom=LineString((78, 105), (3, 17)))
+        mocked.assert_called_with('core', 'path', path.pk)
+
+    def test_dem_tiles_dropped_when_dem_changes(self):
+        tiles = DemTiles()
+        xs, ys = np.array([12.5]), np.array([112.5])
+        self.assertEqual(tiles.sample(xs, ys)[0][0], 0)
+        with connection.cursor() as cur:
+            cur.execute('UPDATE altimetry_dem SET rast = ST_SetValue(rast, 1, 1, 100::float)')
+        self.assertEqual(tiles.sample(xs, ys)[0][0], 100)
+
     def test_elevation_topology_outside_dem(self):
         if settings.TREKKING_TOPOLOGY_ENABLED:
             outside_path = Path.objects.create(geom=LineString((200, 200), (300, 300)))
@@ -117,6 +199,30 @@ class ElevationProfileTest(TestCase):
         profile = AltimetryHelper.elevation_profile(geom)
         self.assertEqual(len(profile), 4)
 
+    def test_elevation_profile_distances(self):
+        geom = LineString((0, 0, 8), (3, 4, 10), (3, 10, 12), srid=settings.SRID)
+        profile = AltimetryHelper.elevation_profile(geom)
+        self.assertEqual([round(step[0], 6) for step in profile], [0, 5, 11])
+        self.assertEqual([step[3] for step in profile], [8, 10, 12])
+        api_coords = geom.transform(settings.API_SRID, clone=True).coords
+        for step, coords in zip(profile, api_coords):
+            self.assertAlmostEqual(step[1], coords[0])
+            self.assertAlmostEqual(step[2], coords[1])
+
+    def test_elevation_profiles_batch(self):
+        geoms = [
+            LineString((1.5, 2.5, 8), (2.5, 2.5, 10), srid=settings.SRID),
+            Point(1.5, 2.5, 8, srid=settings.SRID),
+            MultiLineString(LineString((1.5, 2.5, 8), (2.5, 2.5, 10)),
+                            LineString((2.5, 2.5, 6), (2.5, 0, 7)),
+                            srid=settings.SRID),
+        ]
+        profiles = AltimetryHelper.elevation_profiles(geoms)
+        self.assertEqual(len(profiles), 3)
+        for geom, profile in zip(geoms, profiles):
+            self.assertEqual(profile, AltimetryHelper.elevation_profile(geom))
+        self.assertEqual([step[0] for step in profiles[2]], [1, 2, 3.5, 6])
+
     def test_elevation_profile_point(self):
         geom = Point(1.5, 2.5, 8, srid=settings.SRID)
 
@@ -159,6 +265,12 @@ class ElevationAreaTest(TestCase):
         cls.geom = LineString((100, 370), (1100, 370), srid=settings.SRID)
         cls.area = AltimetryHelper.elevation_area(cls.geom)
 
+    def test_area_tiles_are_cached(self):
+        # Only intersecting tiles are looked up, their values were read for setUpTestData
+        with self.assertNumQueries(1):
+            area = AltimetryHelper.elevation_area(self.geom)
+        self.assertEqual(area, self.area)
+
     def test_area_has_nice_ratio_if_horizontal(self):
         self.assertEqual(self.area['size']['x'], 1300.0)
         self.assertEqual(self.area['size']['y'], 800.0)
@@ -52,8 +52,8 @@ class ProfileCacheTests(TestCase):
         cls.trek = TrekFactory.create(paths=[cls.path])
 
     def test_cache_is_used_when_getting_trek_profile(self):
-        # There are 6 queries to get trek profile
-        with self.assertNumQueries(6):
+        # There are 5 queries to get trek profile
+        with self.assertNumQueries(5):
             response = self.client.get(f"/api/fr/treks/{self.trek.pk}/profile.json")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['Content-Type'], 'application/json')
@@ -64,8 +64,8 @@ class ProfileCacheTests(TestCase):
         self.assertEqual(response['Content-Type'], 'application/json')
 
     def test_cache_is_used_when_getting_trek_profile_svg(self):
-        # There are 6 queries to get trek profile svg
-        with self.assertNumQueries(6):
+        # There are 5 queries to get trek profile svg
+        with self.assertNumQueries(5):
             response = self.client.get(f"/api/fr/treks/{self.trek.pk}/profile.svg")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['Content-Type'], 'image/svg+xml')
@@ -24,9 +24,10 @@ from geotrek.common import models as common_models
 from geotrek.flatpages.models import FlatPage
 from geotrek.tourism import models as tourism_models
 from geotrek.trekking import models as trekking_models
+from geotrek.api.mobile.bundles import TrekBundle, trek_sources
 from geotrek.api.mobile.views.trekking import TrekViewSet
 from geotrek.api.mobile.views.common import FlatPageViewSet, SettingsView
-from geotrek.common.helpers_sync import ZipTilesBuilder
+from geotrek.common.helpers_sync import ManifestZipFile, SyncManifest, TilesStore, close_zips, environment_stamps
 # Register mapentity models
 from geotrek.trekking import urls  # NOQA
 from geotrek.tourism import urls  # NOQA
@@ -36,6 +37,9 @@ logger = logging.getLogger(__name__)
 
 
 class Command(BaseCommand):
+    # Options that must not change to reuse files of previous synchronization
+    sync_options = ('path', 'languages', 'portal', 'skip_tiles', 'url', 'indent')
+
     def add_arguments(self, parser):
         parser.add_argument('path')
         parser.add_argument('--empty-tmp-folder', dest='empty_tmp_folder', action='store_true', default=False,
@@ -53,12 +57,7 @@ class Command(BaseCommand):
         if not os.path.exists(dirname):
             os.makedirs(dirname)
 
-    def sync_view(self, lang, view, name, url='/', params=None, headers={}, zipfile=None, fix2028=False, **kwargs):
-        if self.verbosity == 2:
-            self.stdout.write("\x1b[36m{lang}\x1b[0m \x1b[1m{name}\x1b[0m ...".format(lang=lang, name=name), ending="")
-            self.stdout._out.flush()
-        fullname = os.path.join(self.tmp_root, name)
-        self.mkdirs(fullname)
+    def render_view(self, lang, view, url='/', params=None, headers={}, fix2028=False, **kwargs):
         request = self.factory.get(url, params, **headers)
         request.LANGUAGE_CODE = lang
         request.user = AnonymousUser()
@@ -70,13 +69,12 @@ class Command(BaseCommand):
             self.successfull = False
             if self.verbosity == 2:
                 self.stdout.write("\x1b[3D\x1b[31mfailed ({})\x1b[0m".format(e))
-            return
+            return None
         if response.status_code != 200:
             self.successfull = False
             if self.verbosity == 2:
                 self.stdout.write("\x1b[3D\x1b[31;1mfailed (HTTP {code})\x1b[0m".format(code=response.status_code))
-            return
-        f = open(fullname, 'wb')
+            return None
         if isinstance(response, StreamingHttpResponse):
             content = b''.join(response.streaming_content)
         else:
@@ -85,12 +83,36 @@ class Command(BaseCommand):
         if fix2028:
             content = content.replace(b'\\u2028', b'\\n')
             content = content.replace(b'\\u2029', b'\\n')
-        f.write(content)
-        f.close()
+        return content
+
+    def sync_view(self, lang, view, name, url='/', params=None, headers={}, zipfile=None, fix2028=False, sources=None,
+                  **kwargs):
+        """ Render view into file. If sources objects are given and did not change since previous
+        synchronization, previous file is reused without rendering the view.
+        """
+        if self.verbosity == 2:
+            self.stdout.write("\x1b[36m{lang}\x1b[0m \x1b[1m{name}\x1b[0m ...".format(lang=lang, name=name), ending="")
+            self.stdout._out.flush()
+        fullname = os.path.join(self.tmp_root, name)
+        self.mkdirs(fullname)
         oldfilename = os.path.join(self.dst_root, name)
+        if sources is not None and self.manifest.unchanged(name, sources) and os.path.isfile(oldfilename):
+            unchanged = True
+            self.manifest.reuse(name)
+        else:
+            content = self.render_view(lang, view, url=url, params=params, headers=headers, fix2028=fix2028, **kwargs)
+            if content is None:
+                return
+            with open(fullname, 'wb') as f:
+                f.write(content)
+            unchanged = self.manifest.add(name, content, sources)
+            if unchanged is None:
+                unchanged = os.path.isfile(oldfilename) and filecmp.cmp(fullname, oldfilename)
+            unchanged = unchanged and os.path.isfile(oldfilename)
         # If new file is identical to old one, don't recreate it. This will help backup
-        if os.path.isfile(oldfilename) and filecmp.cmp(fullname, oldfilename):
-            os.unlink(fullname)
+        if unchanged:
+            if os.path.isfile(fullname):
+                os.unlink(fullname)
             os.link(oldfilename, fullname)
             if self.verbosity == 2:
                 self.stdout.write("\x1b[3D\x1b[32munchanged\x1b[0m")
@@ -124,39 +146,39 @@ class Command(BaseCommand):
 
         self.sync_view(lang, view, name, params=params, headers=headers, zipfile=zipfile, fix2028=True, **kwargs)
 
-    def sync_trek_pois(self, lang, trek):
+    def sync_trek_pois(self, lang, trek, sources=None):
         params = {'format': 'geojson', 'root_pk': trek.pk}
         view = TrekViewSet.as_view({'get': 'pois'})
         name = os.path.join(lang, str(trek.pk), 'pois.geojson')
-        self.sync_view(lang, view, name, params=params, pk=trek.pk)
+        self.sync_view(lang, view, name, params=params, pk=trek.pk, sources=sources)
         # Sync POIs of children too
         for child in trek.children:
             name = os.path.join(lang, str(trek.pk), 'pois', '{}.geojson'.format(child.pk))
-            self.sync_view(lang, view, name, params=params, pk=child.pk)
+            self.sync_view(lang, view, name, params=params, pk=child.pk, sources=sources)
 
-    def sync_trek_touristic_contents(self, lang, trek):
+    def sync_trek_touristic_contents(self, lang, trek, sources=None):
         params = {'format': 'geojson', 'root_pk': trek.pk}
         if self.portal:
             params['portal'] = ','.join(self.portal)
         view = TrekViewSet.as_view({'get': 'touristic_contents'})
         name = os.path.join(lang, str(trek.pk), 'touristic_contents.geojson')
-        self.sync_view(lang, view, name, params=params, pk=trek.pk)
+        self.sync_view(lang, view, name, params=params, pk=trek.pk, sources=sources)
         # Sync contents of children too
         for child in trek.children:
             name = os.path.join(lang, str(trek.pk), 'touristic_contents', '{}.geojson'.format(child.pk))
-            self.sync_view(lang, view, name, params=params, pk=child.pk)
+            self.sync_view(lang, view, name, params=params, pk=child.pk, sources=sources)
 
-    def sync_trek_touristic_events(self, lang, trek):
+    def sync_trek_touristic_events(self, lang, trek, sources=None):
         params = {'format': 'geojson', 'root_pk': trek.pk}
         if self.portal:
             params['portal'] = ','.join(self.portal)
         view = TrekViewSet.as_view({'get': 'touristic_events'})
         name = os.path.join(lang, str(trek.pk), 'touristic_events.geojson')
-        self.sync_view(lang, view, name, params=params, pk=trek.pk)
+        self.sync_view(lang, view, name, params=params, pk=trek.pk, sources=sources)
         # Sync events of children too
         for child in trek.children:
             name = os.path.join(lang, str(trek.pk), 'touristic_events', '{}.geojson'.format(child.pk))
-            self.sync_view(lang, view, name, params=params, pk=child.pk)
+            self.sync_view(lang, view, name, params=params, pk=child.pk, sources=sources)
 
     def sync_file(self, name, src_root, url, directory='', zipfile=None):
         url = url.strip('/')
@@ -211,6 +233,12 @@ class Command(BaseCommand):
             self.stdout.write("\x1b[36m**\x1b[0m \x1b[1m{name}\x1b[0m ...".format(name=name), ending="")
             self.stdout._out.flush()
 
+        if isinstance(zipfile, ManifestZipFile):
+            uptodate = zipfile.close()
+            if self.verbosity == 2:
+                self.stdout.write("\x1b[3D\x1b[32m{}\x1b[0m".format("unchanged" if uptodate else "zipped"))
+            return
+
         oldzipfilename = os.path.join(self.dst_root, name)
         zipfilename = os.path.join(self.tmp_root, name)
         try:
@@ -254,17 +282,18 @@ class Command(BaseCommand):
             treks = treks.filter(Q(portal__name__in=self.portal) | Q(portal=None))
 
         for trek in treks:
+            sources = trek_sources(trek)
             self.sync_geojson(lang, TrekViewSet, '{pk}/trek.geojson'.format(pk=trek.pk), pk=trek.pk,
-                              type_view={'get': 'retrieve'})
-            self.sync_trek_pois(lang, trek)
-            self.sync_trek_touristic_contents(lang, trek)
-            self.sync_trek_touristic_events(lang, trek)
+                              type_view={'get': 'retrieve'}, sources=sources)
+            self.sync_trek_pois(lang, trek, sources=sources)
+            self.sync_trek_touristic_contents(lang, trek, sources=sources)
+            self.sync_trek_touristic_events(lang, trek, sources=sources)
             # Sync detail of children too
             for child in trek.children:
                 self.sync_geojson(
                     lang, TrekViewSet,
                     '{pk}/treks/{child_pk}.geojson'.format(pk=trek.pk, child_pk=child.pk),
-                    pk=child.pk, type_view={'get': 'retrieve'}, params={'root_pk': trek.pk},
+                    pk=child.pk, type_view={'get': 'retrieve'}, params={'root_pk': trek.pk}, sources=sources,
                 )
 
     def sync_settings_json(self, lang):
@@ -281,6 +310,8 @@ class Command(BaseCommand):
                     'infos': "{}".format(_("Medias syncing ..."))
                 }
             )
+        if not self.skip_tiles:
+            self.fetch_tiles()
         self.sync_global_media()
         self.sync_treks_media()
 
@@ -289,60 +320,63 @@ class Command(BaseCommand):
         zipname_trekid = os.path.join(url_trek, "{}.zip".format(trek.pk))
         zipfullname_trekid = os.path.join(self.tmp_root, zipname_trekid)
         self.mkdirs(zipfullname_trekid)
-        trekid_zipfile = ZipFile(zipfullname_trekid, 'w')
+        trekid_zipfile = ManifestZipFile(self.manifest, self.tmp_root, self.dst_root, zipname_trekid)
 
         if not self.skip_tiles:
             self.sync_trek_tiles(trek, trekid_zipfile)
 
-        for poi in trek.published_pois:
-            if poi.resized_pictures:
-                for picture, thdetail in poi.resized_pictures[:settings.MOBILE_NUMBER_PICTURES_SYNC]:
-                    self.sync_media_file(thdetail, prefix=trek.pk, directory=url_trek,
-                                         zipfile=trekid_zipfile)
-        for touristic_content in trek.published_touristic_contents:
-            if touristic_content.resized_pictures:
-                for picture, thdetail in touristic_content.resized_pictures[:settings.MOBILE_NUMBER_PICTURES_SYNC]:
-                    self.sync_media_file(thdetail, prefix=trek.pk, directory=url_trek,
-                                         zipfile=trekid_zipfile)
-        for touristic_event in trek.published_touristic_events:
-            if touristic_event.resized_pictures:
-                for picture, thdetail in touristic_event.resized_pictures[:settings.MOBILE_NUMBER_PICTURES_SYNC]:
-                    self.sync_media_file(thdetail, prefix=trek.pk, directory=url_trek,
-                                         zipfile=trekid_zipfile)
-        if trek.resized_pictures:
-            for picture, thdetail in trek.resized_pictures[:settings.MOBILE_NUMBER_PICTURES_SYNC]:
-                self.sync_media_file(thdetail, prefix=trek.pk, directory=url_trek,
-                                     zipfile=trekid_zipfile)
-        for desk in trek.information_desks.all():
-            if desk.resized_picture:
-                self.sync_media_file(desk.resized_picture, prefix=trek.pk, directory=url_trek,
-                                     zipfile=trekid_zipfile)
+        # Pictures of the trek, its POIs, touristic contents, events, information desks and children
+        with translation.override(self.languages[0]):
+            media = TrekBundle(trek, self.languages[0], portal=','.join(self.portal)).get('media')
+        url_media = '/{}{}'.format(trek.pk, settings.MEDIA_URL)
+        for name in media:
+            if not os.path.isfile(os.path.join(settings.MEDIA_ROOT, name)):
+                continue
+            self.sync_file(name, settings.MEDIA_ROOT, url_media, directory=url_trek, zipfile=trekid_zipfile)
         for lang in self.languages:
             trek.prepare_elevation_chart(lang, self.referer)
             url_media = '/{}{}'.format(trek.pk, settings.MEDIA_URL)
             self.sync_file(trek.get_elevation_chart_url_png(lang), settings.MEDIA_ROOT,
                            url_media, directory=url_trek, zipfile=trekid_zipfile)
-        # Sync media of children too
+        # Sync elevation charts of children too
         for child in trek.children:
-            for picture, resized in child.resized_pictures:
-                self.sync_media_file(resized, prefix=trek.pk, directory=url_trek, zipfile=trekid_zipfile)
-            for desk in child.information_desks.all():
-                self.sync_media_file(desk.resized_picture, prefix=trek.pk, directory=url_trek, zipfile=trekid_zipfile)
             for lang in self.languages:
                 child.prepare_elevation_chart(lang, self.referer)
                 url_media = '/{}{}'.format(trek.pk, settings.MEDIA_URL)
                 self.sync_file(child.get_elevation_chart_url_png(lang), settings.MEDIA_ROOT,
                                url_media, directory=url_trek, zipfile=trekid_zipfile)
 
-        self.close_zip(trekid_zipfile, zipname_trekid)
+        return trekid_zipfile
 
-    def sync_treks_media(self):
+    def get_treks(self):
         treks = trekking_models.Trek.objects.existing().filter(published=True).order_by('pk')
         if self.portal:
             treks = treks.filter(Q(portal__name__in=self.portal) | Q(portal=None))
+        return treks
 
+    def sync_treks_media(self):
+        zipnames = []
+        zipfiles = []
+        treks = list(self.get_treks())
+        # Profiles rendered by elevation charts, computed at once
+        trekking_models.Trek.prefetch_elevation_data(treks)
         for trek in treks:
-            self.sync_trek_by_pk_media(trek)
+            zipnames.append(os.path.join('nolang', "{}.zip".format(trek.pk)))
+            zipfiles.append(self.sync_trek_by_pk_media(trek))
+        # Zip files are written in parallel
+        uptodates = close_zips(zipfiles, TilesStore.workers)
+        if self.verbosity == 2:
+            for zipname, uptodate in zip(zipnames, uptodates):
+                self.stdout.write("\x1b[36m**\x1b[0m \x1b[1m{name}\x1b[0m ...\x1b[3D\x1b[32m{status}\x1b[0m".format(
+                    name=zipname, status="unchanged" if uptodate else "zipped"))
+
+    def fetch_tiles(self):
+        """ Download the union of global tiles and tiles of all treks, each one once """
+        global_extent = settings.LEAFLET_CONFIG['SPATIAL_EXTENT']
+        logger.info("Global extent is %s" % str(global_extent))
+        self.global_tiles = self.tiles_store.coverage(global_extent, settings.MOBILE_TILES_GLOBAL_ZOOMS)
+        self.treks_tiles = {trek.pk: self.tiles_store.trek_coverage(trek.geom) for trek in self.get_treks()}
+        self.tiles_store.fetch(self.global_tiles.union(*self.treks_tiles.values()))
 
     def sync_global_media(self):
         url_media_nolang = os.path.join('nolang')
@@ -375,51 +409,27 @@ class Command(BaseCommand):
         self.close_zip(self.zipfile_settings, zipname_settings)
 
     def sync_trek_tiles(self, trek, zipfile):
-        """ Add tiles to zipfile for the specified Trek object.
+        """ Add tiles to zipfile for the specified Trek object, from tiles store.
         """
 
         if self.verbosity == 2:
             self.stdout.write("\x1b[36m**\x1b[0m \x1b[1mnolang/{}/tiles/\x1b[0m ...".format(trek.pk), ending="")
             self.stdout._out.flush()
 
-        def _radius2bbox(lng, lat, radius):
-            return (lng - radius, lat - radius,
-                    lng + radius, lat + radius)
-
-        tiles = ZipTilesBuilder(zipfile, prefix='/{}/tiles/'.format(trek.pk), **self.builder_args)
-
-        geom = trek.geom
-        if geom.geom_type == 'MultiLineString':
-            geom = geom[0]  # FIXME
-        geom.transform(4326)
-
-        for (lng, lat) in geom.coords:
-            large = _radius2bbox(lng, lat, settings.MOBILE_TILES_RADIUS_LARGE)
-            small = _radius2bbox(lng, lat, settings.MOBILE_TILES_RADIUS_SMALL)
-            tiles.add_coverage(bbox=large, zoomlevels=settings.MOBILE_TILES_LOW_ZOOMS)
-            tiles.add_coverage(bbox=small, zoomlevels=settings.MOBILE_TILES_HIGH_ZOOMS)
-
-        tiles.run()
+        self.tiles_store.write(zipfile, self.treks_tiles[trek.pk], prefix='{}/tiles/'.format(trek.pk))
 
         if self.verbosity == 2:
             self.stdout.write("\x1b[3D\x1b[32mdownloaded\x1b[0m")
 
     def sync_global_tiles(self, zipfile):
-        """ Add tiles to zipfile on the global extent.
+        """ Add tiles to zipfile on the global extent, from tiles store.
         """
         if self.verbosity == 2:
             self.stdout.write("\x1b[36m**\x1b[0m \x1b[1mtiles/\x1b[0m ...", ending="")
             self.stdout._out.flush()
 
-        global_extent = settings.LEAFLET_CONFIG['SPATIAL_EXTENT']
-
-        logger.info("Global extent is %s" % str(global_extent))
         logger.info("Build global tiles file...")
-
-        tiles = ZipTilesBuilder(zipfile, prefix='tiles/', **self.builder_args)
-        tiles.add_coverage(bbox=global_extent,
-                           zoomlevels=settings.MOBILE_TILES_GLOBAL_ZOOMS)
-        tiles.run()
+        self.tiles_store.write(zipfile, self.global_tiles, prefix='tiles/')
 
         if self.verbosity == 2:
             self.stdout.write("\x1b[3D\x1b[32mdownloaded\x1b[0m")
@@ -454,7 +464,7 @@ class Command(BaseCommand):
         if not os.path.exists(self.dst_root):
             return
         existing = set([os.path.basename(p) for p in os.listdir(self.dst_root)])
-        remaining = existing - {'nolang'} - set(settings.MODELTRANSLATION_LANGUAGES)
+        remaining = existing - {'nolang', SyncManifest.filename} - set(settings.MODELTRANSLATION_LANGUAGES)
         if remaining:
             raise CommandError("Destination directory contains extra data")
 
@@ -486,6 +496,9 @@ class Command(BaseCommand):
         else:
             self.languages = settings.MODELTRANSLATION_LANGUAGES
         self.celery_task = options.get('task', None)
+        manifest_options = {name: options.get(name) for name in self.sync_options}
+        manifest_options['environment'] = environment_stamps()
+        self.manifest = SyncManifest(self.dst_root, manifest_options)
 
         if options['portal'] is not None:
             self.portal = options['portal'].split(',')
@@ -514,8 +527,10 @@ class Command(BaseCommand):
         if not os.path.exists(sync_mobile_tmp_dir):
             os.mkdir(sync_mobile_tmp_dir)
 
-        with tempfile.TemporaryDirectory(dir=sync_mobile_tmp_dir) as tmp_dir:
+        with tempfile.TemporaryDirectory(dir=sync_mobile_tmp_dir) as tmp_dir, \
+                tempfile.TemporaryDirectory(dir=sync_mobile_tmp_dir) as tiles_dir:
             self.tmp_root = tmp_dir
+            self.tiles_store = TilesStore(tiles_dir, **self.builder_args)
             self.sync()
             if self.celery_task:
                 self.celery_task.update_state(
@@ -527,6 +542,7 @@ class Command(BaseCommand):
                         'infos': "{}".format(_("Sync mobile ended"))
                     }
                 )
+            self.manifest.save(self.tmp_root)
             self.rename_root()
 
         done_message = 'Done'
@@ -0,0 +1,132 @@
+from django.conf import settings
+from django.contrib.gis.db.models.functions import Transform
+from django.core.cache import caches
+from django.db.models import F, Q
+
+from geotrek.api.mobile.serializers import trekking as api_serializers_trekking, tourism as api_serializers_tourism
+from geotrek.common.functions import StartPoint, EndPoint
+from geotrek.common.helpers_sync import SyncManifest
+from geotrek.common.models import Attachment
+from geotrek.common.versions import get_versions
+from geotrek.tourism import models as tourism_models
+from geotrek.trekking import models as trekking_models
+from geotrek.zoning.models import City, District, RestrictedArea
+
+
+def annotate_treks(queryset):
+    """ Geometries of treks as serialized by mobile API """
+    return queryset.annotate(geom2d_transformed=Transform(F('geom'), settings.API_SRID),
+                             start_point=Transform(StartPoint('geom'), settings.API_SRID),
+                             end_point=Transform(EndPoint('geom'), settings.API_SRID))
+
+
+def filter_portal(queryset, portal):
+    if portal:
+        queryset = queryset.filter(Q(portal__name__in=portal.split(',')) | Q(portal=None))
+    return queryset
+
+
+def get_sources(obj):
+    """ Objects whose updates imply to generate again files of given object """
+    sources = [obj]
+    if hasattr(obj, 'attachments'):
+        sources += list(obj.attachments.all())
+    return sources
+
+
+def trek_sources(trek):
+    """ Trek and related objects whose updates imply to generate again trek files """
+    sources = get_sources(trek)
+    for obj in trek.published_pois:
+        sources += get_sources(obj)
+    for obj in trek.published_touristic_contents:
+        sources += get_sources(obj)
+    for obj in trek.published_touristic_events:
+        sources += get_sources(obj)
+    for obj in trek.children:
+        sources += get_sources(obj)
+    sources += list(trek.information_desks.all())
+    return sources
+
+
+class TrekBundle:
+    """
+    Precomputed mobile API data of a trek in a language: detail, POIs, touristic contents
+    and events, and the list of media files they refer to.
+
+    Bundles are stored in the fat cache along with the state of tables they were built from.
+    While these tables do not change, a bundle is served as is. Otherwise, objects of the bundle
+    are looked up again, and the bundle is serialized again only if one of them changed.
+    Bundles which are not requested anymore (deleted treks, former portals) expire after timeout.
+    """
+    member_models = (trekking_models.Trek, trekking_models.POI, tourism_models.TouristicContent,
+                     tourism_models.TouristicEvent, tourism_models.InformationDesk, Attachment)
+    # Serialized through geometric lookups (cities, districts, departure city), not as sources
+    zone_models = (City, District, RestrictedArea)
+    timeout = 7 * 24 * 3600  # 7 days
+
+    def __init__(self, trek, lang, root_pk=None, portal=None):
+        self.trek = trek
+        self.lang = lang
+        self.root_pk = root_pk or trek.pk
+        self.portal = portal or ''
+
+    @property
+    def key(self):
+        return 'mobile_bundle_{}_{}_{}_{}'.format(self.trek.pk, self.lang, self.root_pk, self.portal)
+
+    @classmethod
+    def tables_version(cls):
+        """ Changes whenever an object which can be part of a bundle is added, modified or removed """
+        return get_versions(*cls.member_models, *cls.zone_models)
+
+    def sources_version(self):
+        """ Changes whenever an object of the bundle, or a zone, is added, modified or removed """
+        return '{}:{}'.format(SyncManifest.sources_key(trek_sources(self.trek)), get_versions(*self.zone_models))
+
+    def get(self, name):
+        cache = caches['fat']
+        tables = self.tables_version()
+        bundle = cache.get(self.key)
+        if bundle is None or bundle['tables'] != tables:
+            sources = self.sources_version()
+            if bundle is None or bundle['sources'] != sources:
+                bundle = self.build()
+                bundle['sources'] = sources
+            bundle['tables'] = tables
+            cache.set(self.key, bundle, self.timeout)
+        return bundle[name]
+
+    def build(self):
+        trek = self.trek
+        if not hasattr(trek, 'geom2d_transformed'):
+            trek = annotate_treks(trekking_models.Trek.objects.filter(pk=trek.pk)).get()
+        context = {'root_pk': self.root_pk}
+        pois = trek.pois.filter(published=True).select_related('topo_object', 'type', )\
+            .prefetch_related('topo_object__aggregations', 'attachments') \
+            .annotate(geom2d_transformed=Transform(F('geom'), settings.API_SRID)).order_by('pk')
+        contents = filter_portal(trek.touristic_contents.filter(published=True), self.portal)
+        contents = contents.prefetch_related('attachments') \
+            .annotate(geom2d_transformed=Transform(F('geom'), settings.API_SRID))
+        events = filter_portal(trek.trek.touristic_events.filter(published=True), self.portal)
+        events = events.prefetch_related('attachments') \
+            .annotate(geom2d_transformed=Transform(F('geom'), settings.API_SRID))
+        return {
+            'trek': api_serializers_trekking.TrekDetailSerializer(trek, context=context).data,
+            'pois': api_serializers_trekking.POIListSerializer(pois, many=True, context=context).data,
+            'touristic_contents': api_serializers_tourism.TouristicContentListSerializer(
+                contents, many=True, context=context).data,
+            'touristic_events': api_serializers_tourism.TouristicEventListSerializer(
+                events, many=True, context=context).data,
+            'media': self.media(trek, pois, contents, events),
+        }
+
+    def media(self, trek, pois, contents, events):
+        """ Names of media files referred to by the bundle, relative to MEDIA_ROOT """
+        names = []
+        for obj in [trek, *pois, *contents, *events, *trek.children]:
+            names += [resized.name for picture, resized in obj.resized_pictures[:settings.MOBILE_NUMBER_PICTURES_SYNC]]
+        for obj in [trek, *trek.children]:
+            names += [desk.resized_picture.name for desk in obj.information_desks.all()
+                      if desk.resized_picture and desk.resized_picture.name]
+        return list(dict.fromkeys(names))
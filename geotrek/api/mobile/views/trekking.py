@@ -1,12 +1,13 @@
 from django.conf import settings
 from django.contrib.gis.db.models.functions import Transform
-from django.db.models import Count, F, Q
+from django.db.models import Count, Q
 from django_filters.rest_framework.backends import DjangoFilterBackend
 from rest_framework import response, viewsets, decorators
 from rest_framework.permissions import AllowAny
 from rest_framework_extensions.mixins import DetailSerializerMixin
 
-from geotrek.api.mobile.serializers import trekking as api_serializers_trekking, tourism as api_serializers_tourism
+from geotrek.api.mobile.bundles import TrekBundle, annotate_treks
+from geotrek.api.mobile.serializers import trekking as api_serializers_trekking
 from geotrek.common.functions import StartPoint, EndPoint
 from geotrek.trekking import models as trekking_models
 
@@ -25,14 +26,15 @@ class TrekViewSet(DetailSerializerMixin, viewsets.ReadOnlyModelViewSet):
             .prefetch_related('topo_object__aggregations', 'attachments') \
             .order_by('pk')
         if self.action != 'list':
-            queryset = queryset.annotate(geom2d_transformed=Transform(F('geom'), settings.API_SRID))
+            queryset = annotate_treks(queryset)
         else:
             queryset = queryset.annotate(count_parents=Count('trek_parents')).\
-                exclude(Q(count_parents__gt=0) & Q(published=False))
+                exclude(Q(count_parents__gt=0) & Q(published=False)).\
+                annotate(start_point=Transform(StartPoint('geom'), settings.API_SRID),
+                         end_point=Transform(EndPoint('geom'), settings.API_SRID))
         if 'portal' in self.request.GET:
             queryset = queryset.filter(Q(portal__name=self.request.GET['portal']) | Q(portal=None))
-        return queryset.annotate(start_point=Transform(StartPoint('geom'), settings.API_SRID),
-                                 end_point=Transform(EndPoint('geom'), settings.API_SRID)). \
+        return queryset. \
             filter(Q(**{'published_{lang}'.format(lang=lang): True})
                    | Q(**{'trek_parents__parent__published_{lang}'.format(lang=lang): True,
                           'trek_parents__parent__deleted': False})).distinct()
@@ -40,34 +42,22 @@ class TrekViewSet(DetailSerializerMixin, viewsets.ReadOnlyModelViewSet):
     def get_serializer_context(self):
         return {'root_pk': self.request.GET.get('root_pk')}
 
+    def get_bundle(self):
+        """ Precomputed detail, POIs, touristic contents and events of the trek """
+        return TrekBundle(self.get_object(), self.request.LANGUAGE_CODE, root_pk=self.request.GET.get('root_pk'),
+                          portal=self.request.GET.get('portal'))
+
+    def retrieve(self, request, *args, **kwargs):
+        return response.Response(self.get_bundle().get('trek'))
+
     @decorators.action(detail=True, methods=['get'])
     def pois(self, request, *args, **kwargs):
-        trek = self.get_object()
-        root_pk = self.request.GET.get('root_pk') or trek.pk
-        qs = trek.pois.filter(published=True).select_related('topo_object', 'type', )\
-            .prefetch_related('topo_object__aggregations', 'attachments') \
-            .annotate(geom2d_transformed=Transform(F('geom'), settings.API_SRID)).order_by('pk')
-        data = api_serializers_trekking.POIListSerializer(qs, many=True, context={'root_pk': root_pk}).data
-        return response.Response(data)
+        return response.Response(self.get_bundle().get('pois'))
 
     @decorators.action(detail=True, methods=['get'])
     def touristic_contents(self, request, *args, **kwargs):
-        trek = self.get_object()
-        root_pk = self.request.GET.get('root_pk') or trek.pk
-        qs = trek.touristic_contents.filter(published=True)
-        if 'portal' in self.request.GET:
-            qs = qs.filter(Q(portal__name__in=self.request.GET['portal'].split(',')) | Q(portal=None))
-        qs = qs.prefetch_related('attachments').annotate(geom2d_transformed=Transform(F('geom'), settings.API_SRID))
-        data = api_serializers_tourism.TouristicContentListSerializer(qs, many=True, context={'root_pk': root_pk}).data
-        return response.Response(data)
+        return response.Response(self.get_bundle().get('touristic_contents'))
 
     @decorators.action(detail=True, methods=['get'])
     def touristic_events(self, request, *args, **kwargs):
-        trek = self.get_object()
-        root_pk = self.request.GET.get('root_pk') or trek.pk
-        qs = trek.trek.touristic_events.filter(published=True)
-        if 'portal' in self.request.GET:
-            qs = qs.filter(Q(portal__name__in=self.request.GET['portal'].split(',')) | Q(portal=None))
-        qs = qs.prefetch_related('attachments').annotate(geom2d_transformed=Transform(F('geom'), settings.API_SRID))
-        data = api_serializers_tourism.TouristicEventListSerializer(qs, many=True, context={'root_pk': root_pk}).data
-        return response.Response(data)
+        return response.Response(self.get_bundle().get('touristic_events'))
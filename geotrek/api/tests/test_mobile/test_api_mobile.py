@@ -2,7 +2,9 @@ from django.conf import settings
 from django.urls import reverse
 from django.test.testcases import TestCase
 from django.contrib.gis.geos import Point, MultiPoint, MultiPolygon, Polygon
+from unittest import mock
 
+from geotrek.api.mobile.bundles import TrekBundle
 from geotrek.trekking.tests import factories as trek_factory
 from geotrek.trekking import models as trek_models
 from geotrek.tourism.tests import factories as tourism_factory
@@ -362,6 +364,37 @@ class APIAccessTestCase(BaseApiTest):
         self.assertEqual(json_response.get('features')[0].get('properties')['description'],
                          "Sisi")
 
+    def test_poi_list_bundle_rebuilt_when_poi_changes(self):
+        poi = self.trek.published_pois.first()
+        response = self.get_poi_list(self.trek.pk, 'fr')
+        self.assertIn(poi.name_fr, [feature['properties']['name'] for feature in response.json()['features']])
+        poi.name_fr = 'Renamed'
+        poi.save()
+        response = self.get_poi_list(self.trek.pk, 'fr')
+        self.assertIn('Renamed', [feature['properties']['name'] for feature in response.json()['features']])
+
+    def test_bundle_not_serialized_again_when_unrelated_objects_change(self):
+        bundle = TrekBundle(self.trek, 'fr')
+        bundle.get('pois')
+        tourism_factory.InformationDeskFactory()
+        with mock.patch.object(TrekBundle, 'build') as build:
+            self.assertEqual(len(bundle.get('pois')['features']), self.trek.published_pois.count())
+        build.assert_not_called()
+
+    def test_bundle_serialized_again_when_city_changes(self):
+        bundle = TrekBundle(self.trek, 'fr')
+        self.assertIn(self.city.code, list(bundle.get('trek')['properties']['cities']))
+        self.city.published = False
+        self.city.save()
+        self.assertNotIn(self.city.code, list(bundle.get('trek')['properties']['cities']))
+
+    def test_bundle_stored_with_timeout(self):
+        with mock.patch('geotrek.api.mobile.bundles.caches') as mock_caches:
+            mock_caches.__getitem__.return_value.get.return_value = None
+            TrekBundle(self.trek, 'fr').get('pois')
+        key, bundle, timeout = mock_caches.__getitem__.return_value.set.call_args[0]
+        self.assertEqual(timeout, TrekBundle.timeout)
+
 
 class APISwaggerTestCase(BaseApiTest):
     """
@@ -1,10 +1,12 @@
 import datetime
 import json
+from io import BytesIO
 from unittest import skipIf
 
+import numpy as np
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
-from django.contrib.gis.geos import (LineString, MultiLineString, MultiPoint,
+from django.contrib.gis.geos import (LineString, MultiLineString, MultiPoint, MultiPolygon,
                                      Point, Polygon)
 from django.contrib.gis.geos.collections import GeometryCollection
 from django.db import connection
@@ -17,6 +19,7 @@ from mapentity.tests.factories import SuperUserFactory
 from rest_framework.test import APITestCase
 
 from geotrek import __version__
+from geotrek.api.v2.utils import absolute_images
 from geotrek.authent import models as authent_models
 from geotrek.authent.tests import factories as authent_factory
 from geotrek.common import models as common_models
@@ -1244,6 +1247,26 @@ class APIAccessAnonymousTestCase(BaseApiTest):
         self.assertEqual(response.json()['results'][0]['pdf'],
                          f'http://testserver/api/en/treks/{self.child2.pk}/child-2.pdf')
 
+    def test_trek_detail_description_absolute_images(self):
+        response = self.get_trek_detail(self.parent.id, {'language': 'en'})
+        self.assertEqual(response.json()['description'],
+                         '<p>Description</p>'
+                         '<img src="http://testserver/media/upload/steep_descent.svg" alt="Descent">'
+                         '<img src="https://testserver/media/upload/pedestre.svg" alt="" width="1848" height="1848">')
+        response = self.get_trek_detail(self.parent.id)
+        self.assertIn('<img src="http://testserver/media/upload/steep_descent.svg" alt="Descent">',
+                      response.json()['description']['en'])
+
+    def test_protocol_relative_images_not_rewritten(self):
+        html = '<p>Map</p><img src="//cdn.example.com/map.png"><img src="/media/map.png">'
+        self.assertEqual(absolute_images(html, 'http://testserver'),
+                         '<p>Map</p><img src="//cdn.example.com/map.png"><img src="http://testserver/media/map.png">')
+
+    def test_images_other_attributes_left_as_written(self):
+        html = '<img alt="l\'é" title=\'Say "hi"\' src=\'/media/map.png?a=1&amp;b=2\' width=10>'
+        self.assertEqual(absolute_images(html, 'http://testserver'),
+                         '<img alt="l\'é" title=\'Say "hi"\' src=\'http://testserver/media/map.png?a=1&amp;b=2\' width=10>')
+
     def test_difficulty_list(self):
         response = self.get_difficulties_list()
         self.assertEqual(response.status_code, 200)
@@ -4283,13 +4306,13 @@ class AltimetryCacheTests(BaseApiTest):
 
     @skipIf(not settings.TREKKING_TOPOLOGY_ENABLED, 'Test with dynamic segmentation only')
     def test_cache_is_used_when_getting_trek_DEM(self):
-        # There are 9 queries to get trek DEM
-        with self.assertNumQueries(10):
+        # There are 17 queries to get trek DEM, 2 of them to read DEM tiles, 7 for the cache key
+        with self.assertNumQueries(17):
             response = self.client.get(reverse('apiv2:trek-dem', args=(self.trek.pk,)))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['Content-Type'], 'application/json')
-        # When cache is used there is single query to get trek DEM
-        with self.assertNumQueries(1):
+        # When cache is used there are only queries for the cache key, within test transaction
+        with self.assertNumQueries(7):
             response = self.client.get(reverse('apiv2:trek-dem', args=(self.trek.pk,)))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['Content-Type'], 'application/json')
@@ -4297,39 +4320,49 @@ class AltimetryCacheTests(BaseApiTest):
     @skipIf(settings.TREKKING_TOPOLOGY_ENABLED, 'Test without dynamic segmentation only')
     def test_cache_is_used_when_getting_trek_DEM_nds(self):
         trek = trek_factory.TrekFactory.create(geom=LineString((1, 101), (81, 101), (81, 99)))
-        # There are 9 queries to get trek DEM
-        with self.assertNumQueries(10):
+        # There are 17 queries to get trek DEM, 2 of them to read DEM tiles, 7 for the cache key
+        with self.assertNumQueries(17):
             response = self.client.get(reverse('apiv2:trek-dem', args=(trek.pk,)))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['Content-Type'], 'application/json')
-        # When cache is used there is single query to get trek DEM
-        with self.assertNumQueries(1):
+        # When cache is used there are only queries for the cache key, within test transaction
+        with self.assertNumQueries(7):
             response = self.client.get(reverse('apiv2:trek-dem', args=(trek.pk,)))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['Content-Type'], 'application/json')
 
+    def test_trek_DEM_as_npy(self):
+        response = self.client.get(reverse('apiv2:trek-dem', args=(self.trek.pk,)), {'format': 'json'})
+        altitudes = response.json()['altitudes']
+        response = self.client.get(reverse('apiv2:trek-dem', args=(self.trek.pk,)), {'format': 'npy'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        array = np.load(BytesIO(response.content))
+        self.assertEqual(array.dtype, np.int16)
+        self.assertEqual(array.tolist(), altitudes)
+
     def test_cache_is_used_when_getting_trek_profile(self):
-        # There are 8 queries to get trek profile
-        with self.assertNumQueries(10):
+        # There are 15 queries to get trek profile, 7 for the cache key
+        with self.assertNumQueries(15):
             response = self.client.get(reverse('apiv2:trek-profile', args=(self.trek.pk,)))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['Content-Type'], 'application/json')
         self.assertIn("profile", response.json().keys())
-        # When cache is used there is single query to get trek profile
-        with self.assertNumQueries(1):
+        # When cache is used there are only queries for the cache key, within test transaction
+        with self.assertNumQueries(7):
             response = self.client.get(reverse('apiv2:trek-profile', args=(self.trek.pk,)))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['Content-Type'], 'application/json')
         self.assertIn("profile", response.json().keys())
 
     def test_cache_is_used_when_getting_trek_profile_svg(self):
-        # There are 8 queries to get trek profile svg
-        with self.assertNumQueries(10):
+        # There are 15 queries to get trek profile svg, 7 for the cache key
+        with self.assertNumQueries(15):
             response = self.client.get(reverse('apiv2:trek-profile', args=(self.trek.pk,)), {"format": "svg"})
         self.assertEqual(response.status_code, 200)
         self.assertIn('image/svg+xml', response['Content-Type'])
-        # When cache is used there is single query to get trek profile
-        with self.assertNumQueries(1):
+        # When cache is used there are only queries for the cache key, within test transaction
+        with self.assertNumQueries(7):
             response = self.client.get(reverse('apiv2:trek-profile', args=(self.trek.pk,)), {"format": "svg"})
         self.assertEqual(response.status_code, 200)
         self.assertIn('image/svg+xml', response['Content-Type'])
@@ -4371,3 +4404,102 @@ class GenericCacheTestCase(APITestCase):
             response = self.client.get(reverse('apiv2:practice-detail', args=(self.practice.pk,)))
         data = response.json()
         self.assertTrue(data['pictogram'].startswith('http://'))
+
+
+class ListCacheTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trek = trek_factory.TrekFactory.create(name_en="Old name")
+        cls.trek.refresh_from_db()
+
+    def get_trek_list(self):
+        response = self.client.get(reverse('apiv2:trek-list'), {'language': 'en'})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_list_cache_is_used(self):
+        self.get_trek_list()
+        # Cache key only requires to aggregate related tables with update dates
+        with self.assertNumQueries(10):
+            data = self.get_trek_list()
+        self.assertEqual(data['results'][0]['name'], "Old name")
+
+    def test_list_cache_invalidates_when_object_changes(self):
+        self.get_trek_list()
+        self.trek.name_en = "New name"
+        self.trek.save()
+        data = self.get_trek_list()
+        self.assertEqual(data['results'][0]['name'], "New name")
+
+    def test_list_cache_invalidates_when_object_is_added_or_removed(self):
+        self.assertEqual(self.get_trek_list()['count'], 1)
+        trek = trek_factory.TrekFactory.create()
+        self.assertEqual(self.get_trek_list()['count'], 2)
+        trek.delete()
+        self.assertEqual(self.get_trek_list()['count'], 1)
+
+    def test_list_cache_invalidates_when_zones_change(self):
+        self.assertEqual(self.get_trek_list()['results'][0]['cities'], [])
+        city = zoning_factory.CityFactory.create(geom=MultiPolygon(self.trek.geom.buffer(10), srid=settings.SRID))
+        self.assertEqual(self.get_trek_list()['results'][0]['cities'], [city.code])
+
+    def test_cache_invalidates_when_embedded_object_changes(self):
+        web_link = trek_factory.WebLinkFactory.create(name_en="Old link")
+        self.trek.web_links.add(web_link)
+        detail_url = reverse('apiv2:trek-detail', args=(self.trek.pk,))
+        self.assertEqual(self.get_trek_list()['results'][0]['web_links'][0]['name'], "Old link")
+        self.assertEqual(self.client.get(detail_url, {'language': 'en'}).json()['web_links'][0]['name'], "Old link")
+        # Web links have no update date, editing them must change versions anyway
+        web_link.name_en = "New link"
+        web_link.save()
+        self.assertEqual(self.get_trek_list()['results'][0]['web_links'][0]['name'], "New link")
+        self.assertEqual(self.client.get(detail_url, {'language': 'en'}).json()['web_links'][0]['name'], "New link")
+
+    def test_list_cache_invalidates_when_children_are_reordered(self):
+        child1, child2 = trek_factory.TrekFactory.create_batch(2)
+        ordered1 = trek_models.OrderedTrekChild.objects.create(parent=self.trek, child=child1, order=1)
+        ordered2 = trek_models.OrderedTrekChild.objects.create(parent=self.trek, child=child2, order=2)
+        treks = {trek['id']: trek for trek in self.get_trek_list()['results']}
+        self.assertEqual(treks[self.trek.pk]['children'], [child1.pk, child2.pk])
+        # Treks themselves are not saved
+        ordered1.order, ordered2.order = 2, 1
+        ordered1.save()
+        ordered2.save()
+        treks = {trek['id']: trek for trek in self.get_trek_list()['results']}
+        self.assertEqual(treks[self.trek.pk]['children'], [child2.pk, child1.pk])
+
+    def test_zoning_prefetched_only_for_zoning_fields(self):
+        self.client.get(reverse('apiv2:trek-list'), {'fields': 'id,name'})
+        self.assertFalse(zoning_models.ObjectZoning.objects.exists())
+        self.get_trek_list()
+        self.assertTrue(zoning_models.ObjectZoning.objects.exists())
+
+    def test_list_cache_depends_on_query_params(self):
+        portal = common_factory.TargetPortalFactory.create()
+        self.trek.portal.add(portal)
+        self.assertEqual(self.get_trek_list()['count'], 1)
+        response = self.client.get(reverse('apiv2:trek-list'), {'language': 'en', 'portals': portal.pk + 1})
+        self.assertEqual(response.json()['count'], 0)
+
+
+class TrekDepartureTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trek = trek_factory.TrekFactory.create(
+            parking_location=Point(1, 2, srid=settings.SRID),
+            points_reference=MultiPoint([Point(3, 4), Point(5, 6)], srid=settings.SRID)
+        )
+        cls.trek.refresh_from_db()
+        cls.start = Point(cls.trek.geom.coords[0], srid=settings.SRID)
+        cls.city = zoning_factory.CityFactory.create(geom=MultiPolygon(cls.start.buffer(1), srid=settings.SRID))
+
+    def test_departure_computed_in_database(self):
+        response = self.client.get(reverse('apiv2:trek-detail', args=(self.trek.pk,)))
+        data = response.json()
+        self.assertEqual(data['departure_city'], self.city.code)
+        start = self.start.transform(settings.API_SRID, clone=True)
+        self.assertAlmostEqual(data['departure_geom'][0], start.x)
+        self.assertAlmostEqual(data['departure_geom'][1], start.y)
+        parking = self.trek.parking_location.transform(settings.API_SRID, clone=True)
+        self.assertEqual(data['parking_location'], [round(parking.x, 7), round(parking.y, 7)])
+        self.assertEqual(len(data['points_reference']['coordinates']), 2)
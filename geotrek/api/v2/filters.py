@@ -313,6 +313,17 @@ class NearbyContentFilter(BaseFilterBackend):
                                                          distance=distance, field=field)
         return qs
 
+    def get_cache_models(self, request, view):
+        """ Models of objects which listed objects are compared to """
+        models = {
+            'near_touristicevent': TouristicEvent,
+            'near_touristiccontent': TouristicContent,
+            'near_trek': Trek,
+        }
+        if 'geotrek.outdoor' in settings.INSTALLED_APPS:
+            models.update({'near_outdoorsite': Site, 'near_outdoorcourse': Course})
+        return [model for param, model in models.items() if request.GET.get(param)]
+
     def get_schema_fields(self, view):
         fields = (
             Field(
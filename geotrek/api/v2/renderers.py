@@ -1,3 +1,6 @@
+from io import BytesIO
+
+import numpy as np
 import pygal
 from django.conf import settings
 from django.utils import translation
@@ -51,3 +54,19 @@ class SVGProfileRenderer(BaseRenderer):
         translation.deactivate()
         line_chart.add('', [(int(v[0]), int(v[3])) for v in profile])
         return line_chart.render()
+
+
+class NPYElevationAreaRenderer(BaseRenderer):
+    media_type = "application/octet-stream"
+    format = "npy"
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, media_type=None, renderer_context=None):
+        """
+        Altitudes of the elevation area as a NumPy array (.npy format) of 16 bits integers,
+        rows going from south to north.
+        """
+        output = BytesIO()
+        np.save(output, np.array(data.get('altitudes', []), dtype=np.int16))
+        return output.getvalue()
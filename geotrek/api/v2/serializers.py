@@ -1,9 +1,7 @@
-from bs4 import BeautifulSoup
 import json
 
 from django.conf import settings
 from django.contrib.gis.db.models.functions import Transform
-from django.contrib.gis.geos import MultiLineString, Point
 from django.db.models import F
 from django.urls import reverse
 from django.utils.translation import get_language
@@ -11,7 +9,6 @@ from django.utils.translation import gettext_lazy as _
 from drf_dynamic_fields import DynamicFieldsMixin
 from easy_thumbnails.alias import aliases
 from easy_thumbnails.exceptions import InvalidImageFormatError
-from easy_thumbnails.files import get_thumbnailer
 from PIL.Image import DecompressionBombError
 from rest_framework import serializers
 from rest_framework.relations import HyperlinkedIdentityField
@@ -22,6 +19,7 @@ from geotrek.api.v2.mixins import PDFSerializerMixin
 from geotrek.api.v2.utils import build_url, get_translation_or_dict
 from geotrek.authent import models as authent_models
 from geotrek.common import models as common_models
+from geotrek.common.thumbnails import get_thumbnail
 from geotrek.common.utils import simplify_coords
 
 if 'geotrek.core' in settings.INSTALLED_APPS:
@@ -258,11 +256,17 @@ class AttachmentsSerializerMixin(serializers.ModelSerializer):
         return obj.attachment_file
 
     def get_thumbnail(self, obj):
-        thumbnailer = get_thumbnailer(self.get_attachment_file(obj))
+        attachment_file = self.get_attachment_file(obj)
+        # Thumbnails of attachments (not of their other files) are generated in background
+        own_file = isinstance(obj, common_models.Attachment)
         try:
-            thumbnail = thumbnailer.get_thumbnail(aliases.get('apiv2'))
+            thumbnail = get_thumbnail(obj, aliases.get('apiv2'), wait=False,
+                                      attachment_file=None if own_file else attachment_file)
         except (IOError, InvalidImageFormatError, DecompressionBombError):
             return ""
+        if thumbnail is None:
+            # Not generated yet, serve picture itself meanwhile
+            return build_url(self, attachment_file.url)
         thumbnail.author = obj.author
         thumbnail.legend = obj.legend
         return build_url(self, thumbnail.url)
@@ -664,29 +668,8 @@ if 'geotrek.trekking' in settings.INSTALLED_APPS:
         def get_name(self, obj):
             return get_translation_or_dict('name', self, obj)
 
-        def replace_src_absolute(self, data):
-            soup = BeautifulSoup(data, features="lxml")
-            imgs = soup.find_all('img')
-            for img in imgs:
-                if img.attrs['src'][0] == '/':
-                    img['src'] = f'{self.context.get("request").build_absolute_uri("/")}{img.attrs["src"]}'
-
         def get_description(self, obj):
-            lang = self.context.get('request').GET.get('language', 'all') if self.context.get('request') else 'all'
-
-            if lang != 'all':
-                data = getattr(obj, '{}_{}'.format('description', lang))
-                if data:
-                    self.replace_src_absolute(data)
-            else:
-                data = {}
-                for language in settings.MODELTRANSLATION_LANGUAGES:
-                    data_lang = getattr(obj, '{}_{}'.format('description', language), )
-                    if data_lang:
-                        self.replace_src_absolute(data_lang)
-                    data.update({language: data_lang})
-
-            return data
+            return get_translation_or_dict('description', self, obj)
 
         def get_access(self, obj):
             return get_translation_or_dict('access', self, obj)
@@ -718,15 +701,8 @@ if 'geotrek.trekking' in settings.INSTALLED_APPS:
         def get_departure(self, obj):
             return get_translation_or_dict('departure', self, obj)
 
-        def get_first_point(self, geom):
-            if isinstance(geom, Point):
-                return geom
-            if isinstance(geom, MultiLineString):
-                return Point(geom[0][0])
-            return Point(geom[0])
-
         def get_departure_geom(self, obj):
-            return self.get_first_point(obj.geom3d_transformed)[:2]
+            return obj.departure_geom_transformed.coords[:2]
 
         def get_arrival(self, obj):
             return get_translation_or_dict('arrival', self, obj)
@@ -750,9 +726,9 @@ if 'geotrek.trekking' in settings.INSTALLED_APPS:
             return get_translation_or_dict('advised_parking', self, obj)
 
         def get_parking_location(self, obj):
-            if not obj.parking_location:
+            if not obj.parking_location_transformed:
                 return None
-            point = obj.parking_location.transform(settings.API_SRID, clone=True)
+            point = obj.parking_location_transformed
             return [round(point.x, 7), round(point.y, 7)]
 
         def get_ratings_description(self, obj):
@@ -771,18 +747,15 @@ if 'geotrek.trekking' in settings.INSTALLED_APPS:
             return build_url(self, reverse('apiv2:trek-profile', args=(obj.pk,)))
 
         def get_points_reference(self, obj):
-            if not obj.points_reference:
+            if not obj.points_reference_transformed:
                 return None
-            geojson = obj.points_reference.transform(settings.API_SRID, clone=True).geojson
-            return json.loads(geojson)
+            return json.loads(obj.points_reference_transformed.geojson)
 
         def get_cities(self, obj):
             return [city.code for city in obj.published_cities]
 
         def get_departure_city(self, obj):
-            geom = self.get_first_point(obj.geom)
-            city = zoning_models.City.objects.all().filter(geom__contains=geom).first()
-            return city.code if city else None
+            return obj.departure_city_code
 
         class Meta:
             model = trekking_models.Trek
@@ -1,24 +1,105 @@
+from functools import lru_cache
+from html import escape, unescape
+from html.parser import HTMLParser, attrfind_tolerant, tagfind_tolerant
+
 from django.conf import settings
 
+# Fields edited with rich text editor, whose pictures may have relative URLs
+RICH_TEXT_FIELDS = {
+    'access', 'accessibility_advice', 'advice', 'advised_parking', 'ambiance', 'arrival', 'content', 'departure',
+    'description', 'description_teaser', 'equipment', 'gear', 'practical_info', 'public_transport',
+}
+
+
+def is_relative(url):
+    """ Whether url is relative to site root, protocol-relative urls (//host/path) are not """
+    return url.startswith('/') and not url.startswith('//')
+
+
+class RelativeImagesParser(HTMLParser):
+    """ Locate <img> tags with relative src, without building any document tree """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.tags = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'img' and any(name == 'src' and value and is_relative(value) for name, value in attrs):
+            self.tags.append((self.getpos(), self.get_starttag_text()))
+
+
+def relative_src_offsets(text):
+    """ Offsets of relative src values in text of a start tag, found as HTMLParser does """
+    offsets = []
+    position = tagfind_tolerant.match(text, 1).end()
+    match = attrfind_tolerant.match(text, position)
+    while match and match.end() > position:
+        name, value = match.group(1, 3)
+        if name.lower() == 'src' and value:
+            start = match.start(3)
+            if value[:1] in ('"', "'"):
+                value, start = value[1:-1], start + 1
+            if is_relative(unescape(value)):
+                offsets.append(start)
+        position = match.end()
+        match = attrfind_tolerant.match(text, position)
+    return offsets
+
+
+@lru_cache(maxsize=1024)
+def absolute_images(html, root):
+    """ Prefix relative src of pictures with root url (scheme and host) """
+    if '<img' not in html.lower():
+        return html
+    parser = RelativeImagesParser()
+    parser.feed(html)
+    parser.close()
+    if not parser.tags:
+        return html
+    # Offsets of lines starts, as counted by parser
+    lines = [0]
+    newline = html.find('\n')
+    while newline >= 0:
+        lines.append(newline + 1)
+        newline = html.find('\n', newline + 1)
+    parts = []
+    end = 0
+    for (lineno, offset), text in parser.tags:
+        start = lines[lineno - 1] + offset
+        # Root is inserted before relative src values, other attributes are left as written
+        for src in relative_src_offsets(text):
+            parts += [html[end:start + src], escape(root)]
+            end = start + src
+    parts.append(html[end:])
+    return ''.join(parts)
+
 
 def get_translation_or_dict(model_field_name, serializer, instance):
     """
-    Return translated model field or dict with all translations
+    Return translated model field or dict with all translations.
+    Relative URLs of pictures of rich text fields are made absolute.
     :param model_field_name: Model name field
     :param serializer: serializer object
     :param instance: instance object
     :return: unicode or dict
     """
-    lang = serializer.context.get('request').GET.get('language', 'all') if serializer.context.get('request') else 'all'
+    request = serializer.context.get('request')
+    lang = request.GET.get('language', 'all') if request else 'all'
+    root = request.build_absolute_uri('/')[:-1] if request and model_field_name in RICH_TEXT_FIELDS else None
 
     if lang != 'all':
         data = getattr(instance, '{}_{}'.format(model_field_name, lang))
+        if root and data:
+            data = absolute_images(data, root)
 
     else:
         data = {}
 
         for language in settings.MODELTRANSLATION_LANGUAGES:
-            data.update({language: getattr(instance, '{}_{}'.format(model_field_name, language), )})
+            data_lang = getattr(instance, '{}_{}'.format(model_field_name, language), )
+            if root and data_lang:
+                data_lang = absolute_images(data_lang, root)
+            data.update({language: data_lang})
 
     return data
 
@@ -9,8 +9,9 @@ from rest_framework.response import Response
 
 from geotrek.api.v2 import serializers as api_serializers, \
     filters as api_filters, viewsets as api_viewsets
+from geotrek.api.v2.cache import ListCacheResponseMixin
 from geotrek.api.v2.decorators import cache_response_detail
-from geotrek.common.models import Attachment
+from geotrek.common.models import Attachment, FileType, License, TargetPortal
 from geotrek.tourism import models as tourism_models
 
 
@@ -34,13 +35,14 @@ class TouristicContentCategoryViewSet(api_viewsets.GeotrekViewSet):
         return Response(serializer.data)
 
 
-class TouristicContentViewSet(api_viewsets.GeotrekGeometricViewset):
+class TouristicContentViewSet(ListCacheResponseMixin, api_viewsets.GeotrekGeometricViewset):
     filter_backends = api_viewsets.GeotrekGeometricViewset.filter_backends + (
         api_filters.GeotrekTouristicContentFilter,
         api_filters.NearbyContentFilter,
         api_filters.UpdateOrCreateDateFilter
     )
     serializer_class = api_serializers.TouristicContentSerializer
+    list_cache_models = (Attachment, FileType, License, TargetPortal)
 
     def get_queryset(self):
         activate(self.request.GET.get('language'))
@@ -83,7 +85,7 @@ class TouristicEventTypeViewSet(api_viewsets.GeotrekViewSet):
     queryset = tourism_models.TouristicEventType.objects.order_by('pk')  # Required for reliable pagination
 
 
-class TouristicEventViewSet(api_viewsets.GeotrekGeometricViewset):
+class TouristicEventViewSet(ListCacheResponseMixin, api_viewsets.GeotrekGeometricViewset):
     filter_backends = api_viewsets.GeotrekGeometricViewset.filter_backends + (
         api_filters.GeotrekTouristicEventFilter,
         api_filters.NearbyContentFilter,
@@ -91,6 +93,8 @@ class TouristicEventViewSet(api_viewsets.GeotrekGeometricViewset):
     )
     filterset_class = api_filters.TouristicEventFilterSet
     serializer_class = api_serializers.TouristicEventSerializer
+    list_cache_models = (Attachment, FileType, License, tourism_models.TouristicEventPlace,
+                         tourism_models.CancellationReason, TargetPortal)
 
     def get_queryset(self):
         activate(self.request.GET.get('language'))
@@ -1,6 +1,6 @@
 from django.conf import settings
 from django.contrib.gis.db.models.functions import Transform
-from django.db.models import F, Prefetch, Q
+from django.db.models import F, OuterRef, Prefetch, Q, Subquery
 from django.db.models.aggregates import Count
 from django.utils.translation import activate
 from rest_framework.decorators import action
@@ -8,11 +8,14 @@ from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 
 from geotrek.api.v2 import filters as api_filters, serializers as api_serializers, viewsets as api_viewsets
+from geotrek.api.v2.cache import ListCacheResponseMixin
 from geotrek.api.v2.decorators import cache_response_detail
 from geotrek.api.v2.functions import Length3D
-from geotrek.api.v2.renderers import SVGProfileRenderer
-from geotrek.common.models import Attachment, AccessibilityAttachment, HDViewPoint
+from geotrek.api.v2.renderers import NPYElevationAreaRenderer, SVGProfileRenderer
+from geotrek.common.functions import FirstPoint
+from geotrek.common.models import Attachment, AccessibilityAttachment, FileType, HDViewPoint, License, TargetPortal
 from geotrek.trekking import models as trekking_models
+from geotrek.zoning.models import City
 
 
 class WebLinkCategoryViewSet(api_viewsets.GeotrekViewSet):
@@ -20,7 +23,7 @@ class WebLinkCategoryViewSet(api_viewsets.GeotrekViewSet):
     queryset = trekking_models.WebLinkCategory.objects.all()
 
 
-class TrekViewSet(api_viewsets.GeotrekGeometricViewset):
+class TrekViewSet(ListCacheResponseMixin, api_viewsets.GeotrekGeometricViewset):
     filter_backends = api_viewsets.GeotrekGeometricViewset.filter_backends + (
         api_filters.GeotrekTrekQueryParamsFilter,
         api_filters.NearbyContentFilter,
@@ -28,6 +31,10 @@ class TrekViewSet(api_viewsets.GeotrekGeometricViewset):
         api_filters.GeotrekRatingsFilter
     )
     serializer_class = api_serializers.TrekSerializer
+    # Other relations are serialized as primary keys, changed along with treks or by m2m_changed signals
+    list_cache_models = (Attachment, AccessibilityAttachment, FileType, License, HDViewPoint,
+                         trekking_models.WebLink, trekking_models.WebLinkCategory, TargetPortal,
+                         trekking_models.OrderedTrekChild)
 
     def get_queryset(self):
         activate(self.request.GET.get('language'))
@@ -42,8 +49,14 @@ class TrekViewSet(api_viewsets.GeotrekGeometricViewset):
                                        queryset=trekking_models.WebLink.objects.select_related('category')),
                               Prefetch('view_points',
                                        queryset=HDViewPoint.objects.select_related('content_type', 'license'))) \
+            .alias(departure_point=FirstPoint(F('geom'))) \
             .annotate(geom3d_transformed=Transform(F('geom_3d'), settings.API_SRID),
-                      length_3d_m=Length3D('geom_3d')) \
+                      length_3d_m=Length3D('geom_3d'),
+                      departure_geom_transformed=Transform(F('departure_point'), settings.API_SRID),
+                      departure_city_code=Subquery(City.objects.filter(geom__contains=OuterRef('departure_point'))
+                                                   .order_by('name').values('code')[:1]),
+                      parking_location_transformed=Transform(F('parking_location'), settings.API_SRID),
+                      points_reference_transformed=Transform(F('points_reference'), settings.API_SRID)) \
             .order_by("name")  # Required for reliable pagination
 
     @cache_response_detail()
@@ -75,7 +88,8 @@ class TrekViewSet(api_viewsets.GeotrekGeometricViewset):
             qs = qs.filter(Q(**{field_name: True}) | Q(**{field_name_parent: True}))
         return qs.distinct()
 
-    @action(detail=True, url_name="dem")
+    @action(detail=True, url_name="dem",
+            renderer_classes=api_viewsets.GeotrekGeometricViewset.renderer_classes + [NPYElevationAreaRenderer, ])
     @cache_response_detail()
     def dem(self, request, *args, **kwargs):
         trek = self.get_object()
@@ -159,13 +173,14 @@ class DifficultyViewSet(api_viewsets.GeotrekViewSet):
         return Response(serializer.data)
 
 
-class POIViewSet(api_viewsets.GeotrekGeometricViewset):
+class POIViewSet(ListCacheResponseMixin, api_viewsets.GeotrekGeometricViewset):
     filter_backends = api_viewsets.GeotrekGeometricViewset.filter_backends + (
         api_filters.GeotrekPOIFilter,
         api_filters.NearbyContentFilter,
         api_filters.UpdateOrCreateDateFilter
     )
     serializer_class = api_serializers.POISerializer
+    list_cache_models = (Attachment, FileType, License, HDViewPoint, trekking_models.POIType, TargetPortal)
     queryset = trekking_models.POI.objects.existing() \
         .select_related('topo_object', 'type', ) \
         .prefetch_related('topo_object__aggregations',
@@ -1,3 +1,4 @@
+from datetime import date
 from hashlib import md5
 
 from django.conf import settings
@@ -5,15 +6,24 @@ from django_filters.rest_framework.backends import DjangoFilterBackend
 from mapentity.renderers import GeoJSONRenderer
 from rest_framework import viewsets, renderers
 from rest_framework.authentication import BasicAuthentication, SessionAuthentication
-from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated
 
 from geotrek.api.v2 import pagination as api_pagination, filters as api_filters
 from geotrek.api.v2.cache import RetrieveCacheResponseMixin
 from geotrek.api.v2.serializers import override_serializer
+from geotrek.common.versions import get_versions
+from geotrek.zoning.helpers import prefetch_zoning
+from geotrek.zoning.mixins import ZoningPropertiesMixin
+from geotrek.zoning.models import City, District, RestrictedArea
+
+# Serializer fields read from zoning properties
+ZONING_FIELDS = {'cities', 'districts', 'areas'}
 
 
 class GeotrekViewSet(RetrieveCacheResponseMixin, viewsets.ReadOnlyModelViewSet):
+    # Models whose changes alter responses (embedded objects), besides the listed one.
+    # Used by detail cache keys, and list ones in views which mix in ListCacheResponseMixin.
+    list_cache_models = ()
     filter_backends = (
         DjangoFilterBackend,
         api_filters.GeotrekQueryParamsFilter,
@@ -37,17 +47,38 @@ class GeotrekViewSet(RetrieveCacheResponseMixin, viewsets.ReadOnlyModelViewSet):
         return f"{self.request.path}:{self.get_ordered_query_params()}:{self.request.accepted_renderer.format}:{proto_scheme}"
 
     def get_object_cache_key(self, pk):
-        """ return specific object cache key based on object date_update column"""
-        # don't directly use get_object or get_queryset to avoid select / prefetch and annotation sql queries
-        # insure object exists and doesn't raise exception
-        instance = get_object_or_404(self.get_queryset().model, pk=pk)
-        date_update = instance.date_update
-        return f"{self.get_base_cache_string()}:{date_update.isoformat()}"
+        """ return specific object cache key based on version of model, read from cache without sql query """
+        return f"{self.get_base_cache_string()}:{pk}:{get_versions(self.get_queryset().model, *self.list_cache_models)}"
 
     def object_cache_key_func(self, **kwargs):
         """ cache key md5 for retrieve viewset action """
         return md5(self.get_object_cache_key(kwargs.get('kwargs').get('pk')).encode("utf-8")).hexdigest()
 
+    def get_list_cache_models(self):
+        """ Models of listed objects, of objects they embed and of objects used by filters """
+        models = [self.get_queryset().model, *self.list_cache_models]
+        for backend in self.filter_backends:
+            if hasattr(backend, 'get_cache_models'):
+                models += backend().get_cache_models(self.request, self)
+        return list(dict.fromkeys(models))
+
+    def get_list_cache_version(self):
+        """ Changes whenever an object of list cache models is added, modified or removed,
+        or zones of listed objects change """
+        models = self.get_list_cache_models()
+        if issubclass(self.get_queryset().model, ZoningPropertiesMixin):
+            models += [City, District, RestrictedArea]
+        # Some filters (events dates, sensitivity periods) depend on current date
+        return f"{get_versions(*models)}:{date.today().isoformat()}"
+
+    def get_list_cache_key(self):
+        """ return list cache key based on query params and version of related tables """
+        return f"{self.get_base_cache_string()}:{self.get_list_cache_version()}"
+
+    def list_cache_key_func(self, **kwargs):
+        """ cache key md5 for list viewset action """
+        return md5(self.get_list_cache_key().encode("utf-8")).hexdigest()
+
     def get_serializer_context(self):
         return {
             'request': self.request,
@@ -70,3 +101,11 @@ class GeotrekGeometricViewset(GeotrekViewSet):
         base_serializer_class = super().get_serializer_class()
         format_output = self.request.query_params.get('format', 'json')
         return override_serializer(format_output, base_serializer_class)
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None and issubclass(queryset.model, ZoningPropertiesMixin) \
+                and ZONING_FIELDS.intersection(self.get_serializer().fields):
+            # Cities, districts and areas of the whole page at once
+            prefetch_zoning(page)
+        return page
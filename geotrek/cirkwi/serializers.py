@@ -1,8 +1,9 @@
 import datetime
 
-from django.contrib.gis.db.models.functions import Transform
+from django.db.models import Prefetch, QuerySet
 from django.urls import reverse
 from django.utils import translation
+from django.utils.functional import cached_property
 from django.utils.timezone import utc, make_aware
 from django.utils.translation import get_language
 from django.utils.xmlutils import SimplerXMLGenerator
@@ -11,6 +12,8 @@ from mapentity.serializers import plain_text
 
 
 from geotrek.cirkwi.models import CirkwiTag
+from geotrek.common.models import Attachment
+from geotrek.trekking.models import POI
 
 
 def timestamp(dt):
@@ -18,12 +21,38 @@ def timestamp(dt):
     return str(int((dt - epoch).total_seconds()))
 
 
+def prefetch_pictures():
+    """ Same pictures as PicturesMixin.pictures, for a whole queryset """
+    pictures = Attachment.objects.filter(is_image=True).exclude(title='mapimage').order_by('-starred', 'attachment_file')
+    return Prefetch('attachments', queryset=pictures, to_attr='prefetched_pictures')
+
+
 class CirkwiPOISerializer:
+    chunk_size = 200
+
     def __init__(self, request, stream, get_params=None):
         self.xml = SimplerXMLGenerator(stream, 'utf8')
         self.request = request
         self.stream = stream
 
+    def pois_queryset(self, queryset):
+        return queryset.select_related('type__cirkwi').prefetch_related(prefetch_pictures())
+
+    def prefetch(self, queryset):
+        pois = list(self.pois_queryset(queryset))
+        for poi in pois:
+            poi.pictures = poi.prefetched_pictures
+        return pois
+
+    def iter_chunks(self, objects):
+        """ Iterate over objects by chunks, with their relations prefetched """
+        if not isinstance(objects, QuerySet):
+            yield from objects
+            return
+        pks = list(dict.fromkeys(objects.values_list('pk', flat=True)))
+        for i in range(0, len(pks), self.chunk_size):
+            yield from self.prefetch(objects.filter(pk__in=pks[i:i + self.chunk_size]))
+
     def serialize_field(self, name, value, attrs={}):
         if not value and not attrs:
             return
@@ -51,45 +80,57 @@ class CirkwiPOISerializer:
         self.xml.endElement('images')
         self.xml.endElement('medias')
 
+    def serialize_poi(self, poi):
+        self.xml.startElement('poi', {
+            'date_creation': timestamp(poi.date_insert),
+            'date_modification': timestamp(poi.date_update),
+            'id_poi': str(poi.pk),
+        })
+        if poi.type.cirkwi:
+            self.xml.startElement('categories', {})
+            self.serialize_field('categorie', str(poi.type.cirkwi.eid), {'nom': poi.type.cirkwi.name})
+            self.xml.endElement('categories')
+        orig_lang = translation.get_language()
+        pictures = poi.serializable_pictures
+        self.xml.startElement('informations', {})
+        for lang in poi.published_langs:
+            translation.activate(lang)
+            self.xml.startElement('information', {'langue': lang})
+            self.serialize_field('titre', poi.name)
+            self.serialize_field('description', plain_text(poi.description))
+            self.serialize_medias(self.request, pictures)
+            self.xml.endElement('information')
+        translation.activate(orig_lang)
+        self.xml.endElement('informations')
+        self.xml.startElement('adresse', {})
+        self.xml.startElement('position', {})
+        coords = poi.geom.transform(4326, clone=True).coords
+        self.serialize_field('lat', round(coords[1], 7))
+        self.serialize_field('lng', round(coords[0], 7))
+        self.xml.endElement('position')
+        self.xml.endElement('adresse')
+        self.xml.endElement('poi')
+
     def serialize_pois(self, pois):
         if not pois:
             return
         for poi in pois:
-            self.xml.startElement('poi', {
-                'date_creation': timestamp(poi.date_insert),
-                'date_modification': timestamp(poi.date_update),
-                'id_poi': str(poi.pk),
-            })
-            if poi.type.cirkwi:
-                self.xml.startElement('categories', {})
-                self.serialize_field('categorie', str(poi.type.cirkwi.eid), {'nom': poi.type.cirkwi.name})
-                self.xml.endElement('categories')
-            orig_lang = translation.get_language()
-            self.xml.startElement('informations', {})
-            for lang in poi.published_langs:
-                translation.activate(lang)
-                self.xml.startElement('information', {'langue': lang})
-                self.serialize_field('titre', poi.name)
-                self.serialize_field('description', plain_text(poi.description))
-                self.serialize_medias(self.request, poi.serializable_pictures)
-                self.xml.endElement('information')
-            translation.activate(orig_lang)
-            self.xml.endElement('informations')
-            self.xml.startElement('adresse', {})
-            self.xml.startElement('position', {})
-            coords = poi.geom.transform(4326, clone=True).coords
-            self.serialize_field('lat', round(coords[1], 7))
-            self.serialize_field('lng', round(coords[0], 7))
-            self.xml.endElement('position')
-            self.xml.endElement('adresse')
-            self.xml.endElement('poi')
+            self.serialize_poi(poi)
 
-    def serialize(self, pois):
+    def iter_serialize(self, pois):
+        """ Serialize pois, yielding after each one so that the stream can be flushed """
         self.xml.startDocument()
         self.xml.startElement('pois', {'version': '2'})
-        self.serialize_pois(pois)
+        for poi in self.iter_chunks(pois):
+            self.serialize_poi(poi)
+            yield
         self.xml.endElement('pois')
         self.xml.endDocument()
+        yield
+
+    def serialize(self, pois):
+        for _ in self.iter_serialize(pois):
+            pass
 
 
 class CirkwiTrekSerializer(CirkwiPOISerializer):
@@ -101,6 +142,23 @@ class CirkwiTrekSerializer(CirkwiPOISerializer):
         self.request = request
         self.exclude_pois = get_params.get('withoutpois', None)
 
+    @cached_property
+    def cirkwi_tags(self):
+        return list(CirkwiTag.objects.all())
+
+    def prefetch(self, queryset):
+        treks = list(queryset.select_related('structure', 'practice__cirkwi', 'difficulty')
+                     .prefetch_related('portal', 'source', 'themes', 'accessibilities', 'labels', prefetch_pictures()))
+        for trek in treks:
+            trek.pictures = trek.prefetched_pictures
+        if not self.exclude_pois:
+            # Published POIs of all treks of the chunk at once
+            POI.prefetch_published_pois(treks, queryset=self.pois_queryset(POI.objects.existing()))
+            for trek in treks:
+                for poi in trek.published_pois:
+                    poi.pictures = poi.prefetched_pictures
+        return treks
+
     def serialize_additionnal_info(self, trek, name):
         value = getattr(trek, name)
         if not value:
@@ -153,14 +211,16 @@ class CirkwiTrekSerializer(CirkwiPOISerializer):
             self.serialize_field('description', plain_text(description))
 
     def serialize_tags(self, trek):
-        tag_ids = list(trek.themes.filter(cirkwi_id__isnull=False).values_list('cirkwi_id', flat=True))
-        tag_ids += trek.accessibilities.filter(cirkwi_id__isnull=False).values_list('cirkwi_id', flat=True)
+        tag_ids = {theme.cirkwi_id for theme in trek.themes.all() if theme.cirkwi_id is not None}
+        tag_ids |= {accessibility.cirkwi_id for accessibility in trek.accessibilities.all()
+                    if accessibility.cirkwi_id is not None}
         if trek.difficulty and trek.difficulty.cirkwi_id:
-            tag_ids.append(trek.difficulty.cirkwi_id)
+            tag_ids.add(trek.difficulty.cirkwi_id)
         if tag_ids:
             self.xml.startElement('tags_publics', {})
-            for tag in CirkwiTag.objects.filter(id__in=tag_ids):
-                self.serialize_field('tag_public', '', {'id': str(tag.eid), 'nom': tag.name})
+            for tag in self.cirkwi_tags:
+                if tag.id in tag_ids:
+                    self.serialize_field('tag_public', '', {'id': str(tag.eid), 'nom': tag.name})
             self.xml.endElement('tags_publics')
 
     def serialize_labels(self, trek):
@@ -172,45 +232,54 @@ class CirkwiTrekSerializer(CirkwiPOISerializer):
             self.xml.endElement('information_complementaire')
 
     # TODO: parking location (POI?), points_reference
-    def serialize(self, treks):
-        self.xml.startDocument()
-        self.xml.startElement('circuits', {'version': '2'})
-        for trek in treks:
-            self.xml.startElement('circuit', {
-                'date_creation': timestamp(trek.date_insert),
-                'date_modification': timestamp(trek.date_update),
-                'id_circuit': str(trek.pk),
-            })
-            orig_lang = translation.get_language()
-            self.xml.startElement('informations', {})
-            for lang in trek.published_langs:
-                translation.activate(lang)
-                self.xml.startElement('information', {'langue': lang})
-                self.serialize_field('titre', trek.name)
-                self.serialize_description(trek)
-                self.serialize_medias(self.request, trek.serializable_pictures)
-                if any([getattr(trek, name) for name in self.ADDITIONNAL_INFO]):
-                    self.xml.startElement('informations_complementaires', {})
-                    for name in self.ADDITIONNAL_INFO:
-                        self.serialize_additionnal_info(trek, name)
-                    self.serialize_labels(trek)
-                    self.xml.endElement('informations_complementaires')
-                self.serialize_tags(trek)
-                self.xml.endElement('information')
-            translation.activate(orig_lang)
-            self.xml.endElement('informations')
-            self.serialize_field('distance', int(trek.length))
-            self.serialize_locomotions(trek)
-            kml_url = reverse('trekking:trek_kml_detail',
-                              kwargs={'lang': get_language(), 'pk': trek.pk, 'slug': trek.slug})
-            self.serialize_field('fichier_trace', '', {'url': self.request.build_absolute_uri(kml_url)})
-            self.xml.startElement('tracking_information', {})
-            self.serialize_tracking_info(trek)
-            self.xml.endElement('tracking_information')
-            if not self.exclude_pois and trek.published_pois:
+    def serialize_trek(self, trek):
+        self.xml.startElement('circuit', {
+            'date_creation': timestamp(trek.date_insert),
+            'date_modification': timestamp(trek.date_update),
+            'id_circuit': str(trek.pk),
+        })
+        orig_lang = translation.get_language()
+        pictures = trek.serializable_pictures
+        self.xml.startElement('informations', {})
+        for lang in trek.published_langs:
+            translation.activate(lang)
+            self.xml.startElement('information', {'langue': lang})
+            self.serialize_field('titre', trek.name)
+            self.serialize_description(trek)
+            self.serialize_medias(self.request, pictures)
+            if any([getattr(trek, name) for name in self.ADDITIONNAL_INFO]):
+                self.xml.startElement('informations_complementaires', {})
+                for name in self.ADDITIONNAL_INFO:
+                    self.serialize_additionnal_info(trek, name)
+                self.serialize_labels(trek)
+                self.xml.endElement('informations_complementaires')
+            self.serialize_tags(trek)
+            self.xml.endElement('information')
+        translation.activate(orig_lang)
+        self.xml.endElement('informations')
+        self.serialize_field('distance', int(trek.length))
+        self.serialize_locomotions(trek)
+        kml_url = reverse('trekking:trek_kml_detail',
+                          kwargs={'lang': get_language(), 'pk': trek.pk, 'slug': trek.slug})
+        self.serialize_field('fichier_trace', '', {'url': self.request.build_absolute_uri(kml_url)})
+        self.xml.startElement('tracking_information', {})
+        self.serialize_tracking_info(trek)
+        self.xml.endElement('tracking_information')
+        if not self.exclude_pois:
+            pois = list(trek.published_pois)
+            if pois:
                 self.xml.startElement('pois', {})
-                self.serialize_pois(trek.published_pois.annotate(transformed_geom=Transform('geom', 4326)))
+                self.serialize_pois(pois)
                 self.xml.endElement('pois')
-            self.xml.endElement('circuit')
+        self.xml.endElement('circuit')
+
+    def iter_serialize(self, treks):
+        """ Serialize treks, yielding after each one so that the stream can be flushed """
+        self.xml.startDocument()
+        self.xml.startElement('circuits', {'version': '2'})
+        for trek in self.iter_chunks(treks):
+            self.serialize_trek(trek)
+            yield
         self.xml.endElement('circuits')
         self.xml.endDocument()
+        yield
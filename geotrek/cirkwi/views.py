@@ -1,4 +1,7 @@
-from django.http import HttpResponse
+from io import StringIO
+
+from django.http import StreamingHttpResponse
+from django.utils import translation
 
 from django.views.generic import ListView
 from geotrek.trekking.models import Trek, POI
@@ -6,6 +9,19 @@ from geotrek.cirkwi.filters import CirkwiPOIFilterSet, CirkwiTrekFilterSet
 from geotrek.cirkwi.serializers import CirkwiTrekSerializer, CirkwiPOISerializer
 
 
+def stream_xml(serializer, stream, objects):
+    """ Yield XML written by serializer, object by object, in the language of the request """
+    language = translation.get_language()
+
+    def generate():
+        with translation.override(language):
+            for _ in serializer.iter_serialize(objects):
+                yield stream.getvalue()
+                stream.seek(0)
+                stream.truncate()
+    return generate()
+
+
 class CirkwiTrekView(ListView):
     model = Trek
 
@@ -16,11 +32,10 @@ class CirkwiTrekView(ListView):
         return qs
 
     def get(self, request):
-        response = HttpResponse(content_type='application/xml')
-        serializer = CirkwiTrekSerializer(request, response, request.GET)
+        stream = StringIO()
+        serializer = CirkwiTrekSerializer(request, stream, request.GET)
         treks = self.get_queryset()
-        serializer.serialize(treks)
-        return response
+        return StreamingHttpResponse(stream_xml(serializer, stream, treks), content_type='application/xml')
 
 
 class CirkwiPOIView(ListView):
@@ -33,8 +48,7 @@ class CirkwiPOIView(ListView):
         return qs
 
     def get(self, request):
-        response = HttpResponse(content_type='application/xml')
-        serializer = CirkwiPOISerializer(request, response, request.GET)
+        stream = StringIO()
+        serializer = CirkwiPOISerializer(request, stream, request.GET)
         pois = self.get_queryset()
-        serializer.serialize(pois)
-        return response
+        return StreamingHttpResponse(stream_xml(serializer, stream, pois), content_type='application/xml')
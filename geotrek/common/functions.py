@@ -34,6 +34,13 @@ class EndPoint(GeoFunc):
     output_field = PointField()
 
 
+class FirstPoint(GeoFunc):
+    """ Start point of a line, or of the first line of a collection, or the point itself """
+    output_field = PointField()
+    # Geometry is referenced once, so that parameters of its expression are bound once
+    template = '(SELECT COALESCE(ST_StartPoint(first), first) FROM ST_GeometryN(%(expressions)s, 1) AS first)'
+
+
 class Buffer(GeomOutputGeoFunc):
     """ ST_Buffer postgis function """
     pass
@@ -1,31 +1,47 @@
+import hashlib
+import json
 import logging
+import math
+import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZipFile
 
+from django.apps import apps
 from django.conf import settings
+from django.template import engines
 from landez import TilesManager
 from landez.sources import DownloadError
 
+import geotrek
 from geotrek.common import models
 from geotrek.common import views
+from geotrek.common.versions import get_versions
 
 logger = logging.getLogger(__name__)
 
 
-class ZipTilesBuilder:
-    def __init__(self, zipfile, prefix="", **builder_args):
-        self.zipfile = zipfile
-        self.prefix = prefix
+class TilesStore:
+    """
+    Content-addressed store of the tiles of a synchronization, shared by all its zip files.
+    The union of needed tiles is downloaded once, in parallel, then each zip file is built
+    from stored files. Tiles with the same content (e.g. sea or blank tiles) are stored once.
+    """
+    workers = 8
+
+    def __init__(self, root, **builder_args):
+        self.root = root
         builder_args['tile_format'] = self.format_from_url(builder_args['tiles_url'])
         self.tm = TilesManager(**builder_args)
 
         if not isinstance(settings.MOBILE_TILES_URL, str) and len(settings.MOBILE_TILES_URL) > 1:
             for url in settings.MOBILE_TILES_URL[1:]:
-                args = builder_args
-                args['tiles_url'] = url
-                args['tile_format'] = self.format_from_url(args['tiles_url'])
+                args = dict(builder_args, tiles_url=url, tile_format=self.format_from_url(url))
                 self.tm.add_layer(TilesManager(**args), opacity=1)
 
-        self.tiles = set()
+        self.extension = settings.MOBILE_TILES_EXTENSION or self.tm._tile_extension
+        self.hashes = {}  # (z, x, y) => content hash, None if download failed
 
     def format_from_url(self, url):
         """
@@ -38,22 +54,226 @@ class ZipTilesBuilder:
             return m.group(1)
         return url.rsplit('.')[-1]
 
-    def add_coverage(self, bbox, zoomlevels):
-        self.tiles |= set(self.tm.tileslist(bbox, zoomlevels))
-
-    def run(self):
-        for tile in self.tiles:
-            name = '{prefix}{0}/{1}/{2}{ext}'.format(
-                *tile,
-                prefix=self.prefix,
-                ext=settings.MOBILE_TILES_EXTENSION or self.tm._tile_extension
-            )
-            try:
-                data = self.tm.tile(tile)
-            except DownloadError:
-                logger.warning("Failed to download tile %s" % name)
+    def coverage(self, bbox, zoomlevels):
+        return set(self.tm.tileslist(bbox, zoomlevels))
+
+    def line_bboxes(self, geom, radius):
+        """
+        Bounding boxes of given radius covering a (multi)line in WGS84.
+        The line is simplified first, so that dense geometries do not produce redundant bounding boxes,
+        then long segments are split so that they are covered all along.
+        """
+        tolerance = radius / 4
+        lines = geom if geom.geom_type == 'MultiLineString' else [geom]
+        centers = set()
+        for line in lines:
+            coords = [coord[:2] for coord in line.simplify(tolerance).coords]
+            centers.add(coords[0])
+            for (x0, y0), (x1, y1) in zip(coords, coords[1:]):
+                steps = max(1, math.ceil(math.hypot(x1 - x0, y1 - y0) / radius))
+                for i in range(1, steps + 1):
+                    centers.add((x0 + (x1 - x0) * i / steps, y0 + (y1 - y0) * i / steps))
+        # Widen boxes by simplification tolerance not to lose coverage
+        radius += tolerance
+        return [(x - radius, y - radius, x + radius, y + radius) for x, y in centers]
+
+    def trek_coverage(self, geom):
+        """ Tiles around the trek geometry, large radius at low zooms and small radius at high zooms """
+        geom = geom.transform(4326, clone=True)
+        tiles = set()
+        for bbox in self.line_bboxes(geom, settings.MOBILE_TILES_RADIUS_LARGE):
+            tiles |= self.coverage(bbox, settings.MOBILE_TILES_LOW_ZOOMS)
+        for bbox in self.line_bboxes(geom, settings.MOBILE_TILES_RADIUS_SMALL):
+            tiles |= self.coverage(bbox, settings.MOBILE_TILES_HIGH_ZOOMS)
+        return tiles
+
+    def path(self, content_hash):
+        return os.path.join(self.root, content_hash[:2], '{}{}'.format(content_hash, self.extension))
+
+    def fetch_tile(self, tile):
+        try:
+            data = self.tm.tile(tile)
+        except DownloadError:
+            logger.warning("Failed to download tile {0}/{1}/{2}{ext}".format(*tile, ext=self.extension))
+            return None
+        content_hash = hashlib.sha1(data).hexdigest()
+        path = self.path(content_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = '{}.{}'.format(path, threading.get_ident())
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return content_hash
+
+    def fetch(self, tiles):
+        """ Download tiles which are not in the store yet, each one once """
+        tiles = sorted(set(tiles) - set(self.hashes))
+        with ThreadPoolExecutor(self.workers) as executor:
+            for tile, content_hash in zip(tiles, executor.map(self.fetch_tile, tiles)):
+                self.hashes[tile] = content_hash
+
+    def write(self, zipfile, tiles, prefix=''):
+        """ Add stored tiles to zipfile. Tiles must have been fetched before. """
+        for tile in sorted(tiles):
+            content_hash = self.hashes[tile]
+            if content_hash is None:
+                continue
+            arcname = '{prefix}{0}/{1}/{2}{ext}'.format(*tile, prefix=prefix, ext=self.extension)
+            if isinstance(zipfile, ManifestZipFile):
+                zipfile.write(self.path(content_hash), arcname, content_hash=content_hash)
             else:
-                self.zipfile.writestr(name, data)
+                zipfile.write(self.path(content_hash), arcname)
+
+
+# Tables embedded in synchronized files, besides their source objects
+REFERENCE_MODELS = (
+    'authent.structure', 'common.filetype', 'common.hdviewpoint', 'common.label', 'common.license',
+    'common.recordsource', 'common.reservationsystem', 'common.targetportal', 'common.theme',
+    'core.path', 'trekking.accessibility', 'trekking.accessibilitylevel', 'trekking.difficultylevel',
+    'trekking.orderedtrekchild', 'trekking.poitype', 'trekking.practice', 'trekking.rating',
+    'trekking.ratingscale', 'trekking.route', 'trekking.treknetwork', 'trekking.trekrelationship',
+    'trekking.weblink', 'trekking.weblinkcategory', 'tourism.cancellationreason',
+    'tourism.informationdesktype', 'tourism.labelaccessibility', 'tourism.touristiccontentcategory',
+    'tourism.touristiccontenttype', 'tourism.touristiceventplace', 'tourism.touristiceventtype',
+    'zoning.city', 'zoning.district', 'zoning.restrictedarea', 'zoning.restrictedareatype',
+    'altimetry.dem',
+)
+
+
+def templates_mtime():
+    """ Last modification date of template files, custom ones included """
+    return max((os.stat(os.path.join(root, name)).st_mtime_ns
+                for engine in engines.all()
+                for directory in engine.template_dirs
+                for root, dirs, files in os.walk(directory)
+                for name in files), default=None)
+
+
+def environment_stamps():
+    """
+    Stamps of what synchronized files depend on besides their source objects: Geotrek version,
+    templates, reference tables and DEM. Saved with the manifest options, so that files of
+    previous synchronization are not reused once one of them changed.
+    """
+    reference_models = [apps.get_model(label) for label in REFERENCE_MODELS
+                        if apps.is_installed('geotrek.{}'.format(label.split('.')[0]))]
+    return {
+        'version': geotrek.__version__,
+        'templates': templates_mtime(),
+        'references': get_versions(*reference_models),
+    }
+
+
+class SyncManifest:
+    """
+    Content hash of each synchronized file, with update dates of source objects it was generated from.
+    Saved along with synchronized files, it allows next synchronization to reuse files of unchanged
+    objects without rendering them again, and to rebuild only zip files whose members changed.
+    """
+    filename = 'manifest.json'
+
+    def __init__(self, dst_root, options):
+        self.options = options
+        self.files = {}
+        self.previous = {}
+        try:
+            with open(os.path.join(dst_root, self.filename)) as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            return
+        if manifest.get('options') == options:
+            self.previous = manifest.get('files', {})
+
+    @staticmethod
+    def sources_key(sources):
+        sources = sorted('{}.{}:{}:{}'.format(obj._meta.app_label, obj._meta.model_name, obj.pk,
+                                              getattr(obj, 'date_update', None)) for obj in sources)
+        return hashlib.sha1('\n'.join(sources).encode()).hexdigest()
+
+    def unchanged(self, name, sources):
+        """ Returns True if sources of file did not change since previous synchronization """
+        previous = self.previous.get(name, {}).get('sources')
+        return previous is not None and previous == self.sources_key(sources)
+
+    def reuse(self, name):
+        self.files[name] = self.previous[name]
+
+    def add(self, name, content, sources=None):
+        """
+        Record content of file.
+        Returns True if it is the same as previous synchronization, or None if unknown.
+        """
+        content_hash = hashlib.sha1(content).hexdigest()
+        self.files[name] = {
+            'hash': content_hash,
+            'sources': self.sources_key(sources) if sources is not None else None,
+        }
+        if name not in self.previous:
+            return None
+        return self.previous[name]['hash'] == content_hash
+
+    def file_hash(self, name, fullname):
+        """ Content hash of file if recorded, else its size and modification date """
+        if name in self.files:
+            return self.files[name]['hash']
+        stat = os.stat(fullname)
+        return '{}:{}'.format(stat.st_size, stat.st_mtime_ns)
+
+    def save(self, root):
+        with open(os.path.join(root, self.filename), 'w') as f:
+            json.dump({'options': self.options, 'files': self.files}, f)
+
+
+class ManifestZipFile:
+    """
+    Zip file of synchronized files, only written when closed if its members changed
+    since previous synchronization. Otherwise previous zip file is reused.
+    """
+    def __init__(self, manifest, tmp_root, dst_root, name):
+        self.manifest = manifest
+        self.tmp_root = tmp_root
+        self.dst_root = dst_root
+        self.name = name
+        self.members = {}
+        self.hashes = {}
+
+    def write(self, filename, arcname, content_hash=None):
+        """ Content hash may be given for files which are not synchronized files, e.g. stored tiles """
+        self.members[arcname] = filename
+        if content_hash is not None:
+            self.hashes[arcname] = content_hash
+
+    def namelist(self):
+        return list(self.members)
+
+    def close(self):
+        """ Returns True if previous zip file was reused """
+        members = sorted(
+            (arcname, self.hashes.get(arcname)
+             or self.manifest.file_hash(os.path.relpath(filename, self.tmp_root), filename))
+            for arcname, filename in self.members.items()
+        )
+        content_hash = hashlib.sha1(json.dumps(members).encode()).hexdigest()
+        self.manifest.files[self.name] = {'hash': content_hash, 'sources': None}
+        oldfilename = os.path.join(self.dst_root, self.name)
+        fullname = os.path.join(self.tmp_root, self.name)
+        previous = self.manifest.previous.get(self.name, {})
+        if previous.get('hash') == content_hash and os.path.isfile(oldfilename):
+            if os.path.isfile(fullname):
+                os.unlink(fullname)
+            os.link(oldfilename, fullname)
+            return True
+        with ZipFile(fullname, 'w') as zipfile:
+            for arcname, filename in self.members.items():
+                zipfile.write(filename, arcname)
+        return False
+
+
+def close_zips(zipfiles, workers=8):
+    """ Close manifest zip files in parallel. Returns True for each one whose previous zip file was reused """
+    with ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(ManifestZipFile.close, zipfiles))
 
 
 class SyncRando:
@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from geotrek.common.models import Attachment
+from geotrek.common.thumbnails import generate_thumbnails
+
+
+class Command(BaseCommand):
+    help = "Generate thumbnails of all attached pictures which are not generated yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', dest='workers', type=int, default=1,
+                            help='Number of pictures processed in parallel')
+
+    def generate(self, attachment):
+        try:
+            return attachment, generate_thumbnails(attachment)
+        finally:
+            if self.workers > 1:
+                # Each worker thread has its own connection
+                connection.close()
+
+    def handle(self, *args, **options):
+        self.workers = options['workers']
+        if self.workers < 1:
+            raise CommandError('Number of workers must be positive.')
+        attachments = Attachment.objects.filter(is_image=True).exclude(attachment_file='').order_by('pk')
+        total = 0
+        executor = ThreadPoolExecutor(self.workers) if self.workers > 1 else None
+        results = executor.map(self.generate, attachments) if executor else map(self.generate, attachments)
+        try:
+            for attachment, generated in results:
+                total += generated
+                if generated and options['verbosity'] > 1:
+                    self.stdout.write("{pict}: {count} thumbnails generated".format(
+                        pict=attachment.attachment_file.name, count=generated))
+        finally:
+            if executor:
+                executor.shutdown()
+        if options['verbosity'] > 0:
+            self.stdout.write("{count} thumbnails generated".format(count=total))
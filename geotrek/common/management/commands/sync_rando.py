@@ -1,16 +1,20 @@
 import argparse
+import contextlib
+import json
 import logging
-import filecmp
+import multiprocessing
 import os
 import stat
 import shutil
 import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from time import sleep
 from zipfile import ZipFile
 
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
 from django.db.models import Q
 from django.http import StreamingHttpResponse
 from django.test.client import RequestFactory
@@ -48,8 +52,22 @@ from geotrek.tourism import urls  # NOQA
 
 logger = logging.getLogger(__name__)
 
+# Command instance shared with forked worker processes
+_sync_command = None
+
+
+def _sync_unit(index, lang):
+    """ Worker process entry point, see ``Command.sync_unit()`` """
+    return index, lang, _sync_command.sync_unit(index, lang)
+
 
 class Command(BaseCommand):
+    checkpoint_name = 'checkpoint.json'
+    # Options that must not change to resume an interrupted synchronization or reuse previous files
+    sync_options = ('path', 'url', 'rando_url', 'source', 'portal', 'skip_pdf', 'skip_tiles', 'skip_dem',
+                    'skip_profile_png', 'languages', 'with_events', 'content_categories', 'with_signages',
+                    'with_infrastructures', 'with_dives')
+
     def add_arguments(self, parser):
         parser.add_argument('path')
         parser.add_argument('--empty-tmp-folder', dest='empty_tmp_folder', action='store_true', default=False,
@@ -79,19 +97,22 @@ class Command(BaseCommand):
                             default=False, help='include infrastructures')
         parser.add_argument('--with-dives', action='store_true', dest='with_dives',
                             default=False, help='include dives')
+        parser.add_argument('--processes', '-j', type=int, dest='processes', default=1,
+                            help='Number of processes synchronizing applications and languages in parallel')
+        parser.add_argument('--resume', action='store_true', dest='resume', default=False,
+                            help='Resume an interrupted synchronization, without regenerating finished parts')
         parser.add_argument('--task', default=None, help=argparse.SUPPRESS)
 
     def mkdirs(self, name):
         dirname = os.path.dirname(name)
-        if not os.path.exists(dirname):
-            os.makedirs(dirname)
+        os.makedirs(dirname, exist_ok=True)
 
     def get_params_portal(self, params):
         if self.portal:
             params['portal'] = self.portal
 
-    def sync_global_tiles(self):
-        """ Creates a tiles file on the global extent.
+    def sync_global_tiles(self, tiles):
+        """ Creates a tiles file on the global extent, from tiles store.
         """
         zipname = os.path.join('zip', 'tiles', 'global.zip')
 
@@ -99,61 +120,33 @@ class Command(BaseCommand):
             self.stdout.write("\x1b[36m**\x1b[0m \x1b[1m{name}\x1b[0m ...".format(name=zipname), ending="")
             self.stdout._out.flush()
 
-        global_extent = settings.LEAFLET_CONFIG['SPATIAL_EXTENT']
-
-        logger.info("Global extent is %s" % str(global_extent))
-        global_file = os.path.join(self.tmp_root, zipname)
-
         logger.info("Build global tiles file...")
-        self.mkdirs(global_file)
-
-        zipfile = ZipFile(global_file, 'w')
-        tiles = common_sync.ZipTilesBuilder(zipfile, **self.builder_args)
-        tiles.add_coverage(bbox=global_extent,
-                           zoomlevels=settings.MOBILE_TILES_GLOBAL_ZOOMS)
-        tiles.run()
+        zipfile = self.open_zip(zipname)
+        self.tiles_store.write(zipfile, tiles)
         self.close_zip(zipfile, zipname)
 
-    def sync_trek_tiles(self, trek):
-        """ Creates a tiles file for the specified Trek object.
+    def sync_treks_tiles(self, treks_tiles):
+        """ Creates a tiles file for each trek, from tiles store. Zip files are written in parallel.
         """
-        zipname = os.path.join('zip', 'tiles', '{pk}.zip'.format(pk=trek.pk))
-
+        zipnames = [os.path.join('zip', 'tiles', '{pk}.zip'.format(pk=pk)) for pk in treks_tiles]
+        zipfiles = []
+        for zipname, tiles in zip(zipnames, treks_tiles.values()):
+            zipfile = self.open_zip(zipname)
+            self.tiles_store.write(zipfile, tiles)
+            zipfiles.append(zipfile)
+        uptodates = common_sync.close_zips(zipfiles, self.tiles_store.workers)
         if self.verbosity == 2:
-            self.stdout.write("{name} ...".format(name=zipname), ending="")
-            self.stdout._out.flush()
-
-        trek_file = os.path.join(self.tmp_root, zipname)
-
-        def _radius2bbox(lng, lat, radius):
-            return (lng - radius, lat - radius,
-                    lng + radius, lat + radius)
+            for zipname, uptodate in zip(zipnames, uptodates):
+                self.stdout.write("{name} ...{status}".format(name=zipname, status="unchanged" if uptodate else "zipped"))
 
-        self.mkdirs(trek_file)
+    def get_sources(self, obj):
+        """ Objects whose updates imply to generate again files of given object """
+        sources = [obj]
+        if hasattr(obj, 'attachments'):
+            sources += list(obj.attachments.all())
+        return sources
 
-        zipfile = ZipFile(trek_file, 'w')
-        tiles = common_sync.ZipTilesBuilder(zipfile, **self.builder_args)
-
-        geom = trek.geom
-        if geom.geom_type == 'MultiLineString':
-            geom = geom[0]  # FIXME
-        geom.transform(4326)
-
-        for (lng, lat) in geom.coords:
-            large = _radius2bbox(lng, lat, settings.MOBILE_TILES_RADIUS_LARGE)
-            small = _radius2bbox(lng, lat, settings.MOBILE_TILES_RADIUS_SMALL)
-            tiles.add_coverage(bbox=large, zoomlevels=settings.MOBILE_TILES_LOW_ZOOMS)
-            tiles.add_coverage(bbox=small, zoomlevels=settings.MOBILE_TILES_HIGH_ZOOMS)
-
-        tiles.run()
-        self.close_zip(zipfile, zipname)
-
-    def sync_view(self, lang, view, name, url='/', params={}, zipfile=None, fix2028=False, **kwargs):
-        if self.verbosity == 2:
-            self.stdout.write("{lang} {name} ...".format(lang=lang, name=name), ending="")
-            self.stdout._out.flush()
-        fullname = os.path.join(self.tmp_root, name)
-        self.mkdirs(fullname)
+    def render_view(self, lang, view, url='/', params={}, fix2028=False, **kwargs):
         request = self.factory.get(url, params, HTTP_HOST=self.host, secure=self.secure)
         request.LANGUAGE_CODE = lang
         request.user = AnonymousUser()
@@ -167,13 +160,12 @@ class Command(BaseCommand):
                 self.stdout.write("\x1b[3D\x1b[31mfailed ({})\x1b[0m".format(e))
             if settings.DEBUG:
                 raise
-            return
+            return None
         if response.status_code != 200:
             self.successfull = False
             if self.verbosity > 0:
                 self.stderr.write(self.style.ERROR("failed (HTTP {code})".format(code=response.status_code)))
-            return
-        f = open(fullname, 'wb')
+            return None
         if isinstance(response, StreamingHttpResponse):
             content = b''.join(response.streaming_content)
         else:
@@ -182,13 +174,34 @@ class Command(BaseCommand):
         if fix2028:
             content = content.replace(b'\\u2028', b'\\n')
             content = content.replace(b'\\u2029', b'\\n')
-        f.write(content)
-        f.close()
+        return content
+
+    def sync_view(self, lang, view, name, url='/', params={}, zipfile=None, fix2028=False, sources=None, **kwargs):
+        """ Render view into file. If sources objects are given and did not change since previous
+        synchronization, previous file is reused without rendering the view.
+        """
+        if self.verbosity == 2:
+            self.stdout.write("{lang} {name} ...".format(lang=lang, name=name), ending="")
+            self.stdout._out.flush()
+        fullname = os.path.join(self.tmp_root, name)
+        self.mkdirs(fullname)
         oldfilename = os.path.join(self.dst_root, name)
+        if sources is not None and self.manifest.unchanged(name, sources) and os.path.isfile(oldfilename):
+            unchanged = True
+            self.manifest.reuse(name)
+        else:
+            content = self.render_view(lang, view, url=url, params=params, fix2028=fix2028, **kwargs)
+            if content is None:
+                return
+            unchanged = self.manifest.add(name, content, sources)
+            if unchanged is None:
+                unchanged = os.path.isfile(oldfilename) and self.same_content(oldfilename, content)
+            unchanged = unchanged and os.path.isfile(oldfilename)
+            if not unchanged:
+                self.replace_file(fullname, lambda tmpname: self.write_file(tmpname, content))
         # If new file is identical to old one, don't recreate it. This will help backup
-        if os.path.isfile(oldfilename) and filecmp.cmp(fullname, oldfilename):
-            os.unlink(fullname)
-            os.link(oldfilename, fullname)
+        if unchanged:
+            self.replace_file(fullname, lambda tmpname: os.link(oldfilename, tmpname))
             if self.verbosity == 2:
                 self.stdout.write("unchanged")
         else:
@@ -199,6 +212,23 @@ class Command(BaseCommand):
             if name not in zipfile.namelist():
                 zipfile.write(fullname, name)
 
+    def replace_file(self, fullname, create):
+        """ Create file through a temporary name of this process, then move it in place at once,
+        since several processes may synchronize the same file """
+        tmpname = '{}.{}.tmp'.format(fullname, os.getpid())
+        if os.path.lexists(tmpname):
+            os.unlink(tmpname)  # Left by an interrupted synchronization
+        create(tmpname)
+        os.replace(tmpname, fullname)
+
+    def write_file(self, filename, content):
+        with open(filename, 'wb') as f:
+            f.write(content)
+
+    def same_content(self, filename, content):
+        with open(filename, 'rb') as f:
+            return f.read() == content
+
     def sync_json(self, lang, viewset, name, zipfile=None, params={}, as_view_args=[], **kwargs):
         view = viewset.as_view(*as_view_args)
         name = os.path.join('api', lang, '{name}.json'.format(name=name))
@@ -220,12 +250,12 @@ class Command(BaseCommand):
 
         self.sync_view(lang, view, name, params=params, zipfile=zipfile, fix2028=True, **kwargs)
 
-    def sync_object_view(self, lang, obj, view, basename_fmt, zipfile=None, params={}, **kwargs):
+    def sync_object_view(self, lang, obj, view, basename_fmt, zipfile=None, params={}, sources=None, **kwargs):
         translation.activate(lang)
         modelname = obj._meta.model_name
         name = os.path.join('api', lang, '{modelname}s'.format(modelname=modelname), str(obj.pk),
                             basename_fmt.format(obj=obj))
-        self.sync_view(lang, view, name, params=params, zipfile=zipfile, pk=obj.pk, **kwargs)
+        self.sync_view(lang, view, name, params=params, zipfile=zipfile, pk=obj.pk, sources=sources, **kwargs)
         translation.deactivate()
 
     def sync_profile_json(self, lang, obj, zipfile=None):
@@ -248,7 +278,7 @@ class Command(BaseCommand):
         self.get_params_portal(params)
         if obj:
             name = os.path.join('meta', lang, obj.rando_url, 'index.html')
-            self.sync_view(lang, metaview.as_view(), name, pk=obj.pk, params=params)
+            self.sync_view(lang, metaview.as_view(), name, pk=obj.pk, params=params, sources=self.get_sources(obj))
         else:
             name = os.path.join('meta', lang, 'index.html')
             self.sync_view(lang, metaview.as_view(), name, params=params)
@@ -264,7 +294,10 @@ class Command(BaseCommand):
                 self.stdout.write("\x1b[36m{lang}\x1b[0m \x1b[1m{url}/{name}\x1b[0m \x1b[31mfile does not exist\x1b[0m".format(lang=lang, url=url, name=name))
             return
         if not os.path.isfile(dst):
-            os.link(src, dst)
+            try:
+                os.link(src, dst)
+            except FileExistsError:
+                pass  # Linked meanwhile by another process
         if zipfile:
             zipfile.write(dst, os.path.join(url, name))
         if self.verbosity == 2:
@@ -282,7 +315,17 @@ class Command(BaseCommand):
             for obj in model.objects.all():
                 self.sync_media_file(lang, obj.pictogram, zipfile=zipfile)
 
+    def open_zip(self, name):
+        """ Zip file of synchronized files, only written if its members changed """
+        self.mkdirs(os.path.join(self.tmp_root, name))
+        return common_sync.ManifestZipFile(self.manifest, self.tmp_root, self.dst_root, name)
+
     def close_zip(self, zipfile, name):
+        if isinstance(zipfile, common_sync.ManifestZipFile):
+            uptodate = zipfile.close()
+            if self.verbosity == 2:
+                self.stdout.write("unchanged" if uptodate else "zipped")
+            return
         oldzipfilename = os.path.join(self.dst_root, name)
         zipfilename = os.path.join(self.tmp_root, name)
         try:
@@ -320,7 +363,27 @@ class Command(BaseCommand):
                     }
                 )
 
-            self.sync_global_tiles()
+            # Union of tiles of all zip files is downloaded once
+            self.tiles_store = common_sync.TilesStore(os.path.join(self.work_root, 'tiles'), **self.builder_args)
+            global_extent = settings.LEAFLET_CONFIG['SPATIAL_EXTENT']
+            logger.info("Global extent is %s" % str(global_extent))
+            global_tiles = self.tiles_store.coverage(global_extent, settings.MOBILE_TILES_GLOBAL_ZOOMS)
+
+            treks = trekking_models.Trek.objects.existing().order_by('pk')
+            if self.source:
+                treks = treks.filter(source__name__in=self.source)
+
+            if self.portal:
+                treks = treks.filter(Q(portal__name=self.portal) | Q(portal=None))
+
+            treks_tiles = {
+                trek.pk: self.tiles_store.trek_coverage(trek.geom)
+                for trek in treks
+                if trek.any_published or any([parent.any_published for parent in trek.parents])
+            }
+            self.tiles_store.fetch(global_tiles.union(*treks_tiles.values()))
+
+            self.sync_global_tiles(global_tiles)
 
             if self.celery_task:
                 self.celery_task.update_state(
@@ -333,16 +396,7 @@ class Command(BaseCommand):
                     }
                 )
 
-            treks = trekking_models.Trek.objects.existing().order_by('pk')
-            if self.source:
-                treks = treks.filter(source__name__in=self.source)
-
-            if self.portal:
-                treks = treks.filter(Q(portal__name=self.portal) | Q(portal=None))
-
-            for trek in treks:
-                if trek.any_published or any([parent.any_published for parent in trek.parents]):
-                    self.sync_trek_tiles(trek)
+            self.sync_treks_tiles(treks_tiles)
 
             if self.celery_task:
                 self.celery_task.update_state(
@@ -355,7 +409,7 @@ class Command(BaseCommand):
                     }
                 )
 
-    def sync_pdf(self, lang, obj, view):
+    def sync_pdf(self, lang, obj, view, sources=None):
         if self.skip_pdf:
             return
         try:
@@ -370,6 +424,8 @@ class Command(BaseCommand):
             dst = os.path.join(self.tmp_root, 'api', lang, '{modelname}s'.format(modelname=modelname), str(obj.pk),
                                obj.slug + '.pdf')
             self.mkdirs(dst)
+            if os.path.isfile(dst):
+                os.unlink(dst)  # Left by an interrupted synchronization
             os.link(src, dst)
             if self.verbosity == 2:
                 self.stdout.write("\x1b[36m{lang}\x1b[0m \x1b[1m{dst}\x1b[0m \x1b[32mcopied\x1b[0m".format(lang=lang,
@@ -381,12 +437,11 @@ class Command(BaseCommand):
             if self.source:
                 params['source'] = self.source[0]
             self.get_params_portal(params)
-            self.sync_object_view(lang, obj, view, '{obj.slug}.pdf', params=params, slug=obj.slug)
+            if sources is None:
+                sources = self.get_sources(obj)
+            self.sync_object_view(lang, obj, view, '{obj.slug}.pdf', params=params, slug=obj.slug, sources=sources)
 
-    def sync(self):
-        step_value = int(50 / len(settings.MODELTRANSLATION_LANGUAGES))
-        current_value = 30
-        self.sync_tiles()
+    def get_subcommands(self):
         subcommands = [trekking_sync.SyncRando(self), common_sync.SyncRando(self)]
         if self.with_signages and 'geotrek.signage' in settings.INSTALLED_APPS:
             subcommands.append(signage_sync.SyncRando(self))
@@ -402,33 +457,119 @@ class Command(BaseCommand):
             subcommands.append(tourism_sync.SyncRando(self))
         if 'geotrek.sensitivity' in settings.INSTALLED_APPS:
             subcommands.append(sensitivity_sync.SyncRando(self))
-        for subcommand in subcommands:
-            for lang in self.languages:
-                if self.celery_task:
-                    self.celery_task.update_state(
-                        state='PROGRESS',
-                        meta={
-                            'name': self.celery_task.name,
-                            'current': current_value + step_value,
-                            'total': 100,
-                            'infos': "{} : {} ...".format(_("Language"), lang)
-                        }
-                    )
-                    current_value = current_value + step_value
-
-                zipname = os.path.join('zip', 'treks', lang, 'global.zip')
-                zipfullname = os.path.join(self.tmp_root, zipname)
-                self.mkdirs(zipfullname)
-                self.zipfile = ZipFile(zipfullname, 'w')
-
-                translation.activate(lang)
-                subcommand.sync(lang)
-                translation.deactivate()
-
-                if self.verbosity == 2:
-                    self.stdout.write("{lang} {name} ...".format(lang=lang, name=zipname), ending="")
-
-                self.close_zip(self.zipfile, zipname)
+        return subcommands
+
+    def unit_name(self, index, lang):
+        subcommand = self.subcommands[index]
+        return '{module}-{lang}'.format(module=type(subcommand).__module__.split('.')[1], lang=lang)
+
+    def unit_filename(self, index, lang):
+        return os.path.join(self.work_root, 'units', '{}.json'.format(self.unit_name(index, lang)))
+
+    def sync_unit(self, index, lang):
+        """ Synchronize one application in one language.
+        Members of global zip and manifest records are saved in a file of their own,
+        merged at the end of synchronization.
+        Returns True if synchronization is successfull.
+        """
+        previous, self.successfull = self.successfull, True
+        files, self.manifest.files = self.manifest.files, {}
+        self.zipfile = common_sync.ManifestZipFile(self.manifest, self.tmp_root, self.dst_root, None)
+
+        translation.activate(lang)
+        self.subcommands[index].sync(lang)
+        translation.deactivate()
+
+        filename = self.unit_filename(index, lang)
+        self.mkdirs(filename)
+        with open(filename, 'w') as f:
+            json.dump({'members': self.zipfile.members, 'files': self.manifest.files}, f)
+        self.manifest.files = files
+        successfull, self.successfull = self.successfull, previous
+        return successfull
+
+    def sync_units(self, units):
+        """ Run synchronization units, in worker processes if asked for.
+        Yields (index, lang, successfull) as soon as each unit is finished.
+        """
+        if self.processes <= 1:
+            for index, lang in units:
+                yield index, lang, self.sync_unit(index, lang)
+            return
+        global _sync_command
+        _sync_command = self
+        # Worker processes are forked and must not share parent database connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=self.processes,
+                                 mp_context=multiprocessing.get_context('fork')) as executor:
+            futures = [executor.submit(_sync_unit, index, lang) for index, lang in units]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def read_checkpoint(self):
+        """ Returns names of units already synchronized by a previous run with same options """
+        try:
+            with open(os.path.join(self.work_root, self.checkpoint_name)) as f:
+                checkpoint = json.load(f)
+        except (IOError, ValueError):
+            return set()
+        if checkpoint.get('options') != self.options_fingerprint:
+            return set()
+        return set(checkpoint.get('done', []))
+
+    def write_checkpoint(self, done):
+        filename = os.path.join(self.work_root, self.checkpoint_name)
+        with open(filename + '.tmp', 'w') as f:
+            json.dump({'options': self.options_fingerprint, 'done': sorted(done)}, f)
+        os.replace(filename + '.tmp', filename)
+
+    def merge_zips(self, lang):
+        zipname = os.path.join('zip', 'treks', lang, 'global.zip')
+        zipfile = self.open_zip(zipname)
+        for index in range(len(self.subcommands)):
+            with open(self.unit_filename(index, lang)) as f:
+                unit = json.load(f)
+            self.manifest.files.update(unit['files'])
+            for arcname, filename in unit['members'].items():
+                if arcname not in zipfile.members:
+                    zipfile.write(filename, arcname)
+
+        if self.verbosity == 2:
+            self.stdout.write("{lang} {name} ...".format(lang=lang, name=zipname), ending="")
+
+        self.close_zip(zipfile, zipname)
+
+    def sync(self):
+        done = self.read_checkpoint()
+        if 'tiles' not in done:
+            self.sync_tiles()
+            done.add('tiles')
+            self.write_checkpoint(done)
+        self.subcommands = self.get_subcommands()
+        units = [(index, lang) for index in range(len(self.subcommands)) for lang in self.languages]
+        total = len(units)
+        units = [(index, lang) for index, lang in units if self.unit_name(index, lang) not in done]
+        finished = total - len(units)
+        for index, lang, successfull in self.sync_units(units):
+            finished += 1
+            if successfull:
+                done.add(self.unit_name(index, lang))
+                self.write_checkpoint(done)
+            else:
+                self.successfull = False
+            if self.celery_task:
+                self.celery_task.update_state(
+                    state='PROGRESS',
+                    meta={
+                        'name': self.celery_task.name,
+                        'current': 30 + int(50 * finished / total),
+                        'total': 100,
+                        'infos': "{} : {} ...".format(_("Language"), lang)
+                    }
+                )
+
+        for lang in self.languages:
+            self.merge_zips(lang)
 
         self.sync_static_file('**', 'tourism/touristicevent.svg')
         self.sync_pictograms('**', [tourism_models.InformationDeskType, tourism_models.TouristicContentCategory,
@@ -438,7 +579,7 @@ class Command(BaseCommand):
         if not os.path.exists(self.dst_root):
             return
         existing = set([os.path.basename(p) for p in os.listdir(self.dst_root)])
-        remaining = existing - set(('api', 'media', 'meta', 'static', 'zip'))
+        remaining = existing - set(('api', 'media', 'meta', 'static', 'zip', common_sync.SyncManifest.filename))
         if remaining:
             raise CommandError("Destination directory contains extra data")
 
@@ -491,6 +632,10 @@ class Command(BaseCommand):
         self.with_infrastructures = options.get('with_infrastructures', False)
         self.with_dives = options.get('with_dives', False)
         self.celery_task = options.get('task', None)
+        self.processes = options.get('processes', 1)
+        self.options_fingerprint = {name: options.get(name) for name in self.sync_options}
+        self.options_fingerprint['environment'] = common_sync.environment_stamps()
+        self.manifest = common_sync.SyncManifest(self.dst_root, self.options_fingerprint)
 
         if self.source is not None:
             self.source = self.source.split(',')
@@ -514,8 +659,17 @@ class Command(BaseCommand):
             os.mkdir(settings.TMP_DIR)
         if not os.path.exists(sync_rando_tmp_dir):
             os.mkdir(sync_rando_tmp_dir)
-        with tempfile.TemporaryDirectory(dir=sync_rando_tmp_dir) as tmp_dir:
-            self.tmp_root = tmp_dir
+        if options.get('resume'):
+            # Keep work directory if synchronization is interrupted
+            work_dir = contextlib.nullcontext(os.path.join(sync_rando_tmp_dir, 'resume'))
+        else:
+            work_dir = tempfile.TemporaryDirectory(dir=sync_rando_tmp_dir)
+        with work_dir as work_root:
+            self.work_root = work_root
+            if options.get('resume') and not self.read_checkpoint() and os.path.exists(work_root):
+                shutil.rmtree(work_root)  # Left by a synchronization with other options
+            self.tmp_root = os.path.join(work_root, 'sync')
+            os.makedirs(self.tmp_root, exist_ok=True)
             self.sync()
             if self.celery_task:
                 self.celery_task.update_state(
@@ -527,7 +681,10 @@ class Command(BaseCommand):
                         'infos': "{}".format(_("Sync ended"))
                     }
                 )
+            self.manifest.save(self.tmp_root)
             self.rename_root()
+            if options.get('resume'):
+                shutil.rmtree(work_root)
 
         done_message = 'Done'
         if self.successfull:
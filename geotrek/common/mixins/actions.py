@@ -2,6 +2,8 @@ from django.db import transaction
 from django.db.models import ForeignKey, ManyToManyField
 from django.utils.translation import gettext_lazy as _
 
+from geotrek.common.versions import bump_versions
+
 
 @transaction.atomic
 def apply_merge(modeladmin, request, queryset):
@@ -17,6 +19,7 @@ def apply_merge(modeladmin, request, queryset):
             remote_field = field.remote_field.name
             if isinstance(field.remote_field, ForeignKey):
                 field.remote_field.model.objects.filter(**{'%s__in' % remote_field: tail}).update(**{remote_field: main})
+                bump_versions(field.remote_field.model)
             elif isinstance(field.remote_field, ManyToManyField):
                 for element in field.remote_field.model.objects.filter(**{'%s__in' % remote_field: tail}):
                     getattr(element, remote_field).add(main)
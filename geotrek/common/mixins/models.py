@@ -1,5 +1,4 @@
 import datetime
-import hashlib
 import os
 import shutil
 import uuid
@@ -17,10 +16,10 @@ from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
 from easy_thumbnails.alias import aliases
 from easy_thumbnails.exceptions import InvalidImageFormatError
-from easy_thumbnails.files import get_thumbnailer
 from embed_video.backends import detect_backend, VideoDoesntExistException
 
 from geotrek.common.mixins.managers import NoDeleteManager
+from geotrek.common.thumbnails import get_thumbnail, watermark_options
 from geotrek.common.utils import classproperty, logger
 
 from mapentity.models import MapEntityMixin
@@ -139,20 +138,8 @@ class PicturesMixin:
     def resized_pictures(self):
         resized = []
         for picture in self.pictures:
-            thumbnailer = get_thumbnailer(picture.attachment_file)
             try:
-                # Uppercase options aren't used by prepared options (a primary
-                # use of prepared options is to generate the filename -- these
-                # options don't alter the filename).
-                text = settings.THUMBNAIL_COPYRIGHT_FORMAT.format(author=picture.author, title=picture.title,
-                                                                  legend=picture.legend)
-                ali = thumbnailer.get_options({'size': (800, 800),
-                                               'TEXT': text,
-                                               'SIZE_WATERMARK': settings.THUMBNAIL_COPYRIGHT_SIZE,
-                                               'watermark': hashlib.md5(text.encode('utf-8')).hexdigest()
-                                               })
-
-                thdetail = thumbnailer.get_thumbnail(ali)
+                thdetail = get_thumbnail(picture, watermark_options(picture))
             except (IOError, InvalidImageFormatError, DecompressionBombError) as e:
                 logger.info(_("Image {} invalid or missing from disk: {}.").format(picture.attachment_file, e))
             else:
@@ -162,9 +149,8 @@ class PicturesMixin:
     @property
     def picture_print(self):
         for picture in self.pictures:
-            thumbnailer = get_thumbnailer(picture.attachment_file)
             try:
-                thumbnail = thumbnailer.get_thumbnail(aliases.get('print'))
+                thumbnail = get_thumbnail(picture, aliases.get('print'))
             except (IOError, InvalidImageFormatError, DecompressionBombError) as e:
                 logger.info(_("Image {} invalid or missing from disk: {}.").format(picture.attachment_file, e))
                 continue
@@ -176,9 +162,8 @@ class PicturesMixin:
     @property
     def thumbnail(self):
         for picture in self.pictures:
-            thumbnailer = get_thumbnailer(picture.attachment_file)
             try:
-                thumbnail = thumbnailer.get_thumbnail(aliases.get('small-square'))
+                thumbnail = get_thumbnail(picture, aliases.get('small-square'))
             except (IOError, InvalidImageFormatError, DecompressionBombError) as e:
                 logger.info(_("Image {} invalid or missing from disk: {}.").format(picture.attachment_file, e))
                 continue
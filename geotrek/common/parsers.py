@@ -1,4 +1,5 @@
 from io import BytesIO
+import datetime
 import importlib
 import json
 import os
@@ -9,9 +10,10 @@ from requests.auth import HTTPBasicAuth
 import textwrap
 import xlrd
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from functools import reduce
 from collections import Iterable
-from time import sleep
+from time import sleep, time
 from PIL import Image, UnidentifiedImageError
 
 from ftplib import FTP
@@ -19,22 +21,28 @@ from os.path import dirname
 from urllib.parse import urlparse
 
 from django.contrib.gis.geos import GEOSGeometry, WKBWriter
-from django.db import models, connection
+from django.db import models, connection, transaction
+from django.db.models.signals import m2m_changed, post_save
 from django.db.utils import DatabaseError, InternalError
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.gis.gdal import DataSource, GDALException, CoordTransform
 from django.contrib.gis.geos import Point, Polygon
-from django.core.exceptions import ImproperlyConfigured
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured, ValidationError
 from django.core.files.base import ContentFile
 from django.template.loader import render_to_string
-from django.utils import translation
+from django.utils import timezone, translation
 from django.utils.translation import gettext as _
 from django.utils.encoding import force_str
 from django.conf import settings
 from paperclip.models import attachment_upload
 
 from geotrek.authent.models import default_structure
+from geotrek.common.mixins.models import BasePublishableMixin, PublishableMixin
 from geotrek.common.models import FileType, Attachment, License
+from geotrek.common.signals import bump_model_version, bump_related_models_versions
+from geotrek.common.thumbnails import queue_thumbnails
+from geotrek.common.versions import bump_versions
 from geotrek.common.utils.parsers import add_http_prefix
 from geotrek.common.utils.translation import get_translated_fields
 
@@ -69,6 +77,7 @@ class Parser:
     """
     provider: Allow to differentiate multiple Parser for the same model
     default_language: Allow to define which language this parser will populate by default
+    bulk_size: Parse rows by chunks of this size, fetching existing objects and writing them in bulk (0 to disable)
     """
     label = None
     model = None
@@ -93,6 +102,8 @@ class Parser:
     natural_keys = {}
     field_options = {}
     default_language = None
+    bulk_size = 0
+    session = None  # requests.Session shared by parsers fetching the same host
 
     def __init__(self, progress_cb=None, user=None, encoding='utf8'):
         self.warnings = {}
@@ -106,6 +117,12 @@ class Parser:
         self.structure = user and user.profile.structure or default_structure()
         self.encoding = encoding
         self.translated_fields = get_translated_fields(self.model)
+        self.prefetched = None
+        self.related = {}
+        self.to_create = []
+        self.to_update = {}
+        self.pending_m2m = {}
+        self.pending_non_fields = {}
 
         if self.fields is None:
             self.fields = {
@@ -117,12 +134,70 @@ class Parser:
                 f.name: force_str(f.verbose_name)
                 for f in self.model._meta.many_to_many
             }
+        self.bulk_save = bool(self.bulk_size) and self.can_bulk_save()
+        self.activate_language()
 
+    def activate_language(self):
+        """Activate import language in current thread"""
         if self.default_language and self.default_language in settings.MODELTRANSLATION_LANGUAGES:
             translation.activate(self.default_language)
         else:
             translation.activate(settings.MODELTRANSLATION_DEFAULT_LANGUAGE)
 
+    def can_bulk_save(self):
+        """Objects are written with bulk queries only if nothing is bound to their individual save,
+        except save() overrides replicated by prepare_bulk_object(). Non fields are parsed once
+        objects are written, and post_save receivers are called by send_post_save()."""
+        for cls in self.model.__mro__:
+            if cls is not models.Model and 'save' in cls.__dict__ and not self.can_skip_save(cls):
+                return False
+        for dst in list(self.m2m_fields) + list(self.m2m_constant_fields):
+            try:
+                field = self.model._meta.get_field(dst)
+            except FieldDoesNotExist:
+                return False
+            through = field.remote_field.through
+            if not through._meta.auto_created:
+                return False
+            # Versions are bumped by flush_m2m()
+            receivers = m2m_changed._live_receivers(through)
+            if any(receiver is not bump_related_models_versions for receiver in receivers):
+                return False
+        return True
+
+    def can_skip_save(self, cls):
+        """Whether save() override of given class can be skipped by bulk writes"""
+        if cls is BasePublishableMixin:
+            # Publication date is set by prepare_bulk_object()
+            return True
+        if cls is PublishableMixin:
+            # Review alerts are only sent when review flag changes
+            return 'review' not in self.fields and 'review' not in self.constant_fields
+        return False
+
+    def prepare_bulk_object(self, obj):
+        """Apply skipped save() overrides to an object before it is written in bulk"""
+        if isinstance(obj, BasePublishableMixin):
+            if obj.publication_date is None and obj.any_published:
+                obj.publication_date = datetime.date.today()
+            if obj.publication_date is not None and not obj.any_published:
+                obj.publication_date = None
+
+    def send_post_save(self, objects, created):
+        """Call post_save receivers for objects written in bulk, as a save() would.
+        objects is a list of (object, update fields or None), versions are bumped once by flush()"""
+        receivers = [receiver for receiver in post_save._live_receivers(self.model) if receiver is not bump_model_version]
+        for obj, update_fields in objects:
+            for receiver in receivers:
+                receiver(signal=post_save, sender=self.model, instance=obj, created=created,
+                         update_fields=update_fields, raw=False, using=obj._state.db)
+
+    def discard_prefetched(self, obj):
+        """Forget an object which could not be created, rows with the same eid will create it again"""
+        if self.prefetched is not None and obj.pk is None:
+            key = self.get_eid_key(getattr(obj, self.eid))
+            self.prefetched[key] = [other for other in self.prefetched.get(key, []) if other is not obj]
+
     def normalize_field_name(self, name):
         return name.upper()
 
@@ -204,25 +279,37 @@ class Parser:
         if isinstance(field, models.CharField):
             val = str(val)[:256]
         if isinstance(field, models.ManyToManyField):
-            fk = getattr(self.obj, dst)
-            fk.set(val)
+            if self.bulk_save:
+                self.pending_m2m.setdefault(id(self.obj), (self.line, self.obj, {}))[2][dst] = val
+            else:
+                fk = getattr(self.obj, dst)
+                fk.set(val)
         else:
             setattr(self.obj, dst, val)
 
+    def get_m2m_value(self, dst):
+        pending = self.pending_m2m.get(id(self.obj))
+        if pending and dst in pending[2]:
+            return set(pending[2][dst])
+        if self.obj.pk is None:
+            return set()
+        return set(getattr(self.obj, dst).all())
+
     def parse_real_field(self, dst, src, val):
         """Returns True if modified"""
-        if hasattr(self.obj, dst):
-            if dst in self.m2m_fields or dst in self.m2m_constant_fields:
-                old = set(getattr(self.obj, dst).all())
-            else:
-                old = getattr(self.obj, dst)
+        m2m = dst in self.m2m_fields or dst in self.m2m_constant_fields
+        has_old = m2m or hasattr(self.obj, dst)
+        if m2m:
+            old = self.get_m2m_value(dst)
+        elif has_old:
+            old = getattr(self.obj, dst)
 
         if hasattr(self, 'filter_{0}'.format(dst)):
             val = getattr(self, 'filter_{0}'.format(dst))(src, val)
         else:
             val = self.apply_filter(dst, src, val)
-        if hasattr(self.obj, dst):
-            if dst in self.m2m_fields or dst in self.m2m_constant_fields:
+        if has_old:
+            if m2m:
                 val = set(val)
                 if dst in self.m2m_aggregate_fields:
                     val = val | old
@@ -322,16 +409,28 @@ class Parser:
                 update_fields.remove('id')  # Can't update primary key
         except RowImportError as warnings:
             self.add_warning(str(warnings))
+            self.discard_prefetched(self.obj)
             return
         if operation == "created":
             if hasattr(self.model, 'provider') and self.provider is not None and not self.obj.provider:
                 self.obj.provider = self.provider
-            self.obj.save()
+            if self.bulk_save:
+                self.to_create.append((self.line, self.obj))
+            else:
+                self.obj.save()
+        elif self.bulk_save:
+            fields = {name for name in update_fields if self.model._meta.get_field(name).concrete}
+            if fields:
+                self.to_update.setdefault(id(self.obj), (self.line, self.obj, set()))[2].update(fields)
         else:
             self.obj.save(update_fields=update_fields)
         update_fields += self.parse_fields(row, self.m2m_fields)
         update_fields += self.parse_fields(row, self.m2m_constant_fields)
-        update_fields += self.parse_fields(row, self.non_fields, non_field=True)
+        if self.bulk_save and self.non_fields:
+            # Object may not be written yet, non fields are parsed by flush()
+            self.pending_non_fields[id(self.obj)] = (self.line, self.obj, row, operation, bool(update_fields))
+        else:
+            update_fields += self.parse_fields(row, self.non_fields, non_field=True)
         if operation == "created":
             self.nb_created += 1
         elif update_fields:
@@ -355,6 +454,169 @@ class Parser:
         self.eid_val = eid_val
         return {self.eid: eid_val}
 
+    def get_eid_key(self, eid_val):
+        """Normalize an eid value so that it can be compared with the ones of prefetched objects"""
+        try:
+            key = self.model._meta.get_field(self.eid).to_python(eid_val)
+            hash(key)
+        except (FieldDoesNotExist, ValidationError, TypeError):
+            return None
+        return key
+
+    def get_objects(self, eid_kwargs):
+        if self.prefetched is not None:
+            key = self.get_eid_key(eid_kwargs[self.eid])
+            if key is not None:
+                if any(obj.pk is None for obj in self.prefetched.get(key, [])):
+                    # Same eid than a previous row of this chunk
+                    self.flush()
+                return list(self.prefetched.get(key, []))
+        objects = self.model.objects.filter(**eid_kwargs)
+        if hasattr(self.model, 'provider') and self.provider is not None:
+            objects = objects.filter(provider__exact=self.provider)
+        return objects
+
+    def prefetch_objects(self, rows):
+        """Fetch at once existing objects matching eids of rows"""
+        self.prefetched = None
+        if self.eid is None:
+            return
+        eids = set()
+        warnings, self.warnings = self.warnings, {}
+        for row in rows:
+            try:
+                eid_val = self.get_eid_kwargs(row)[self.eid]
+            except ImportError:
+                continue  # Reported when parsing the row
+            key = self.get_eid_key(eid_val)
+            if key is not None:
+                eids.add(key)
+        self.warnings = warnings
+        objects = self.model.objects.filter(**{'{}__in'.format(self.eid): eids})
+        if hasattr(self.model, 'provider') and self.provider is not None:
+            objects = objects.filter(provider__exact=self.provider)
+        m2m = [dst for dst in list(self.m2m_fields) + list(self.m2m_constant_fields)
+               if isinstance(self.model._meta.get_field(dst), models.ManyToManyField)]
+        self.prefetched = {}
+        for obj in objects.prefetch_related(*m2m):
+            self.prefetched.setdefault(self.get_eid_key(getattr(obj, self.eid)), []).append(obj)
+
+    def save_one(self, obj, update_fields=None):
+        """Save an object which could not be written in bulk, returns False on error"""
+        try:
+            with transaction.atomic():
+                obj.save(update_fields=update_fields)
+        except DatabaseError as e:
+            if settings.DEBUG:
+                raise
+            self.add_warning(str(e))
+            return False
+        return True
+
+    def flush(self):
+        """Write objects buffered by parse_obj() in bulk mode"""
+        line = self.line
+        to_create, self.to_create = self.to_create, []
+        for obj_line, obj in to_create:
+            self.prepare_bulk_object(obj)
+        if to_create:
+            try:
+                with transaction.atomic():
+                    self.model.objects.bulk_create([obj for obj_line, obj in to_create])
+                    bump_versions(self.model)
+            except DatabaseError:
+                # Save one by one to report errors on the right lines
+                for self.line, obj in to_create:
+                    if not self.save_one(obj):
+                        self.nb_created -= 1
+                        self.pending_m2m.pop(id(obj), None)
+                        self.pending_non_fields.pop(id(obj), None)
+                        self.discard_prefetched(obj)
+            else:
+                self.send_post_save([(obj, None) for obj_line, obj in to_create], created=True)
+        to_update, self.to_update = self.to_update, {}
+        if to_update:
+            auto_now = [field for field in self.model._meta.concrete_fields if getattr(field, 'auto_now', False)]
+            now = timezone.now()
+            update_fields = {field.name for field in auto_now}
+            if issubclass(self.model, BasePublishableMixin):
+                update_fields.add('publication_date')
+            for obj_line, obj, fields in to_update.values():
+                for field in auto_now:
+                    setattr(obj, field.attname, now)
+                for name in fields:
+                    field = self.model._meta.get_field(name)
+                    if isinstance(field, models.FileField):
+                        # Store new files, as save() would
+                        field.pre_save(obj, False)
+                self.prepare_bulk_object(obj)
+                update_fields |= fields
+            try:
+                with transaction.atomic():
+                    self.model.objects.bulk_update([obj for obj_line, obj, fields in to_update.values()], update_fields)
+                    bump_versions(self.model)
+            except DatabaseError:
+                for self.line, obj, fields in to_update.values():
+                    if not self.save_one(obj, update_fields=fields):
+                        self.nb_updated -= 1
+                        self.pending_non_fields.pop(id(obj), None)
+            else:
+                self.send_post_save([(obj, frozenset(fields)) for obj_line, obj, fields in to_update.values()],
+                                    created=False)
+        self.flush_m2m()
+        self.flush_non_fields()
+        self.line = line
+
+    def flush_non_fields(self):
+        """Parse non fields (e.g. attachments) of objects written by flush()"""
+        pending, self.pending_non_fields = self.pending_non_fields, {}
+        current = getattr(self, 'obj', None)
+        for self.line, self.obj, row, operation, modified in pending.values():
+            if self.obj.pk is None:
+                continue
+            try:
+                updated = self.parse_fields(row, self.non_fields, non_field=True)
+            except DatabaseError as e:
+                if settings.DEBUG:
+                    raise
+                self.add_warning(str(e))
+                continue
+            except (ValueImportError, RowImportError) as e:
+                self.add_warning(str(e))
+                continue
+            if updated and operation != "created" and not modified:
+                # Counted as unmodified by parse_obj()
+                self.nb_unmodified -= 1
+                self.nb_updated += 1
+        self.obj = current
+
+    def flush_m2m(self):
+        pending, self.pending_m2m = self.pending_m2m, {}
+        values = {}
+        for obj_line, obj, obj_values in pending.values():
+            if obj.pk is None:
+                continue
+            for dst, val in obj_values.items():
+                values.setdefault(dst, []).append((obj, val))
+        for dst, items in values.items():
+            field = self.model._meta.get_field(dst)
+            through = field.remote_field.through
+            source = through._meta.get_field(field.m2m_field_name()).attname
+            target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+            wanted = {(obj.pk, related.pk) for obj, val in items for related in val}
+            existing = through.objects.filter(**{'{}__in'.format(source): [obj.pk for obj, val in items]})
+            existing = {(pair[1], pair[2]): pair[0] for pair in existing.values_list('pk', source, target)}
+            obsolete = [pk for pair, pk in existing.items() if pair not in wanted]
+            if obsolete:
+                through.objects.filter(pk__in=obsolete).delete()
+            missing = [through(**{source: pair[0], target: pair[1]}) for pair in wanted if pair not in existing]
+            if missing:
+                through.objects.bulk_create(missing, ignore_conflicts=True)
+            if obsolete or missing:
+                bump_versions(self.model)
+            for obj, val in items:
+                getattr(obj, '_prefetched_objects_cache', {}).pop(dst, None)
+
     def parse_row(self, row):
         self.eid_val = None
         self.line += 1
@@ -367,9 +629,7 @@ class Parser:
             except RowImportError as warnings:
                 self.add_warning(str(warnings))
                 return
-            objects = self.model.objects.filter(**eid_kwargs)
-            if hasattr(self.model, 'provider') and self.provider is not None:
-                objects = objects.filter(provider__exact=self.provider)
+            objects = self.get_objects(eid_kwargs)
         if len(objects) == 0 and self.update_only:
             if self.warn_on_missing_objects:
                 self.add_warning(_("Bad value '{eid_val}' for field '{eid_src}'. No object with this identifier").format(eid_val=self.eid_val, eid_src=self.eid_src))
@@ -380,6 +640,8 @@ class Parser:
                 obj.structure = self.structure
             objects = [obj]
             operation = "created"
+            if self.prefetched is not None:
+                self.prefetched.setdefault(self.get_eid_key(self.eid_val), []).append(obj)
         elif len(objects) >= 2 and not self.duplicate_eid_allowed:
             self.add_warning(_("Bad value '{eid_val}' for field '{eid_src}'. Multiple objects with this identifier").format(eid_val=self.eid_val, eid_src=self.eid_src))
             return
@@ -435,6 +697,28 @@ class Parser:
                 val = mapping[val]
         return val
 
+    def get_related(self, model, fields, create):
+        """Returns (object or None, created), lookups are cached for the whole run in bulk mode"""
+        key = None
+        if self.bulk_size:
+            try:
+                key = (model, tuple(sorted(fields.items())), create)
+                if key in self.related:
+                    return self.related[key], False
+            except TypeError:
+                key = None
+        if create:
+            related, created = model.objects.get_or_create(**fields)
+        else:
+            created = False
+            try:
+                related = model.objects.get(**fields)
+            except model.DoesNotExist:
+                related = None
+        if key is not None:
+            self.related[key] = related
+        return related, created
+
     def filter_fk(self, src, val, model, field, mapping=None, partial=False, create=False, fk=None, **kwargs):
         val = self.get_mapping(src, val, mapping, partial)
         if val is None:
@@ -442,16 +726,12 @@ class Parser:
         fields = {field: val}
         if fk:
             fields[fk] = getattr(self.obj, fk)
-        if create:
-            val, created = model.objects.get_or_create(**fields)
-            if created:
-                self.add_warning(_("{model} '{val}' did not exist in Geotrek-Admin and was automatically created").format(model=model._meta.verbose_name.title(), val=val))
-            return val
-        try:
-            return model.objects.get(**fields)
-        except model.DoesNotExist:
+        related, created = self.get_related(model, fields, create)
+        if created:
+            self.add_warning(_("{model} '{val}' did not exist in Geotrek-Admin and was automatically created").format(model=model._meta.verbose_name.title(), val=related))
+        elif related is None:
             self.add_warning(_("{model} '{val}' does not exists in Geotrek-Admin. Please add it").format(model=model._meta.verbose_name.title(), val=val))
-            return None
+        return related
 
     def filter_m2m(self, src, val, model, field, mapping=None, partial=False, create=False, fk=None, **kwargs):
         if not val:
@@ -468,17 +748,13 @@ class Parser:
             fields = {field: subval}
             if fk:
                 fields[fk] = getattr(self.obj, fk)
-            if create:
-                subval, created = model.objects.get_or_create(**fields)
-                if created:
-                    self.add_warning(_("{model} '{val}' did not exist in Geotrek-Admin and was automatically created").format(model=model._meta.verbose_name.title(), val=subval))
-                dst.append(subval)
-                continue
-            try:
-                dst.append(model.objects.get(**fields))
-            except model.DoesNotExist:
+            related, created = self.get_related(model, fields, create)
+            if created:
+                self.add_warning(_("{model} '{val}' did not exist in Geotrek-Admin and was automatically created").format(model=model._meta.verbose_name.title(), val=related))
+            elif related is None:
                 self.add_warning(_("{model} '{val}' does not exists in Geotrek-Admin. Please add it").format(model=model._meta.verbose_name.title(), val=subval))
                 continue
+            dst.append(related)
         return dst
 
     def get_to_delete_kwargs(self):
@@ -528,29 +804,49 @@ class Parser:
         if self.filename and not os.path.exists(self.filename):
             raise GlobalImportError(_("File does not exists at: {filename}").format(filename=self.filename))
         self.start()
+        rows = []
         for i, row in enumerate(self.next_row()):
             if limit and i >= limit:
                 break
-            try:
-                self.parse_row(row)
-            except DatabaseError as e:
-                if settings.DEBUG:
-                    raise
-                self.add_warning(str(e))
-            except (ValueImportError, RowImportError) as e:
-                self.add_warning(str(e))
-            except Exception as e:
-                raise
-                if settings.DEBUG:
-                    raise
-                self.add_warning(str(e))
+            if not self.bulk_size:
+                self.parse_one(row)
+                continue
+            rows.append(row)
+            if len(rows) >= self.bulk_size:
+                self.parse_rows(rows)
+                rows = []
+        if rows:
+            self.parse_rows(rows)
         self.end()
 
+    def parse_one(self, row):
+        try:
+            self.parse_row(row)
+        except DatabaseError as e:
+            if settings.DEBUG:
+                raise
+            self.add_warning(str(e))
+        except (ValueImportError, RowImportError) as e:
+            self.add_warning(str(e))
+        except Exception as e:
+            raise
+            if settings.DEBUG:
+                raise
+            self.add_warning(str(e))
+
+    def parse_rows(self, rows):
+        """Parse a chunk of rows in bulk mode"""
+        self.prefetch_objects(rows)
+        for row in rows:
+            self.parse_one(row)
+        self.flush()
+        self.prefetched = None
+
     def request_or_retry(self, url, verb='get', **kwargs):
         try_get = settings.PARSER_NUMBER_OF_TRIES
         assert try_get > 0
         while try_get:
-            action = getattr(requests, verb)
+            action = getattr(self.session or requests, verb)
             response = action(url, allow_redirects=True, **kwargs)
             if response.status_code in settings.PARSER_RETRY_HTTP_STATUS:
                 logger.info("Failed to fetch url {}. Retrying ...".format(url))
@@ -656,6 +952,7 @@ class AtomParser(Parser):
 
 class AttachmentParserMixin:
     download_attachments = True
+    download_workers = 8
     base_url = ''
     delete_attachments = True
     filetype_name = "Photographie"
@@ -663,6 +960,33 @@ class AttachmentParserMixin:
         'attachments': _("Attachments"),
     }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.executor = None
+        self.responses = {}
+
+    def parse(self, filename=None, limit=None):
+        """HTTP requests of all rows are run by the same pool of workers"""
+        if self.download_workers < 2:
+            return super().parse(filename, limit)
+        self.executor = ThreadPoolExecutor(max_workers=self.download_workers)
+        try:
+            return super().parse(filename, limit)
+        finally:
+            self.discard_responses()
+            self.executor.shutdown()
+            self.executor = None
+
+    def prefetch_objects(self, rows):
+        super().prefetch_objects(rows)
+        self.prefetch_attachments(rows)
+
+    def parse_rows(self, rows):
+        try:
+            super().parse_rows(rows)
+        finally:
+            self.discard_responses()
+
     def start(self):
         super().start()
         if settings.PAPERCLIP_ENABLE_LINK is False and self.download_attachments is False:
@@ -682,6 +1006,56 @@ class AttachmentParserMixin:
             return []
         return [(subval.strip(), '', '') for subval in val.split(self.separator) if subval.strip()]
 
+    def prefetch_attachments(self, rows):
+        """Queue requests for attachments of a whole chunk of rows, so that they run while first rows are parsed:
+        sizes of existing attachments with the same name, contents of other ones"""
+        if self.executor is None or 'attachments' not in self.non_fields:
+            return
+        src = self.normalize_src(self.non_fields['attachments'])
+        objects = [obj for objs in (self.prefetched or {}).values() for obj in objs if obj.pk is not None]
+        existing = {}
+        if objects:
+            attachments = Attachment.objects.filter(content_type=ContentType.objects.get_for_model(self.model),
+                                                    object_id__in=[obj.pk for obj in objects])
+            for attachment in attachments:
+                existing.setdefault(attachment.object_id, []).append(attachment)
+        warnings, self.warnings = self.warnings, {}
+        for row in rows:
+            try:
+                val = self.get_val(row, 'attachments', src)
+                attachments_data = self.get_attachments_data(src, val)
+                key = self.get_eid_key(self.get_eid_kwargs(row)[self.eid]) if self.eid else None
+            except ImportError:
+                continue  # Reported when parsing the row
+            row_objects = self.prefetched.get(key, []) if self.prefetched and key is not None else []
+            row_attachments = [attachment for obj in row_objects for attachment in existing.get(obj.pk, [])]
+            for data in attachments_data:
+                if any(self.is_same_name(attachment, data['name']) for attachment in row_attachments):
+                    self.prefetch_responses([data['url']], verb='head')
+                elif self.download_attachments:
+                    self.prefetch_responses([data['url']])
+        self.warnings = warnings
+
+    def prefetch_responses(self, urls, verb='get'):
+        """Queue HTTP requests to the pool of workers, responses are then consumed by get_response()"""
+        if self.executor is None:
+            return
+        for url in urls:
+            if urlparse(url).scheme in ('http', 'https') and (verb, url) not in self.responses:
+                self.responses[(verb, url)] = self.executor.submit(self.request_or_retry, url, verb=verb)
+
+    def get_response(self, url, verb='get'):
+        future = self.responses.pop((verb, url), None)
+        if future is None:
+            return self.request_or_retry(url, verb=verb)
+        return future.result()
+
+    def discard_responses(self):
+        """Forget responses which were not consumed, e.g. of rows which failed"""
+        for future in self.responses.values():
+            future.cancel()
+        self.responses = {}
+
     def has_size_changed(self, url, attachment):
         parsed_url = urlparse(url)
         if parsed_url.scheme == 'ftp':
@@ -695,7 +1069,7 @@ class AttachmentParserMixin:
 
         if parsed_url.scheme == 'http' or parsed_url.scheme == 'https':
             try:
-                response = self.request_or_retry(url, verb='head')
+                response = self.get_response(url, verb='head')
             except (requests.exceptions.ConnectionError, DownloadImportError) as e:
                 raise ValueImportError('Failed to load attachment: {exc}'.format(exc=e))
             size = response.headers.get('content-length')
@@ -717,7 +1091,7 @@ class AttachmentParserMixin:
         else:
             if self.download_attachments:
                 try:
-                    response = self.request_or_retry(url)
+                    response = self.get_response(url)
                 except (DownloadImportError, requests.exceptions.ConnectionError) as e:
                     raise ValueImportError('Failed to load attachment: {exc}'.format(exc=e))
                 if response.status_code != requests.codes.ok:
@@ -726,14 +1100,15 @@ class AttachmentParserMixin:
                 return response.content
             return None
 
+    def is_same_name(self, attachment, name):
+        upload_name, ext = os.path.splitext(attachment_upload(attachment, name))
+        existing_name = attachment.attachment_file.name
+        return re.search(r"^{name}(_[a-zA-Z0-9]{{7}})?{ext}$".format(name=upload_name, ext=ext), existing_name)
+
     def check_attachment_updated(self, attachments_to_delete, updated, **kwargs):
         found = False
         for attachment in attachments_to_delete:
-            upload_name, ext = os.path.splitext(attachment_upload(attachment, kwargs.get('name')))
-            existing_name = attachment.attachment_file.name
-            if re.search(r"^{name}(_[a-zA-Z0-9]{{7}})?{ext}$".format(
-                    name=upload_name, ext=ext), existing_name
-            ) and not self.has_size_changed(kwargs.get('url'), attachment):
+            if self.is_same_name(attachment, kwargs.get('name')) and not self.has_size_changed(kwargs.get('url'), attachment):
                 found = True
                 attachments_to_delete.remove(attachment)
                 if (
@@ -792,23 +1167,40 @@ class AttachmentParserMixin:
         attachment.title = textwrap.shorten(kwargs.get('title'), width=127)
         return attachment
 
-    def generate_attachments(self, src, val, attachments_to_delete, updated):
-        attachments = []
+    def get_attachments_data(self, src, val):
+        attachments_data = []
         for attachment_data in self.filter_attachments(src, val):
             url = self.base_url + attachment_data[0]
-            legend = attachment_data[1] or ""
-            author = attachment_data[2] or ""
-            title = attachment_data[3] if len(attachment_data) > 3 else ""
             basename, ext = os.path.splitext(os.path.basename(url))
-            name = '%s%s' % (basename[:128], ext)
-            found, updated = self.check_attachment_updated(attachments_to_delete, updated, name=name, url=url,
-                                                           legend=legend, author=author, title=title)
-            if found:
-                continue
+            attachments_data.append({
+                'url': url,
+                'name': '%s%s' % (basename[:128], ext),
+                'legend': attachment_data[1] or "",
+                'author': attachment_data[2] or "",
+                'title': attachment_data[3] if len(attachment_data) > 3 else "",
+            })
+        return attachments_data
 
-            parsed_url = urlparse(url)
-            attachment = self.generate_attachment(author=author, legend=legend, title=title)
-            save, updated = self.generate_content_attachment(attachment, parsed_url, url, updated, name)
+    def generate_attachments(self, src, val, attachments_to_delete, updated):
+        attachments = []
+        attachments_data = self.get_attachments_data(src, val)
+        # Sizes of existing attachments and then new contents are fetched concurrently
+        self.prefetch_responses([
+            data['url'] for data in attachments_data
+            if any(self.is_same_name(attachment, data['name']) for attachment in attachments_to_delete)
+        ], verb='head')
+        to_download = []
+        for data in attachments_data:
+            found, updated = self.check_attachment_updated(attachments_to_delete, updated, **data)
+            if not found:
+                to_download.append(data)
+        if self.download_attachments:
+            self.prefetch_responses([data['url'] for data in to_download])
+
+        for data in to_download:
+            url = data['url']
+            attachment = self.generate_attachment(**data)
+            save, updated = self.generate_content_attachment(attachment, urlparse(url), url, updated, data['name'])
             if not save:
                 continue
             attachments.append(attachment)
@@ -820,15 +1212,19 @@ class AttachmentParserMixin:
         attachments_to_delete = list(Attachment.objects.attachments_for_object(self.obj))
         updated, attachments = self.generate_attachments(src, val, attachments_to_delete, updated)
         Attachment.objects.bulk_create(attachments)
+        bump_versions(Attachment)
         # TODO : attachments from parsers should be resized
         #  See https://github.com/makinacorpus/django-paperclip/blob/master/paperclip/models.py#L124
-        # `bulk_create` does not call this `save` method
+        # `bulk_create` does not call this `save` method, nor send post_save signal
+        if settings.THUMBNAILS_PRECOMPUTE:
+            queue_thumbnails(attachments)
         self.remove_attachments(attachments_to_delete)
         return updated
 
 
 class TourInSoftParser(AttachmentParserMixin, Parser):
     version_tourinsoft = 2
+    bulk_size = 100
     separator = '#'
     separator2 = '|'
 
@@ -1126,6 +1522,8 @@ class LEIParser(AttachmentParserMixin, XmlParser):
 class GeotrekAggregatorParser:
     filename = None
     url = None
+    # Number of Geotrek-admin hosts downloaded in parallel, objects are always written one parser at a time
+    workers = 1
 
     mapping_model_parser = {
         "Trek": ("geotrek.trekking.parsers", "GeotrekTrekParser"),
@@ -1152,11 +1550,60 @@ class GeotrekAggregatorParser:
         self.progress_cb = progress_cb
         self.warnings = {}
         self.report_by_api_v2_by_type = {}
+        self.sessions = []
+        self.duration = 0
 
     def add_warning(self, key, msg):
         warnings = self.warnings.setdefault(key, [])
         warnings.append(msg)
 
+    def get_parser(self, key, datas, model, session=None):
+        """Instantiate parser of a model for a Geotrek-admin.
+        Objects are downloaded beforehand if a session is given (concurrent mode)"""
+        module_name, class_name = self.mapping_model_parser[model]
+        module = importlib.import_module(module_name)
+        parser = getattr(module, class_name)
+        Parser = parser(progress_cb=self.progress_cb, provider=key, url=datas['url'],
+                        portals_filter=datas.get('portals'), mapping=datas.get('mapping'),
+                        create_categories=datas.get('create'), all_datas=datas.get('all_datas'), session=session)
+        if session:
+            Parser.prefetch()
+        return Parser
+
+    def fetch_host(self, jobs, session):
+        """Instantiate parsers of Geotrek-admins sharing a host and download their objects in a worker thread.
+        Returns parser (or raised exception) and elapsed time by provider and model"""
+        results = {}
+        try:
+            for key, datas, model in jobs:
+                start = time()
+                try:
+                    Parser = self.get_parser(key, datas, model, session=session)
+                except Exception as e:
+                    Parser = e
+                results[(key, model)] = (Parser, time() - start)
+        finally:
+            # Each worker thread has its own connection
+            connection.close()
+        return results
+
+    def start_fetching(self, executor, jobs):
+        """Submit downloads, grouped by host to reuse its connections. Returns futures by provider and model"""
+        # Objects created on the fly by parsers, before threads would race to create them
+        default_structure()
+        get_user_model().objects.get_or_create(username='import', defaults={'is_active': False})
+        jobs_by_host = {}
+        for job in jobs:
+            jobs_by_host.setdefault(urlparse(job[1]['url']).netloc, []).append(job)
+        futures = {}
+        for host_jobs in jobs_by_host.values():
+            session = requests.Session()
+            self.sessions.append(session)
+            future = executor.submit(self.fetch_host, host_jobs, session)
+            for key, datas, model in host_jobs:
+                futures[(key, model)] = future
+        return futures
+
     def parse(self, filename=None, limit=None):
         filename = filename if filename else self.filename
         if not os.path.exists(filename):
@@ -1164,46 +1611,88 @@ class GeotrekAggregatorParser:
         with open(filename, mode='r') as f:
             json_aggregator = json.load(f)
 
+        start = time()
+        jobs = []
         for key, datas in json_aggregator.items():
             self.report_by_api_v2_by_type[key] = {}
             models_to_import = datas.get('data_to_import')
             if not models_to_import:
                 models_to_import = self.mapping_model_parser.keys()
             for model in models_to_import:
-                Parser = None
+                self.report_by_api_v2_by_type[key][model] = None
                 if settings.TREKKING_TOPOLOGY_ENABLED:
                     if model in self.invalid_model_topology:
                         warning = f"{model}s can't be imported with dynamic segmentation"
                         logger.warning(warning)
                         key_warning = _(f"Model {model}")
                         self.add_warning(key_warning, warning)
+                elif 'url' not in datas:
+                    warning = f"{key} has no url"
+                    key_warning = _("Geotrek-admin")
+                    self.add_warning(key_warning, warning)
                 else:
-                    module_name, class_name = self.mapping_model_parser[model]
-                    module = importlib.import_module(module_name)
-                    parser = getattr(module, class_name)
-                    if 'url' not in datas:
-                        warning = f"{key} has no url"
-                        key_warning = _("Geotrek-admin")
-                        self.add_warning(key_warning, warning)
-                    else:
-                        Parser = parser(progress_cb=self.progress_cb, provider=key, url=datas['url'],
-                                        portals_filter=datas.get('portals'), mapping=datas.get('mapping'),
-                                        create_categories=datas.get('create'), all_datas=datas.get('all_datas'))
+                    jobs.append((key, datas, model))
+
+        executor = ThreadPoolExecutor(self.workers) if self.workers > 1 else None
+        try:
+            futures = self.start_fetching(executor, jobs) if executor else {}
+            for key, datas, model in jobs:
+                if executor:
+                    Parser, fetch_time = futures[(key, model)].result()[(key, model)]
+                else:
+                    fetch_start = time()
+                    try:
+                        Parser = self.get_parser(key, datas, model)
+                    except Exception as e:
+                        Parser = e
+                    fetch_time = time() - fetch_start
+                import_start = time()
+                if isinstance(Parser, Exception):
+                    self.add_failure(key, model, Parser)
+                    Parser = None
+                else:
+                    try:
+                        # Parser may have been instantiated in another thread
+                        Parser.activate_language()
                         self.progress_cb(0, 0, f'{model} ({key})')
                         Parser.parse()
-
-                self.report_by_api_v2_by_type[key][model] = {
-                    'nb_lines': Parser.line if Parser else 0,
-                    'nb_success': Parser.nb_success if Parser else 0,
-                    'nb_created': Parser.nb_created if Parser else 0,
-                    'nb_updated': Parser.nb_updated if Parser else 0,
-                    'nb_deleted': len(Parser.to_delete) if Parser and Parser.delete else None,
-                    'nb_unmodified': Parser.nb_unmodified if Parser else 0,
-                    'warnings': Parser.warnings if Parser else self.warnings
-                }
+                    except Exception as e:
+                        self.add_failure(key, model, e, Parser.warnings)
+                self.report_by_api_v2_by_type[key][model] = self.get_report(Parser, fetch_time, time() - import_start)
+        finally:
+            if executor:
+                executor.shutdown()
+            for session in self.sessions:
+                session.close()
+
+        for key, reports in self.report_by_api_v2_by_type.items():
+            for model, report in reports.items():
+                if report is None:
+                    reports[model] = self.get_report(None)
+        self.duration = time() - start
+
+    def add_failure(self, key, model, exception, warnings=None):
+        """Failure of a provider is reported, it does not prevent others to be imported"""
+        logger.warning(f"Import of {model}s from {key} failed", exc_info=exception)
+        warnings = self.warnings if warnings is None else warnings
+        key_warning = _(f"Model {model}")
+        warnings.setdefault(key_warning, []).append(_("{key} failed: {error}").format(key=key, error=exception))
+
+    def get_report(self, Parser, fetch_time=0, import_time=0):
+        return {
+            'nb_lines': Parser.line if Parser else 0,
+            'nb_success': Parser.nb_success if Parser else 0,
+            'nb_created': Parser.nb_created if Parser else 0,
+            'nb_updated': Parser.nb_updated if Parser else 0,
+            'nb_deleted': len(Parser.to_delete) if Parser and Parser.delete else None,
+            'nb_unmodified': Parser.nb_unmodified if Parser else 0,
+            'warnings': Parser.warnings if Parser else self.warnings,
+            'fetch_time': fetch_time,
+            'import_time': import_time,
+        }
 
     def report(self, output_format='txt'):
-        context = {'report': self.report_by_api_v2_by_type}
+        context = {'report': self.report_by_api_v2_by_type, 'duration': self.duration}
         return render_to_string('common/parser_report_aggregator.{output_format}'.format(output_format=output_format), context)
 
 
@@ -1243,8 +1732,11 @@ class GeotrekParser(AttachmentParserMixin, Parser):
     create_categories = False
     all_datas = False
     provider = None
+    ids = None
+    pages = None
 
-    def __init__(self, all_datas=None, create_categories=None, provider=None, mapping=None, portals_filter=None, url=None, *args, **kwargs):
+    def __init__(self, all_datas=None, create_categories=None, provider=None, mapping=None, portals_filter=None, url=None, session=None, *args, **kwargs):
+        self.session = session
         super().__init__(*args, **kwargs)
         self.bbox = Polygon.from_bbox(settings.SPATIAL_EXTENT)
         self.bbox.srid = settings.SRID
@@ -1296,28 +1788,19 @@ class GeotrekParser(AttachmentParserMixin, Parser):
                 return key
         return label
 
-    def generate_attachments(self, src, val, attachments_to_delete, updated):
-        attachments = []
+    def get_attachments_data(self, src, val):
+        attachments_data = []
         for url, legend, author, license in self.filter_attachments(src, val):
             url = self.base_url + url
-            legend = legend or ""
-            author = author or ""
-            license = License.objects.get_or_create(label=license)[0] if license else None
             basename, ext = os.path.splitext(os.path.basename(url))
-            name = '%s%s' % (basename[:128], ext)
-            found, updated = self.check_attachment_updated(attachments_to_delete, updated, name=name, url=url,
-                                                           legend=legend, author=author)
-            if found:
-                continue
-
-            parsed_url = urlparse(url)
-            attachment = self.generate_attachment(author=author, legend=legend, license=license)
-            save, updated = self.generate_content_attachment(attachment, parsed_url, url, updated, name)
-            if not save:
-                continue
-            attachments.append(attachment)
-            updated = True
-        return updated, attachments
+            attachments_data.append({
+                'url': url,
+                'name': '%s%s' % (basename[:128], ext),
+                'legend': legend or "",
+                'author': author or "",
+                'license': License.objects.get_or_create(label=license)[0] if license else None,
+            })
+        return attachments_data
 
     def generate_attachment(self, **kwargs):
         attachment = Attachment()
@@ -1329,16 +1812,19 @@ class GeotrekParser(AttachmentParserMixin, Parser):
         attachment.license = kwargs.get('license')
         return attachment
 
-    def start(self):
-        super().start()
-        kwargs = self.get_to_delete_kwargs()
+    def fetch_ids(self):
         json_id_key = self.replace_fields.get('eid', 'id')
         params = {
             'fields': json_id_key,
             'page_size': 10000
         }
         response = self.request_or_retry(self.next_url, params=params)
-        ids = [f"{element[json_id_key]}" for element in response.json().get('results', [])]
+        return [f"{element[json_id_key]}" for element in response.json().get('results', [])]
+
+    def start(self):
+        super().start()
+        kwargs = self.get_to_delete_kwargs()
+        ids = self.ids if self.ids is not None else self.fetch_ids()
         self.to_delete = set(self.model.objects.filter(**kwargs).exclude(eid__in=ids).values_list('pk', flat=True))
 
     def filter_attachments(self, src, val):
@@ -1368,10 +1854,10 @@ class GeotrekParser(AttachmentParserMixin, Parser):
         geom = GEOSGeometry(geom)
         return geom
 
-    def next_row(self):
-        """Returns next row.
+    def fetch_pages(self):
+        """Returns next page.
         Geotrek API is paginated, run until "next" is empty
-        :returns row
+        :returns page
         """
         portals = self.portals_filter
         updated_after = None
@@ -1385,23 +1871,32 @@ class GeotrekParser(AttachmentParserMixin, Parser):
             'updated_after': updated_after
         }
         response = self.request_or_retry(self.next_url, params=params)
-        self.root = response.json()
-        self.nb = int(self.root['count'])
-
-        for row in self.items:
-            yield row
-        self.next_url = self.root['next']
+        page = response.json()
+        yield page
+        self.next_url = page['next']
 
         while self.next_url:
             response = self.request_or_retry(self.next_url)
-            self.root = response.json()
+            page = response.json()
+            yield page
+            self.next_url = page['next']
+
+    def prefetch(self):
+        """Download identifiers and pages of objects to import, parse() then only waits for attachments"""
+        self.ids = self.fetch_ids()
+        self.pages = list(self.fetch_pages())
+
+    def next_row(self):
+        """Returns next row, from pages downloaded by prefetch() if any
+        :returns row
+        """
+        for page in self.pages if self.pages is not None else self.fetch_pages():
+            self.root = page
             self.nb = int(self.root['count'])
 
             for row in self.items:
                 yield row
 
-            self.next_url = self.root['next']
-
 
 class ApidaeBaseParser(Parser):
     """Parser to import "anything" from APIDAE"""
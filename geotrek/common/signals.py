@@ -1,8 +1,11 @@
-from django.db.models.signals import post_save, post_delete
+from django.conf import settings
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_save, pre_delete
 from django.dispatch import receiver
 from django.utils.timezone import now
 
 from geotrek.common.models import Attachment, AccessibilityAttachment, HDViewPoint
+from geotrek.common.thumbnails import queue_thumbnails
+from geotrek.common.versions import bump_versions, instance_subsets
 
 
 @receiver(post_save, sender=Attachment)
@@ -17,3 +20,35 @@ def update_content_object_date_update(sender, instance, *args, **kwargs):
     if content_object and hasattr(content_object, 'date_update'):
         content_object.date_update = now()
         content_object.save(update_fields=['date_update'])
+
+
+@receiver(post_save, sender=Attachment)
+def generate_attachment_thumbnails(sender, instance, *args, **kwargs):
+    """ after each upload / edition of a picture, generate its thumbnails in background """
+    if settings.THUMBNAILS_PRECOMPUTE:
+        queue_thumbnails([instance])
+
+
+@receiver(pre_save)
+@receiver(pre_delete)
+def remember_version_subsets(sender, instance, *args, **kwargs):
+    """ before each edition / deletion, remember subsets of model the object belonged to """
+    instance._version_subsets = instance_subsets(instance)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def bump_model_version(sender, instance, signal, *args, **kwargs):
+    """ after each creation / edition / deletion, change version of model in registry,
+    and versions of subsets the object belonged to or belongs to now """
+    subsets = getattr(instance, '_version_subsets', frozenset())
+    if signal is post_save:
+        subsets |= instance_subsets(instance)
+    bump_versions(sender, subsets=subsets)
+
+
+@receiver(m2m_changed)
+def bump_related_models_versions(sender, instance, action, model, *args, **kwargs):
+    """ after each change of a many to many relation, change versions of models on both sides """
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_versions(sender, type(instance), model)
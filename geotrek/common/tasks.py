@@ -175,3 +175,25 @@ def launch_sync_rando(*args, **kwargs):
     return {
         'name': current_task.name,
     }
+
+
+@shared_task(name='geotrek.common.generate-thumbnails')
+def generate_attachments_thumbnails(pks):
+    """
+    celery shared task - generate thumbnails of attached pictures
+    """
+    from geotrek.common.models import Attachment
+    from geotrek.common.thumbnails import generate_thumbnails
+    from geotrek.common.versions import bump_versions
+
+    generated = 0
+    owners = set()
+    for attachment in Attachment.objects.filter(pk__in=pks).select_related('content_type'):
+        count = generate_thumbnails(attachment)
+        if count:
+            generated += count
+            owners.add(attachment.content_type.model_class())
+    if owners:
+        # Cached API responses serving pictures themselves meanwhile are invalidated
+        bump_versions(Attachment, *(owner for owner in owners if owner is not None))
+    return generated
@@ -11,6 +11,7 @@ from geotrek.common.utils.testdata import (dummy_filefield_as_sequence,
 
 from .. import models
 
+from geotrek.common.helpers_sync import SyncManifest
 from geotrek.common.management.commands.sync_rando import Command
 
 from django.conf import settings
@@ -39,6 +40,7 @@ class FakeSyncCommand(Command):
             os.makedirs(dirname)
         self.zipfile = ZipFile(os.path.join(self.tmp_root, 'zip', 'tiles', 'global.zip'), 'w')
         self.factory = RequestFactory()
+        self.manifest = SyncManifest(self.dst_root, {})
         self.source = source
         self.portal = portal
         self.skip_dem = skip_dem
@@ -141,6 +141,17 @@ class CommandAttachmentsTests(TestCase):
         self.assertFalse(os.path.exists("{name}.120x120_q85_crop.png".format(name=self.picture.attachment_file.path)))
         self.assertEqual(Thumbnail.objects.count(), 0)
 
+    def test_generate_thumbnails(self):
+        output = StringIO()
+        call_command('generate_thumbnails', stdout=output)
+        self.assertIn('6 thumbnails generated', output.getvalue())
+        self.assertEqual(Thumbnail.objects.count(), 6)
+        output = StringIO()
+        call_command('generate_thumbnails', stdout=output)
+        self.assertIn('0 thumbnails generated', output.getvalue())
+        self.assertIsNotNone(self.content.thumbnail)
+        self.assertEqual(Thumbnail.objects.count(), 6)
+
     def test_clean_attachments_deleted(self):
         output = StringIO()
         self.picture.delete()
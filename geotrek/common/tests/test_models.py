@@ -1,12 +1,17 @@
 import os
 
+from django.conf import settings
+from django.contrib.gis.db.models.functions import Transform
+from django.contrib.gis.geos import Point
 from django.core.files import File
 from django.test import TestCase
 
 from geotrek.authent.models import default_structure
 from geotrek.authent.tests.factories import StructureFactory, UserProfileFactory, UserFactory
+from geotrek.common.functions import FirstPoint
 from geotrek.common.models import Theme
 from geotrek.common.tests.factories import (HDViewPointFactory, LabelFactory, OrganismFactory)
+from geotrek.trekking.models import Trek
 from geotrek.trekking.tests.factories import TrekFactory
 
 
@@ -77,3 +82,13 @@ class HDViewPointTestCase(TestCase):
     def test_properties(self):
         self.assertEqual(str(self.vp), 'Panorama')
         self.assertIn('admin/', self.vp.get_list_url())
+
+
+class FirstPointTestCase(TestCase):
+    def test_first_point_of_expression_with_parameters(self):
+        trek = TrekFactory.create()
+        first = Trek.objects.annotate(first=FirstPoint(Transform('geom', settings.API_SRID))).get(pk=trek.pk).first
+        x, y = trek.geom.coords[0][:2] if trek.geom.geom_type == 'LineString' else trek.geom.coords[0][0][:2]
+        expected = Point(x, y, srid=settings.SRID).transform(settings.API_SRID, clone=True)
+        self.assertAlmostEqual(first.x, expected.x)
+        self.assertAlmostEqual(first.y, expected.y)
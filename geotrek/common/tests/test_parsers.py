@@ -2,6 +2,7 @@ import json
 import os
 import urllib
 from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
 from shutil import rmtree
 from tempfile import mkdtemp
 from unittest import mock, skipIf
@@ -11,6 +12,8 @@ from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.core.management import call_command
 from django.core.management.base import CommandError
+from django.db.models.query import QuerySet
+from django.db.models.signals import post_save
 from django.db.utils import DatabaseError
 from django.template.exceptions import TemplateDoesNotExist
 from django.test import TestCase
@@ -21,12 +24,14 @@ from geotrek.authent.tests.factories import StructureFactory
 from geotrek.common.models import Attachment, FileType, Organism, Theme
 from geotrek.common.parsers import (AttachmentParserMixin, DownloadImportError,
                                     ExcelParser, GeotrekAggregatorParser,
-                                    GeotrekParser, OpenSystemParser,
+                                    GeotrekParser, OpenSystemParser, Parser,
                                     TourInSoftParser, TourismSystemParser,
                                     ValueImportError, XmlParser)
 from geotrek.common.tests.mixins import GeotrekParserTestMixin
 from geotrek.common.tests.factories import ThemeFactory
 from geotrek.common.utils.testdata import get_dummy_img
+from geotrek.sensitivity.models import Species
+from geotrek.sensitivity.tests.factories import SportPracticeFactory
 from geotrek.trekking.models import POI, Trek
 from geotrek.trekking.parsers import GeotrekTrekParser
 from geotrek.trekking.tests.factories import TrekFactory
@@ -43,6 +48,10 @@ class OrganismEidParser(ExcelParser):
     eid = 'organism'
 
 
+class OrganismEidBulkParser(OrganismEidParser):
+    bulk_size = 2
+
+
 class StructureExcelParser(ExcelParser):
     model = Organism
     fields = {
@@ -89,6 +98,49 @@ class AttachmentLegendParser(AttachmentParser):
         return [(url, legend, author)]
 
 
+class MultipleAttachmentsParser(AttachmentParser):
+
+    def filter_attachments(self, src, val):
+        return [(val, '', ''), (val.replace('.', '2.'), '', '')]
+
+
+class AttachmentBulkParser(AttachmentParser):
+    url = 'http://test.url/organisms'
+    bulk_size = 10
+    rows = []
+
+    def next_row(self):
+        self.nb = len(self.rows)
+        yield from self.rows
+
+
+class SpeciesBulkParser(Parser):
+    model = Species
+    url = 'http://species.test/'
+    eid = 'eid'
+    fields = {'eid': 'id', 'name': 'name'}
+    m2m_fields = {'practices': 'practices'}
+    natural_keys = {'practices': 'name'}
+    field_options = {'name': {'required': True}}
+    bulk_size = 10
+    rows = []
+
+    def normalize_field_name(self, name):
+        return name
+
+    def next_row(self):
+        self.nb = len(self.rows)
+        yield from self.rows
+
+
+class SpeciesBulkNonFieldsParser(SpeciesBulkParser):
+    non_fields = {'url': 'url'}
+
+    def save_url(self, src, val):
+        self.saved_urls.append((self.obj.pk, val))
+        return bool(val)
+
+
 class ParserTests(TestCase):
     def test_bad_parser_class(self):
         with self.assertRaisesRegex(CommandError, "Failed to import parser class 'DoesNotExist'"):
@@ -146,6 +198,82 @@ class ParserTests(TestCase):
         self.assertEqual(organisms[0].organism, "2.0")
         self.assertEqual(organisms[1].organism, "Comité Hippolyte")
 
+    def test_updated_with_eid_in_bulk(self):
+        filename = os.path.join(os.path.dirname(__file__), 'data', 'organism.xls')
+        filename2 = os.path.join(os.path.dirname(__file__), 'data', 'organism2.xls')
+        call_command('import', 'geotrek.common.tests.test_parsers.OrganismEidBulkParser', filename, verbosity=0)
+        call_command('import', 'geotrek.common.tests.test_parsers.OrganismEidBulkParser', filename, verbosity=0)
+        self.assertEqual(Organism.objects.count(), 1)
+        with mock.patch.object(QuerySet, 'bulk_create', autospec=True, side_effect=QuerySet.bulk_create) as mock_bulk_create:
+            call_command('import', 'geotrek.common.tests.test_parsers.OrganismEidBulkParser', filename2, verbosity=0)
+        mock_bulk_create.assert_called()
+        self.assertEqual(Organism.objects.count(), 2)
+        organisms = Organism.objects.order_by('pk')
+        self.assertEqual(organisms[0].organism, "2.0")
+        self.assertEqual(organisms[1].organism, "Comité Hippolyte")
+
+    def test_many_to_many_in_bulk(self):
+        practice1 = SportPracticeFactory.create(name="Practice 1")
+        practice2 = SportPracticeFactory.create(name="Practice 2")
+        parser = SpeciesBulkParser()
+        self.assertTrue(parser.bulk_save)
+        parser.rows = [{'id': 'A', 'name': "Species A", 'practices': "Practice 1+Practice 2"},
+                       {'id': 'B', 'name': "Species B", 'practices': "Practice 2"}]
+        with mock.patch.object(QuerySet, 'bulk_create', autospec=True, side_effect=QuerySet.bulk_create) as mock_bulk_create:
+            parser.parse()
+        # Species, then links to practices
+        self.assertEqual(mock_bulk_create.call_count, 2)
+        self.assertEqual(set(Species.objects.get(eid='A').practices.all()), {practice1, practice2})
+        self.assertEqual(set(Species.objects.get(eid='B').practices.all()), {practice2})
+        parser = SpeciesBulkParser()
+        parser.rows = [{'id': 'A', 'name': "Species A", 'practices': "Practice 2"},
+                       {'id': 'B', 'name': "Species B", 'practices': "Practice 1"}]
+        parser.parse()
+        self.assertEqual(parser.nb_updated, 2)
+        self.assertEqual(set(Species.objects.get(eid='A').practices.all()), {practice2})
+        self.assertEqual(set(Species.objects.get(eid='B').practices.all()), {practice1})
+
+    def test_failed_row_not_updated_by_next_rows_in_bulk(self):
+        parser = SpeciesBulkParser()
+        parser.rows = [{'id': 'A', 'practices': ""},
+                       {'id': 'A', 'name': "Species A", 'practices': ""}]
+        parser.parse()
+        self.assertEqual(len(parser.warnings), 1)
+        self.assertEqual(parser.nb_created, 1)
+        self.assertEqual(Species.objects.get(eid='A').name, "Species A")
+
+    def test_non_fields_parsed_once_written_in_bulk(self):
+        parser = SpeciesBulkNonFieldsParser()
+        self.assertTrue(parser.bulk_save)
+        parser.saved_urls = []
+        parser.rows = [{'id': 'A', 'name': "Species A", 'practices': "", 'url': "http://a.test/"},
+                       {'id': 'B', 'name': "Species B", 'practices': "", 'url': ""}]
+        parser.parse()
+        self.assertEqual(parser.saved_urls, [(Species.objects.get(eid='A').pk, "http://a.test/"),
+                                             (Species.objects.get(eid='B').pk, "")])
+        parser = SpeciesBulkNonFieldsParser()
+        parser.saved_urls = []
+        parser.rows = [{'id': 'A', 'name': "Species A", 'practices': "", 'url': "http://a.test/"},
+                       {'id': 'B', 'name': "Species B", 'practices': "", 'url': ""}]
+        parser.parse()
+        # Modified by its non field only
+        self.assertEqual((parser.nb_updated, parser.nb_unmodified), (1, 1))
+
+    def test_post_save_receivers_called_in_bulk(self):
+        receiver = mock.MagicMock()
+        post_save.connect(receiver, sender=Species)
+        self.addCleanup(post_save.disconnect, receiver, sender=Species)
+        parser = SpeciesBulkParser()
+        parser.rows = [{'id': 'A', 'name': "Species A", 'practices': ""}]
+        parser.parse()
+        self.assertEqual(receiver.call_args[1]['instance'], Species.objects.get(eid='A'))
+        self.assertTrue(receiver.call_args[1]['created'])
+        parser = SpeciesBulkParser()
+        parser.rows = [{'id': 'A', 'name': "Species A'", 'practices': ""}]
+        parser.parse()
+        self.assertFalse(receiver.call_args[1]['created'])
+        self.assertIn('name', receiver.call_args[1]['update_fields'])
+
     def test_report_format_text(self):
         parser = OrganismParser()
         self.assertRegex(parser.report(), '0/0 lines imported.')
@@ -476,6 +604,40 @@ class AttachmentParserTests(TestCase):
         self.assertIn("Failed to load attachment: DownloadImportError", output.getvalue())
         self.assertEqual(mocked_get.call_count, 1)
 
+    @mock.patch('requests.get')
+    def test_attachments_of_chunk_queued_at_once(self, mocked_get):
+        mocked_get.return_value.status_code = 200
+        mocked_get.return_value.content = b''
+        parser = AttachmentBulkParser()
+        parser.rows = [{'NOM': "Organism A", 'PHOTO': 'http://test.url/a.jpg'},
+                       {'NOM': "Organism B", 'PHOTO': 'http://test.url/b.jpg'}]
+        queued = []
+        save_attachments = parser.save_attachments
+
+        def save(src, val):
+            queued.append(len(parser.responses))
+            return save_attachments(src, val)
+
+        with mock.patch('geotrek.common.parsers.ThreadPoolExecutor', wraps=ThreadPoolExecutor) as mocked_executor:
+            with mock.patch.object(parser, 'save_attachments', side_effect=save):
+                parser.parse()
+        mocked_executor.assert_called_once_with(max_workers=8)
+        # Requests of second row were queued before first row was parsed
+        self.assertEqual(queued, [2, 1])
+        self.assertEqual(mocked_get.call_count, 2)
+        self.assertEqual(Attachment.objects.count(), 2)
+
+    @mock.patch('requests.get')
+    def test_attachments_downloaded_concurrently(self, mocked_get):
+        mocked_get.return_value.status_code = 200
+        mocked_get.return_value.content = b''
+        filename = os.path.join(os.path.dirname(__file__), 'data', 'organism.xls')
+        with mock.patch('geotrek.common.parsers.ThreadPoolExecutor', wraps=ThreadPoolExecutor) as mocked_executor:
+            call_command('import', 'geotrek.common.tests.test_parsers.MultipleAttachmentsParser', filename, verbosity=0)
+        mocked_executor.assert_called_once_with(max_workers=8)
+        self.assertEqual(mocked_get.call_count, 2)
+        self.assertEqual(Attachment.objects.count(), 2)
+
     @mock.patch('requests.get')
     def test_attachment_no_content(self, mocked):
         """
@@ -626,6 +788,10 @@ class GeotrekAggregatorTestParser(GeotrekAggregatorParser):
     pass
 
 
+class GeotrekAggregatorConcurrentTestParser(GeotrekAggregatorParser):
+    workers = 2
+
+
 class GeotrekParserTest(TestCase):
     def setUp(self, *args, **kwargs):
         self.filetype = FileType.objects.create(type="Photographie")
@@ -753,6 +919,37 @@ class GeotrekAggregatorParserTest(GeotrekParserTestMixin, TestCase):
         # "POI", "InformationDesk", "TouristicContent"
         self.assertEqual(8, mocked_import_module.call_count)
 
+    @skipIf(settings.TREKKING_TOPOLOGY_ENABLED, 'Test without dynamic segmentation only')
+    @mock.patch('geotrek.common.parsers.importlib.import_module')
+    def test_geotrek_aggregator_parser_concurrent_provider_failure(self, mocked_import_module):
+        parsers = []
+
+        def side_effect_parser(provider, session, **kwargs):
+            self.assertIsInstance(session, requests.Session)
+            if provider == 'URL_2':
+                raise DownloadImportError("Failed to download URL_2")
+            parser = mock.MagicMock(line=1, nb_success=1, nb_created=1, nb_updated=0, nb_unmodified=0,
+                                    delete=False, warnings={})
+            parsers.append(parser)
+            return parser
+
+        for module_name, class_name in GeotrekAggregatorParser.mapping_model_parser.values():
+            getattr(mocked_import_module.return_value, class_name).side_effect = side_effect_parser
+        output = StringIO()
+        filename = os.path.join(os.path.dirname(__file__), 'data', 'geotrek_parser_v2',
+                                'config_aggregator_multiple_admin.json')
+        call_command('import', 'geotrek.common.tests.test_parsers.GeotrekAggregatorConcurrentTestParser',
+                     filename=filename, verbosity=2, stdout=output)
+        stdout_parser = output.getvalue()
+        # Objects of URL_1 and URL_3 are downloaded, then imported
+        self.assertEqual(len(parsers), 5)
+        for parser in parsers:
+            parser.prefetch.assert_called_once_with()
+            parser.parse.assert_called_once_with()
+        self.assertIn('0000: InformationDesk (URL_3) (00%)', stdout_parser)
+        self.assertNotIn('(URL_2)', stdout_parser)
+        self.assertIn('URL_2 failed: Failed to download URL_2', stdout_parser)
+
     @skipIf(settings.TREKKING_TOPOLOGY_ENABLED, 'Test without dynamic segmentation only')
     def test_geotrek_aggregator_parser_no_url(self):
         output = StringIO()
@@ -1,7 +1,21 @@
-from django.test import TestCase
+from unittest import mock
+
+from django.db import DatabaseError, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from easy_thumbnails.alias import aliases
+from easy_thumbnails.models import Thumbnail
 from freezegun import freeze_time
 
+from geotrek.common.models import Attachment, Organism
+from geotrek.common.tasks import generate_attachments_thumbnails
 from geotrek.common.tests.factories import HDViewPointFactory, OrganismFactory, AttachmentFactory, AttachmentAccessibilityFactory
+from geotrek.common.thumbnails import get_thumbnail
+from geotrek.common.utils.testdata import get_dummy_uploaded_image
+from geotrek.common.versions import get_subset_version, get_version
+from geotrek.core.models import Path, Topology
+from geotrek.core.tests.factories import PathFactory
+from geotrek.trekking.models import Trek, WebLink
+from geotrek.trekking.tests.factories import WebLinkFactory
 
 
 class CommonSignalsTestCase(TestCase):
@@ -18,6 +32,30 @@ class CommonSignalsTestCase(TestCase):
         # object date_update has been updated with current datetime
         self.assertEqual(self.object.date_update.isoformat(), "2022-07-04T14:00:00+00:00")
 
+    @override_settings(THUMBNAILS_PRECOMPUTE=True)
+    def test_thumbnails_generated_when_picture_added(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            AttachmentFactory(content_object=self.object, attachment_file=get_dummy_uploaded_image())
+        # apiv2, medium, print, small-square, mobile_picto and copyrighted 800px
+        self.assertEqual(Thumbnail.objects.count(), 6)
+
+    @override_settings(THUMBNAILS_PRECOMPUTE=True)
+    def test_thumbnail_requested_before_ready_queued_once(self):
+        attachment = AttachmentFactory(content_object=self.object, attachment_file=get_dummy_uploaded_image())
+        with mock.patch('geotrek.common.thumbnails.queue_thumbnails') as mocked:
+            self.assertIsNone(get_thumbnail(attachment, aliases.get('apiv2'), wait=False))
+            self.assertIsNone(get_thumbnail(attachment, aliases.get('apiv2'), wait=False))
+        mocked.assert_called_once_with([attachment])
+
+    def test_versions_bumped_when_thumbnails_generated(self):
+        attachment = AttachmentFactory(content_object=self.object, attachment_file=get_dummy_uploaded_image())
+        with mock.patch('geotrek.common.versions.bump_versions') as mocked:
+            self.assertEqual(generate_attachments_thumbnails([attachment.pk]), 6)
+            mocked.assert_called_once_with(Attachment, Organism)
+            mocked.reset_mock()
+            self.assertEqual(generate_attachments_thumbnails([attachment.pk]), 0)
+            mocked.assert_not_called()
+
     def test_date_update_when_attachment_updated(self):
         """ Object date_update updated when attachment updated """
         attachment = AttachmentFactory(content_object=self.object)
@@ -82,3 +120,69 @@ class CommonSignalsTestCase(TestCase):
         self.object.refresh_from_db()
         # object date_update has been updated with current datetime
         self.assertEqual(self.object.date_update.isoformat(), "2022-07-04T17:00:00+00:00")
+
+
+class ModelVersionsTestCase(TransactionTestCase):
+    """ Versions registry is used out of transactions only """
+
+    def test_version_is_stable(self):
+        self.assertEqual(get_version(Organism), get_version(Organism))
+
+    def test_version_changes_when_object_saved(self):
+        version = get_version(Organism)
+        organism = OrganismFactory()
+        self.assertNotEqual(get_version(Organism), version)
+        version = get_version(Organism)
+        organism.delete()
+        self.assertNotEqual(get_version(Organism), version)
+
+    def test_version_changes_when_object_without_timestamp_saved(self):
+        web_link = WebLinkFactory()
+        version = get_version(WebLink)
+        web_link.name = "New name"
+        web_link.save()
+        self.assertNotEqual(get_version(WebLink), version)
+
+    def test_version_changes_along_with_dependencies(self):
+        path = PathFactory()
+        versions = get_version(Topology), get_version(Trek)
+        path.save()
+        self.assertNotEqual(get_version(Topology), versions[0])
+        self.assertNotEqual(get_version(Trek), versions[1])
+
+    def test_version_does_not_change_within_transaction(self):
+        version = get_version(Organism)
+        with transaction.atomic():
+            OrganismFactory()
+        self.assertNotEqual(get_version(Organism), version)
+        version = get_version(Organism)
+        try:
+            with transaction.atomic():
+                OrganismFactory()
+                raise DatabaseError
+        except DatabaseError:
+            pass
+        self.assertEqual(get_version(Organism), version)
+
+    def test_subset_version_changes_along_with_its_objects(self):
+        path = PathFactory(draft=True)
+        version = get_subset_version(Path, 'nodraft')
+        path.save()
+        self.assertEqual(get_subset_version(Path, 'nodraft'), version)
+        path.draft = False
+        path.save()
+        self.assertNotEqual(get_subset_version(Path, 'nodraft'), version)
+        version = get_subset_version(Path, 'nodraft')
+        path.draft = True
+        path.save()
+        self.assertNotEqual(get_subset_version(Path, 'nodraft'), version)
+
+    def test_version_without_timestamp_within_transaction(self):
+        web_link = WebLinkFactory()
+        with transaction.atomic():
+            with self.assertNumQueries(0):
+                version = get_version(WebLink)
+            web_link.save()
+            self.assertNotEqual(get_version(WebLink), version)
+            version = get_version(WebLink)
+        self.assertNotEqual(get_version(WebLink), version)
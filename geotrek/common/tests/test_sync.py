@@ -8,13 +8,15 @@ from io import StringIO
 import zipfile
 
 from django.conf import settings
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from django.contrib.gis.geos import LineString
 from django.core import management
 from django.core.management.base import CommandError
 from django.http import HttpResponse, StreamingHttpResponse
 from django.test.utils import override_settings
 
+from geotrek.common import helpers_sync as common_sync
+from geotrek.common.management.commands.sync_rando import Command as SyncRandoCommand
 from geotrek.common.tests.factories import FileTypeFactory, RecordSourceFactory, TargetPortalFactory, AttachmentFactory, ThemeFactory
 from geotrek.common.utils.testdata import get_dummy_uploaded_image
 from geotrek.core.tests.factories import PathFactory
@@ -24,6 +26,7 @@ from geotrek.signage.tests.factories import SignageFactory
 from geotrek.tourism.tests.factories import InformationDeskFactory, TouristicContentFactory, TouristicEventFactory
 from geotrek.trekking.tests.factories import TrekFactory, TrekWithPublishedPOIsFactory
 from geotrek.trekking import models as trekking_models
+from geotrek.trekking.views import TrekAPIViewSet, TrekGPXDetail
 
 
 class VarTmpTestCase(TestCase):
@@ -148,6 +151,32 @@ class SyncRandoTilesTest(VarTmpTestCase):
             self.assertEqual(ifile_trek.read(), b'I am a png')
         self.assertIn("zip/tiles/{pk}.zip".format(pk=trek.pk), output.getvalue())
 
+    @mock.patch('geotrek.trekking.models.Trek.prepare_map_image')
+    @mock.patch('landez.TilesManager.tile', return_value=b'I am a png')
+    @mock.patch('landez.TilesManager.tileslist', return_value=[(9, 258, 199)])
+    def test_tiles_downloaded_once(self, mock_tileslist, mock_tiles, mock_prepare):
+        trek1 = TrekFactory.create(published=True)
+        trek2 = TrekFactory.create(published=True)
+        management.call_command('sync_rando', os.path.join(settings.TMP_DIR, 'sync_rando', 'tmp_sync'), url='http://localhost:8000',
+                                languages='en', verbosity=0)
+        self.assertEqual(mock_tiles.call_count, 1)
+        for name in ('global', trek1.pk, trek2.pk):
+            zfile = zipfile.ZipFile(os.path.join(settings.TMP_DIR, 'sync_rando', 'tmp_sync', 'zip', 'tiles', '{}.zip'.format(name)))
+            self.assertEqual(len(zfile.namelist()), 1)
+            self.assertEqual(zfile.read(zfile.namelist()[0]), b'I am a png')
+
+    def test_line_bboxes(self):
+        store = common_sync.TilesStore(os.path.join(settings.TMP_DIR, 'tiles_store'),
+                                       tiles_url='http://localhost/{z}/{x}/{y}.png')
+        # Dense line produces as few bboxes as a simple one
+        dense = LineString([(i / 10000, 0) for i in range(101)], srid=4326)
+        self.assertEqual(len(store.line_bboxes(dense, 0.005)), 3)
+        # Long segment is covered all along
+        bboxes = sorted(store.line_bboxes(LineString((0, 0), (0.1, 0), srid=4326), 0.01))
+        self.assertEqual(len(bboxes), 11)
+        for previous, bbox in zip(bboxes, bboxes[1:]):
+            self.assertLess(bbox[0], previous[2])
+
 
 class SyncRandoFailTest(VarTmpTestCase):
     def test_fail_directory_not_empty(self):
@@ -250,6 +279,68 @@ class SyncTest(VarTmpTestCase):
                                 skip_pdf=True, verbosity=2, stdout=output)
         self.assertIn("unchanged", output.getvalue())
 
+    @mock.patch('geotrek.trekking.models.Trek.prepare_map_image')
+    def test_sync_manifest(self, mock_prepare):
+        management.call_command('sync_rando', os.path.join(settings.TMP_DIR, 'sync_rando', 'tmp_sync'), url='http://localhost:8000', skip_tiles=True, languages='en',
+                                skip_pdf=True, verbosity=2, stdout=StringIO())
+        with open(os.path.join(settings.TMP_DIR, 'sync_rando', 'tmp_sync', 'manifest.json'), 'r') as f:
+            manifest = json.load(f)
+        gpx_name = os.path.join('api', 'en', 'treks', str(self.trek.pk), '{}.gpx'.format(self.trek.slug))
+        self.assertIsNotNone(manifest['files'][gpx_name]['sources'])
+
+        output = StringIO()
+        with mock.patch.object(SyncRandoCommand, 'render_view', autospec=True,
+                               side_effect=SyncRandoCommand.render_view) as mock_render:
+            management.call_command('sync_rando', os.path.join(settings.TMP_DIR, 'sync_rando', 'tmp_sync'), url='http://localhost:8000', skip_tiles=True, languages='en',
+                                    skip_pdf=True, verbosity=2, stdout=output)
+        rendered = [getattr(call[0][2], 'cls', getattr(call[0][2], 'view_class', None)) for call in mock_render.call_args_list]
+        self.assertNotIn(TrekGPXDetail, rendered)
+        self.assertIn(TrekAPIViewSet, rendered)
+        self.assertIn("en zip/treks/en/{}.zip ...unchanged".format(self.trek.pk), output.getvalue())
+
+        self.trek.save()
+        with mock.patch.object(SyncRandoCommand, 'render_view', autospec=True,
+                               side_effect=SyncRandoCommand.render_view) as mock_render:
+            management.call_command('sync_rando', os.path.join(settings.TMP_DIR, 'sync_rando', 'tmp_sync'), url='http://localhost:8000', skip_tiles=True, languages='en',
+                                    skip_pdf=True, verbosity=2, stdout=StringIO())
+        rendered = [getattr(call[0][2], 'cls', getattr(call[0][2], 'view_class', None)) for call in mock_render.call_args_list]
+        self.assertIn(TrekGPXDetail, rendered)
+
+    @mock.patch('geotrek.trekking.models.Trek.prepare_map_image')
+    def test_sync_manifest_environment(self, mock_prepare):
+        management.call_command('sync_rando', os.path.join(settings.TMP_DIR, 'sync_rando', 'tmp_sync'), url='http://localhost:8000', skip_tiles=True, languages='en',
+                                skip_pdf=True, verbosity=2, stdout=StringIO())
+        stamps = common_sync.environment_stamps()
+        self.assertEqual(common_sync.environment_stamps(), stamps)
+        # Reference tables are not sources of files, but their changes imply to render files again
+        self.trek.practice.save()
+        self.assertNotEqual(common_sync.environment_stamps(), stamps)
+        with mock.patch.object(SyncRandoCommand, 'render_view', autospec=True,
+                               side_effect=SyncRandoCommand.render_view) as mock_render:
+            management.call_command('sync_rando', os.path.join(settings.TMP_DIR, 'sync_rando', 'tmp_sync'), url='http://localhost:8000', skip_tiles=True, languages='en',
+                                    skip_pdf=True, verbosity=2, stdout=StringIO())
+        rendered = [getattr(call[0][2], 'cls', getattr(call[0][2], 'view_class', None)) for call in mock_render.call_args_list]
+        self.assertIn(TrekGPXDetail, rendered)
+
+    @mock.patch('geotrek.trekking.models.Trek.prepare_map_image')
+    def test_sync_resume(self, mock_prepare):
+        with mock.patch('geotrek.common.helpers_sync.SyncRando.sync', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                management.call_command('sync_rando', os.path.join(settings.TMP_DIR, 'sync_rando', 'tmp_sync'),
+                                        url='http://localhost:8000', skip_tiles=True, skip_pdf=True, languages='en',
+                                        resume=True, verbosity=2, stdout=StringIO())
+        with open(os.path.join(settings.TMP_DIR, 'sync_rando', 'resume', 'checkpoint.json'), 'r') as f:
+            self.assertEqual(json.load(f)['done'], ['tiles', 'trekking-en'])
+        with mock.patch('geotrek.trekking.helpers_sync.SyncRando.sync') as mock_sync:
+            management.call_command('sync_rando', os.path.join(settings.TMP_DIR, 'sync_rando', 'tmp_sync'),
+                                    url='http://localhost:8000', skip_tiles=True, skip_pdf=True, languages='en',
+                                    resume=True, verbosity=2, stdout=StringIO())
+        mock_sync.assert_not_called()
+        self.assertTrue(os.path.exists(os.path.join(settings.TMP_DIR, 'sync_rando', 'tmp_sync', 'api', 'en', 'treks.geojson')))
+        self.assertFalse(os.path.exists(os.path.join(settings.TMP_DIR, 'sync_rando', 'resume')))
+        zfile = zipfile.ZipFile(os.path.join(settings.TMP_DIR, 'sync_rando', 'tmp_sync', 'zip', 'treks', 'en', 'global.zip'))
+        self.assertIn('api/en/treks.geojson', zfile.namelist())
+
     @override_settings(THUMBNAIL_COPYRIGHT_FORMAT='*' * 300)
     def test_sync_pictures_long_title_legend_author(self):
         with mock.patch('geotrek.trekking.models.Trek.prepare_map_image'):
@@ -317,6 +408,31 @@ class SyncTest(VarTmpTestCase):
         self.assertTrue(os.path.exists(os.path.join(settings.TMP_DIR, 'sync_rando', 'tmp_sync', 'api', 'fr', 'treks', str(trek_2.pk), 'fr_2.kml')))
 
 
+class SyncProcessesTest(TransactionTestCase):
+    """ Worker processes read objects from their own connection, they have to be committed """
+    def setUp(self):
+        self.dst = os.path.join(settings.TMP_DIR, 'sync_rando', 'tmp_sync')
+        if os.path.exists(self.dst):
+            shutil.rmtree(self.dst)
+        self.trek = TrekWithPublishedPOIsFactory.create(published=True)
+
+    def tearDown(self):
+        if os.path.exists(self.dst):
+            shutil.rmtree(self.dst)
+
+    @mock.patch('geotrek.trekking.models.Trek.prepare_map_image')
+    def test_sync_processes(self, mock_prepare):
+        for i in range(2):
+            management.call_command('sync_rando', self.dst, url='http://localhost:8000', skip_tiles=True,
+                                    skip_pdf=True, languages='en', processes=2, verbosity=2, stdout=StringIO())
+            self.assertTrue(os.path.isfile(os.path.join(self.dst, 'meta', 'en', 'index.html')))
+            with open(os.path.join(self.dst, 'api', 'en', 'treks.geojson'), 'r') as f:
+                self.assertEqual(len(json.load(f)['features']), 1)
+            zfile = zipfile.ZipFile(os.path.join(self.dst, 'zip', 'treks', 'en', 'global.zip'))
+            self.assertIn('api/en/treks.geojson', zfile.namelist())
+        self.assertEqual([name for root, dirs, files in os.walk(self.dst) for name in files if name.endswith('.tmp')], [])
+
+
 class SyncComplexTest(VarTmpTestCase):
     @classmethod
     def setUpTestData(cls):
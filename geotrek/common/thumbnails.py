@@ -0,0 +1,86 @@
+import hashlib
+import logging
+
+from PIL.Image import DecompressionBombError
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext as _
+from easy_thumbnails.alias import aliases
+from easy_thumbnails.exceptions import InvalidImageFormatError
+from easy_thumbnails.files import get_thumbnailer
+
+logger = logging.getLogger(__name__)
+
+# Thumbnails used by APIs, synchronizations and exports
+PRECOMPUTED_ALIASES = ('apiv2', 'medium', 'print', 'small-square', 'mobile_picto')
+# Time during which a thumbnail requested before being ready is not queued again
+QUEUED_TIMEOUT = 600
+
+
+def watermark_options(picture):
+    """ Options of the 800px thumbnail with copyright, used by synchronizations and mobile API """
+    # Uppercase options aren't used by prepared options (a primary
+    # use of prepared options is to generate the filename -- these
+    # options don't alter the filename).
+    text = settings.THUMBNAIL_COPYRIGHT_FORMAT.format(author=picture.author, title=picture.title,
+                                                      legend=picture.legend)
+    return {
+        'size': (800, 800),
+        'TEXT': text,
+        'SIZE_WATERMARK': settings.THUMBNAIL_COPYRIGHT_SIZE,
+        'watermark': hashlib.md5(text.encode('utf-8')).hexdigest()
+    }
+
+
+def thumbnails_options(picture):
+    return [aliases.get(alias) for alias in PRECOMPUTED_ALIASES] + [watermark_options(picture)]
+
+
+def get_thumbnail(picture, options, wait=True, attachment_file=None):
+    """
+    Thumbnail of picture (or of another file of it), as generated in background if it is ready.
+    Otherwise, it is generated now, or None is returned if wait is False and
+    thumbnails are precomputed, its generation being queued.
+    Raises IOError, InvalidImageFormatError or DecompressionBombError for invalid images.
+    """
+    thumbnailer = get_thumbnailer(picture.attachment_file if attachment_file is None else attachment_file)
+    options = thumbnailer.get_options(options)
+    thumbnail = thumbnailer.get_existing_thumbnail(options)
+    if thumbnail is not None:
+        return thumbnail
+    if not wait and settings.THUMBNAILS_PRECOMPUTE and attachment_file is None and picture.pk and picture.is_image:
+        # Queued once for all requests made meanwhile
+        key = 'thumbnail_queued_{}_{}'.format(picture.pk, hashlib.md5(
+            '_'.join(options.prepared_options()).encode('utf-8')).hexdigest())
+        if cache.add(key, True, QUEUED_TIMEOUT):
+            queue_thumbnails([picture])
+        return None
+    return thumbnailer.get_thumbnail(options)
+
+
+def generate_thumbnails(picture):
+    """ Generate thumbnails of picture which are not ready yet. Returns the number of generated thumbnails. """
+    if not picture.is_image or not picture.attachment_file:
+        return 0
+    thumbnailer = get_thumbnailer(picture.attachment_file)
+    generated = 0
+    for options in thumbnails_options(picture):
+        options = thumbnailer.get_options(options)
+        try:
+            if thumbnailer.get_existing_thumbnail(options) is None:
+                thumbnailer.get_thumbnail(options)
+                generated += 1
+        except (IOError, InvalidImageFormatError, DecompressionBombError) as e:
+            logger.info(_("Image {} invalid or missing from disk: {}.").format(picture.attachment_file, e))
+            break
+    return generated
+
+
+def queue_thumbnails(pictures):
+    """ Generate thumbnails of pictures in background (celery), once current transaction is committed """
+    from geotrek.common.tasks import generate_attachments_thumbnails
+
+    pks = [picture.pk for picture in pictures if picture.pk and picture.is_image and picture.attachment_file]
+    if pks:
+        transaction.on_commit(lambda: generate_attachments_thumbnails.delay(pks))
@@ -0,0 +1,144 @@
+"""
+Registry of model versions, used to build cache keys without querying the database.
+
+The version of a model is a random token stored in the shared cache, which is replaced
+once a transaction adding, modifying or removing objects of this model is committed.
+Versions of all models are bumped by post_save, post_delete and m2m_changed signals (see
+signals.py), along with models whose tables are updated by SQL triggers in the same time.
+Writes which do not send signals (bulk operations, raw SQL) must call bump_versions().
+Subsets of objects of a model may have a version of their own, which only changes along with
+objects belonging to the subset before or after their modification.
+"""
+import hashlib
+import json
+import uuid
+from functools import lru_cache
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, Max
+
+# Models whose tables are updated by SQL triggers of another model
+TRIGGER_DEPENDENCIES = {
+    # Topologies geometries are computed again when paths change
+    'core.path': ('core.topology', ),
+}
+
+# Filters of subsets of objects with a version of their own, by model
+SUBSETS = {
+    # Layers and graph of paths without drafts
+    'core.path': {'nodraft': {'draft': False}},
+}
+
+
+def model_label(model):
+    return model._meta.concrete_model._meta.label_lower
+
+
+def is_timestamped(model):
+    """ Whether changes of model objects update their date_update field """
+    return any(field.name == 'date_update' for field in model._meta.fields)
+
+
+@lru_cache()
+def bumped_labels(label):
+    """ Labels of models whose version changes along with the given one: models updated by triggers,
+    children and parents (multi-table inheritance) """
+    models = [apps.get_model(label)] + [apps.get_model(dependency) for dependency in TRIGGER_DEPENDENCIES.get(label, ())]
+    models += [model for model in apps.get_models() if issubclass(model, tuple(models)) and not model._meta.proxy]
+    models += [parent for model in models for parent in model._meta.get_parent_list()]
+    return frozenset(model_label(model) for model in models)
+
+
+def version_key(label):
+    return 'model_version_{}'.format(label)
+
+
+def subset_label(label, subset):
+    return '{}:{}'.format(label, subset)
+
+
+def instance_subsets(instance):
+    """ Labels of subsets the object belongs to, as stored in database """
+    model = type(instance)
+    label = model_label(model)
+    if instance.pk is None or label not in SUBSETS:
+        return frozenset()
+    queryset = model._base_manager.filter(pk=instance.pk)
+    return frozenset(subset_label(label, subset) for subset, filters in SUBSETS[label].items()
+                     if queryset.filter(**filters).exists())
+
+
+class VersionsBump:
+    """ Callback changing versions of models once transaction is committed. Until then, the transaction
+    reads its own versions (see pending_versions()), which are never published. """
+    def __init__(self, labels):
+        self.versions = {version_key(label): uuid.uuid4().hex for label in labels}
+
+    def __call__(self):
+        cache.set_many({key: uuid.uuid4().hex for key in self.versions}, None)
+
+
+def bump_versions(*models, subsets=None):
+    """ Change versions of given models once current transaction is committed, along with versions
+    of given subset labels (all subsets of these models by default) """
+    labels = frozenset().union(*(bumped_labels(model_label(model)) for model in models))
+    if subsets is None:
+        subsets = [subset_label(label, subset) for label in labels for subset in SUBSETS.get(label, ())]
+    labels |= frozenset(subsets)
+    if labels:
+        transaction.on_commit(VersionsBump(labels))
+
+
+def pending_versions():
+    """ Versions of models changed by current transaction. Callbacks of rolled back transactions
+    or savepoints are discarded, and their versions along with them. """
+    versions = {}
+    for entry in transaction.get_connection().run_on_commit:
+        if isinstance(entry[1], VersionsBump):
+            versions.update(entry[1].versions)
+    return versions
+
+
+def registry_versions(keys):
+    """ Versions read at once from the shared cache """
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Unknown or evicted version, unless another process set it meanwhile
+            version = uuid.uuid4().hex
+            versions[key] = version if cache.add(key, version, None) else cache.get(key, version)
+    return versions
+
+
+def read_versions(sources):
+    """ Version of (label, queryset) sources together """
+    keys = [version_key(label) for label, queryset in sources]
+    if not transaction.get_connection().in_atomic_block:
+        versions = registry_versions(keys)
+        return ':'.join(versions[key] for key in keys)
+    # Registry only follows committed changes: those of current transaction are revealed by
+    # timestamps of objects, or by versions it will publish on commit
+    untimestamped = [key for key, (label, queryset) in zip(keys, sources) if not is_timestamped(queryset.model)]
+    versions = {**registry_versions(untimestamped), **pending_versions()} if untimestamped else {}
+    stamps = [versions[key] if key in untimestamped
+              else queryset.aggregate(last_update=Max('date_update'), count=Count('pk'))
+              for key, (label, queryset) in zip(keys, sources)]
+    return hashlib.md5(json.dumps(stamps, cls=DjangoJSONEncoder).encode('utf-8')).hexdigest()
+
+
+def get_versions(*models):
+    """ Version of given models together, read at once from the shared cache """
+    return read_versions([(model_label(model), model._base_manager.all()) for model in models])
+
+
+def get_version(model):
+    return get_versions(model)
+
+
+def get_subset_version(model, subset):
+    """ Version of given subset of model objects (see SUBSETS) """
+    label = model_label(model)
+    return read_versions([(subset_label(label, subset), model._base_manager.filter(**SUBSETS[label][subset]))])
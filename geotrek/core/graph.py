@@ -1,10 +1,35 @@
+import gzip
+import heapq
+import json
 import math
+import struct
+import sys
+import uuid
+from array import array
 from collections import defaultdict
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from geotrek.common.functions import StartPoint, EndPoint
+
+
+def edge_length(length):
+    return 0.0 if math.isnan(length) else length
+
 
 def path_modifier(path):
-    length = 0.0 if math.isnan(path.length) else path.length
-    return {"id": path.pk, "length": length}
+    return {"id": path.pk, "length": edge_length(path.length)}
+
+
+def pack_array(typecode, values):
+    """ Little-endian bytes of an array of values """
+    values = array(typecode, list(values))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
 
 
 def get_key_optimizer():
@@ -55,3 +80,351 @@ def graph_edges_nodes_of_qs(qs):
         'edges': dict(edges),
         'nodes': dict(nodes),
     }
+
+
+class PathGraph:
+    """
+    Path graph kept between requests and updated with deltas instead of
+    being rebuilt from scratch each time a path changes.
+
+    ``serialize()`` returns the same structure as ``graph_edges_nodes_of_qs``.
+    Each update increments ``version`` and records touched edges and nodes,
+    so that a client can fetch only the changes since a given version.
+    Node ids and versions are only meaningful within an ``epoch``, which changes
+    each time the graph is built from scratch (e.g. when evicted from cache).
+
+    ``encode()`` keeps the whole graph in JSON and compact binary (``serialize_csr()``)
+    formats, already compressed, so that it is served as bytes as long as it does not change.
+    """
+    MAX_CHANGES = 100
+    CSR_MAGIC = b'GTG1'
+
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex
+        self.version = 0
+        self.latest = None
+        self.source_version = None
+        self.stamps = {}
+        self.encoded = {}
+        self.encoded_version = None
+        self.edges = {}
+        self.nodes = {}
+        self.node_keys = {}
+        self.node_coords = {}
+        self.node_edges = defaultdict(set)
+        self.next_node_id = 1
+        self.changes = []
+        self._router = None
+
+    def is_stale(self, source_version, latest):
+        """ Whether paths changed since the graph was updated """
+        if self.source_version != source_version:
+            return True
+        return latest is not None and (self.latest is None or self.latest < latest)
+
+    def fork(self):
+        """ Detach the graph from its epoch, so that it can change apart from the copy it comes from """
+        self.epoch = uuid.uuid4().hex
+        self.changes = []
+        self.encoded_version = None
+
+    def _node_id(self, coords):
+        node_id = self.node_keys.get(coords)
+        if node_id is None:
+            node_id = self.next_node_id
+            self.next_node_id += 1
+            self.node_keys[coords] = node_id
+            self.node_coords[node_id] = coords
+            self.nodes[node_id] = {}
+        return node_id
+
+    def _link(self, node_a, node_b):
+        """ Recompute link between two nodes from the remaining edges """
+        edge_ids = [edge_id for edge_id in self.node_edges[node_a]
+                    if set(self.edges[edge_id]['nodes_id']) == {node_a, node_b}]
+        if edge_ids:
+            self.nodes[node_a][node_b] = max(edge_ids)
+        else:
+            self.nodes[node_a].pop(node_b, None)
+
+    def add_edge(self, edge_id, start_point, end_point, length, touched_nodes):
+        self.remove_edge(edge_id, touched_nodes)
+        k_start_point, k_end_point = self._node_id(start_point), self._node_id(end_point)
+        self.edges[edge_id] = {"id": edge_id, "length": length, "nodes_id": [k_start_point, k_end_point]}
+        self.node_edges[k_start_point].add(edge_id)
+        self.node_edges[k_end_point].add(edge_id)
+        self.nodes[k_start_point][k_end_point] = edge_id
+        self.nodes[k_end_point][k_start_point] = edge_id
+        touched_nodes.update((k_start_point, k_end_point))
+
+    def remove_edge(self, edge_id, touched_nodes):
+        edge = self.edges.pop(edge_id, None)
+        if edge is None:
+            return
+        k_start_point, k_end_point = edge['nodes_id']
+        for node_id in (k_start_point, k_end_point):
+            self.node_edges[node_id].discard(edge_id)
+        self._link(k_start_point, k_end_point)
+        self._link(k_end_point, k_start_point)
+        for node_id in (k_start_point, k_end_point):
+            if node_id in self.nodes and not self.node_edges.get(node_id):
+                # Orphan node, its id is never reused
+                del self.nodes[node_id]
+                self.node_edges.pop(node_id, None)
+                del self.node_keys[self.node_coords.pop(node_id)]
+        touched_nodes.update((k_start_point, k_end_point))
+
+    def apply(self, updated, removed, latest):
+        """
+        Apply a delta to the graph.
+        ``updated`` is an iterable of (edge_id, start coords, end coords, length),
+        ``removed`` an iterable of edge ids.
+        """
+        touched_edges = set()
+        touched_nodes = set()
+        for edge_id in removed:
+            self.remove_edge(edge_id, touched_nodes)
+            touched_edges.add(edge_id)
+        for edge_id, start_point, end_point, length in updated:
+            self.add_edge(edge_id, start_point, end_point, length, touched_nodes)
+            touched_edges.add(edge_id)
+        self.latest = latest
+        if touched_edges:
+            self._router = None
+            self.version += 1
+            self.changes.append((self.version, touched_edges, touched_nodes))
+            del self.changes[:-self.MAX_CHANGES]
+
+    def router(self):
+        """ Return a routing engine on this graph, built once per version """
+        if self._router is None:
+            self._router = PathRouter(self.edges)
+        return self._router
+
+    def serialize(self):
+        return {
+            'edges': self.edges,
+            'nodes': self.nodes,
+        }
+
+    def serialize_csr(self):
+        """
+        Return the graph as compressed adjacency arrays, in little-endian binary:
+
+        - header: magic ``GTG1``, version, number of nodes ``N``, number of edges ``E``, adjacency size ``M`` (uint32)
+        - node ids (int32 x N)
+        - offsets (uint32 x N + 1): neighbours of node ``i`` are in ``[offsets[i], offsets[i + 1])``
+        - neighbour node indexes (uint32 x M) and edge ids leading to them (int32 x M)
+        - edge ids (int32 x E), node indexes of their extremities (uint32 x 2E) and lengths (float64 x E)
+        """
+        router = self.router()
+        node_ids = sorted(router.node_index, key=router.node_index.get)
+        edge_ids = sorted(router.extremities)
+        return b''.join([
+            struct.pack('<4sIIII', self.CSR_MAGIC, self.version, len(node_ids), len(edge_ids), len(router.targets)),
+            pack_array('i', node_ids),
+            pack_array('I', router.offsets),
+            pack_array('I', router.targets),
+            pack_array('i', router.edge_ids),
+            pack_array('i', edge_ids),
+            pack_array('I', [node for edge_id in edge_ids for node in router.extremities[edge_id]]),
+            pack_array('d', [router.lengths[edge_id] for edge_id in edge_ids]),
+        ])
+
+    def encode(self):
+        """
+        Serialize the whole graph in each format ('json' and 'csr'), by content encoding
+        ('identity', 'gzip', and 'br' if brotli is installed), once per version.
+        Return True if graph was encoded again.
+        """
+        if self.encoded_version == self.version:
+            return False
+        self.encoded = {}
+        for fmt, content in (('json', json.dumps(self.serialize(), separators=(',', ':')).encode()),
+                             ('csr', self.serialize_csr())):
+            self.encoded[fmt] = {'identity': content, 'gzip': gzip.compress(content)}
+            if brotli is not None:
+                self.encoded[fmt]['br'] = brotli.compress(content)
+        self.encoded_version = self.version
+        return True
+
+    def diff(self, since, epoch=None):
+        """
+        Return changes since version ``since`` of ``epoch``, or None if they are not known anymore
+        (in which case the whole graph has to be fetched again).
+        """
+        if epoch != self.epoch or since > self.version:
+            return None
+        if since < self.version and (not self.changes or self.changes[0][0] > since + 1):
+            return None
+        touched_edges = set()
+        touched_nodes = set()
+        for version, edges, nodes in self.changes:
+            if version > since:
+                touched_edges |= edges
+                touched_nodes |= nodes
+        return {
+            'epoch': self.epoch,
+            'version': self.version,
+            'since': since,
+            'edges': {edge_id: self.edges[edge_id] for edge_id in touched_edges if edge_id in self.edges},
+            'removed_edges': sorted(edge_id for edge_id in touched_edges if edge_id not in self.edges),
+            'nodes': {node_id: self.nodes[node_id] for node_id in touched_nodes if node_id in self.nodes},
+            'removed_nodes': sorted(node_id for node_id in touched_nodes if node_id not in self.nodes),
+        }
+
+
+class PathRouter:
+    """
+    Shortest path computation on the path network.
+
+    The graph is stored as compressed adjacency arrays: neighbours of node ``i``
+    are ``targets[offsets[i]:offsets[i + 1]]``, reached through edge
+    ``edge_ids[j]`` of weight ``weights[j]``.
+    """
+
+    def __init__(self, edges):
+        node_index = {}
+        for edge in edges.values():
+            for node_id in edge['nodes_id']:
+                node_index.setdefault(node_id, len(node_index))
+        self.node_index = node_index
+        self.lengths = {edge_id: edge['length'] for edge_id, edge in edges.items()}
+        self.extremities = {edge_id: tuple(node_index[node_id] for node_id in edge['nodes_id'])
+                            for edge_id, edge in edges.items()}
+
+        adjacency = [[] for _ in range(len(node_index))]
+        for edge_id, (start, end) in self.extremities.items():
+            adjacency[start].append((end, edge_id))
+            if start != end:
+                adjacency[end].append((start, edge_id))
+        self.offsets = array('l', [0])
+        self.targets = array('l')
+        self.edge_ids = array('l')
+        self.weights = array('d')
+        for neighbours in adjacency:
+            for target, edge_id in neighbours:
+                self.targets.append(target)
+                self.edge_ids.append(edge_id)
+                self.weights.append(self.lengths[edge_id])
+            self.offsets.append(len(self.targets))
+
+    def _dijkstra(self, sources, targets):
+        """
+        Run Dijkstra from ``sources`` (dict node -> initial cost) until all ``targets``
+        are settled. Return costs and predecessors (node -> (previous node, edge id)).
+        """
+        costs = dict(sources)
+        previous = {}
+        settled = set()
+        remaining = set(targets)
+        queue = [(cost, node) for node, cost in sources.items()]
+        heapq.heapify(queue)
+        offsets, neighbours, edge_ids, weights = self.offsets, self.targets, self.edge_ids, self.weights
+        while queue and remaining:
+            cost, node = heapq.heappop(queue)
+            if node in settled:
+                continue
+            settled.add(node)
+            remaining.discard(node)
+            for j in range(offsets[node], offsets[node + 1]):
+                target = neighbours[j]
+                new_cost = cost + weights[j]
+                if new_cost < costs.get(target, math.inf):
+                    costs[target] = new_cost
+                    previous[target] = (node, edge_ids[j])
+                    heapq.heappush(queue, (new_cost, target))
+        return costs, previous
+
+    def _edge_position(self, edge_id, node):
+        """ Position (0.0 or 1.0) of node along edge """
+        return 0.0 if self.extremities[edge_id][0] == node else 1.0
+
+    def shortest_path(self, start_edge, start_position, end_edge, end_position):
+        """
+        Return the shortest way between two positions on edges, as a list of
+        (edge id, start position, end position), and its length.
+        Return None if both positions are not connected.
+        """
+        best = None
+        if start_edge == end_edge:
+            best = (abs(end_position - start_position) * self.lengths[start_edge],
+                    [(start_edge, start_position, end_position)])
+        start_length, end_length = self.lengths[start_edge], self.lengths[end_edge]
+        start_a, start_b = self.extremities[start_edge]
+        end_a, end_b = self.extremities[end_edge]
+        sources = {}
+        for node, cost in ((start_a, start_position * start_length), (start_b, (1 - start_position) * start_length)):
+            sources[node] = min(cost, sources.get(node, math.inf))
+        exits = {}
+        for node, cost in ((end_a, end_position * end_length), (end_b, (1 - end_position) * end_length)):
+            exits[node] = min(cost, exits.get(node, math.inf))
+        costs, previous = self._dijkstra(sources, exits)
+        reached = [(costs[node] + cost, node) for node, cost in exits.items() if node in costs]
+        if reached:
+            length, node = min(reached)
+            if best is None or length < best[0]:
+                steps = []
+                end_node = node
+                while node in previous:
+                    prev_node, edge_id = previous[node]
+                    steps.append((edge_id, self._edge_position(edge_id, prev_node), self._edge_position(edge_id, node)))
+                    node = prev_node
+                steps.reverse()
+                steps.insert(0, (start_edge, start_position, self._edge_position(start_edge, node)))
+                steps.append((end_edge, self._edge_position(end_edge, end_node), end_position))
+                best = (length, steps)
+        if best is None:
+            return None
+        length, steps = best
+        # Drop empty steps, when a waypoint is on a node
+        return [step for step in steps if step[1] != step[2]] or steps[:1], length
+
+    def route(self, waypoints):
+        """
+        Compute the shortest route through ``waypoints``, a list of (edge id, position).
+        Return a serialized topology (see ``Topology.deserialize``) and the total length,
+        or None if a waypoint can't be reached.
+        """
+        topology = []
+        total_length = 0.0
+        for (start_edge, start_position), (end_edge, end_position) in zip(waypoints, waypoints[1:]):
+            result = self.shortest_path(start_edge, start_position, end_edge, end_position)
+            if result is None:
+                return None
+            steps, length = result
+            total_length += length
+            topology.append({
+                'offset': 0,
+                'paths': [edge_id for edge_id, start, end in steps],
+                'positions': {str(i): [start, end] for i, (edge_id, start, end) in enumerate(steps)},
+            })
+        return topology, total_length
+
+
+def update_graph_of_qs(graph, qs, latest, since=None):
+    """
+    Bring ``graph`` up-to-date with the paths of ``qs``.
+    Update timestamps of all paths are compared with the ones known by the graph, so that
+    rows committed late with an earlier timestamp are caught too, and only changed paths
+    have their extremities fetched from the database. Splits and merges are done by
+    triggers which also update ``date_update``, so they are caught the same way.
+    When ``since`` is given, paths are known to be the same as when the graph was updated
+    (same model version), and only paths updated after ``since`` are looked at.
+    """
+    if since is not None:
+        stamps = dict(graph.stamps, **dict(qs.filter(date_update__gt=since).values_list('pk', 'date_update')))
+    else:
+        stamps = dict(qs.values_list('pk', 'date_update'))
+    removed = set(graph.edges) - set(stamps)
+    changed = qs
+    if graph.edges:
+        changed = qs.filter(pk__in=[pk for pk, stamp in stamps.items() if graph.stamps.get(pk) != stamp])
+    changed = changed.order_by('pk').annotate(start_point=StartPoint('geom'), end_point=EndPoint('geom'))
+    updated = (
+        (pk, start_point.coords, end_point.coords, edge_length(length))
+        for pk, length, start_point, end_point in changed.values_list('pk', 'length', 'start_point', 'end_point')
+    )
+    graph.apply(updated, removed, latest)
+    graph.stamps = stamps
+    return graph
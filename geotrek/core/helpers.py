@@ -0,0 +1,131 @@
+from collections import defaultdict
+from math import floor, hypot
+
+from django.contrib.gis.geos import LineString, Point
+
+
+class GridIndex:
+    """ Spatial index of extents, registered in every cell of a regular grid they overlap """
+
+    def __init__(self, size):
+        self.size = size
+        self.cells = defaultdict(set)
+
+    def cells_of(self, extent):
+        xmin, ymin, xmax, ymax = extent
+        for i in range(floor(xmin / self.size), floor(xmax / self.size) + 1):
+            for j in range(floor(ymin / self.size), floor(ymax / self.size) + 1):
+                yield i, j
+
+    def insert(self, key, extent):
+        for cell in self.cells_of(extent):
+            self.cells[cell].add(key)
+
+    def query(self, extent):
+        """ Keys of extents possibly intersecting the given one """
+        keys = set()
+        for cell in self.cells_of(extent):
+            keys |= self.cells.get(cell, set())
+        return keys
+
+
+def grow(extent, distance):
+    xmin, ymin, xmax, ymax = extent
+    return xmin - distance, ymin - distance, xmax + distance, ymax + distance
+
+
+def grid_size(lines, distance):
+    """ Mean extent of lines, so that each line lies on a few cells only """
+    sizes = [max(line.extent[2] - line.extent[0], line.extent[3] - line.extent[1]) for line in lines]
+    return max(sum(sizes) / len(sizes) if sizes else 0, distance, 1e-9)
+
+
+def snap_point(point, lines, candidates, distance):
+    """ Same as paths_snap_extremities() trigger: closest point of the closest line,
+    or its closest vertex if less than distance away """
+    closest = None
+    for key in candidates:
+        d = lines[key].distance(point)
+        if d < distance and (closest is None or d < closest[0]):
+            closest = (d, key)
+    if closest is None:
+        return point.coords
+    other = lines[closest[1]]
+    result = other.interpolate(other.project(point))
+    d = distance
+    for vertex in other.coords:
+        vertex_distance = result.distance(Point(vertex, srid=other.srid))
+        if vertex_distance < d:
+            d = vertex_distance
+            result = Point(vertex, srid=other.srid)
+    return result.coords
+
+
+def snap_lines(lines, distance):
+    """ Snap extremities of each line on the previous ones,
+    as if lines were inserted one after the other in paths table """
+    index = GridIndex(grid_size(lines, distance))
+    snapped = []
+    for i, line in enumerate(lines):
+        coords = list(line.coords)
+        for position in (0, -1):
+            point = Point(coords[position], srid=line.srid)
+            candidates = index.query(grow(point.extent, distance))
+            coords[position] = snap_point(point, snapped, candidates, distance)
+        line = LineString(coords, srid=line.srid)
+        snapped.append(line)
+        index.insert(i, line.extent)
+    return snapped
+
+
+def intersection_points(line, other):
+    """ Points where lines cross each other, none if they overlap (same as paths_topology_intersect_split()) """
+    intersection = line.intersection(other)
+    if intersection.empty or intersection.geom_type in ('LineString', 'MultiLineString'):
+        return []
+    parts = [intersection] if intersection.geom_type == 'Point' else list(intersection)
+    return [part for part in parts if part.geom_type == 'Point']
+
+
+def cut_line(line, points):
+    """ Cut a line at given points, lying on it """
+    length = line.length
+    cuts = sorted({(line.project(point), point.coords) for point in points})
+    cuts = [(position, coords) for position, coords in cuts if 0 < position < length]
+    if not cuts:
+        return [line]
+    pieces = []
+    coords = line.coords
+    current = [coords[0]]
+    travelled = 0.0
+    k = 0
+    for start, end in zip(coords, coords[1:]):
+        segment = hypot(end[0] - start[0], end[1] - start[1])
+        while k < len(cuts) and cuts[k][0] < travelled + segment:
+            point = cuts[k][1]
+            if point != current[-1]:
+                current.append(point)
+            pieces.append(current)
+            current = [point]
+            k += 1
+        travelled += segment
+        if end != current[-1]:
+            current.append(end)
+    pieces.append(current)
+    return [LineString(piece, srid=line.srid) for piece in pieces if len(piece) > 1]
+
+
+def split_lines(lines):
+    """ Split lines where they cross each other, as paths_topology_intersect_split() trigger does.
+    Returns a list of (index of the original line, piece of line). """
+    index = GridIndex(grid_size(lines, 0))
+    for i, line in enumerate(lines):
+        index.insert(i, line.extent)
+    pieces = []
+    for i, line in enumerate(lines):
+        extremities = {line.coords[0], line.coords[-1]}
+        points = [point for j in index.query(line.extent) if j != i
+                  for point in intersection_points(line, lines[j])
+                  if point.coords not in extremities]
+        pieces += [(i, piece) for piece in cut_line(line, points)]
+    return pieces
@@ -1,15 +1,22 @@
+import io
+
 from django.contrib.gis.gdal import DataSource, GDALException
+from geotrek.common.versions import bump_versions
+from geotrek.core.helpers import snap_lines, split_lines
 from geotrek.core.models import Path
 from geotrek.authent.models import Structure
 from django.contrib.gis.geos.collections import Polygon, LineString
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 from django.db.utils import IntegrityError, InternalError
-from django.db import transaction
+from django.db import connection, transaction
 
 
 class Command(BaseCommand):
     help = 'Load Paths from a file within the spatial extent\n'
+    # Row triggers replaced by their set-based counterpart in bulk mode
+    bulk_disabled_triggers = ('core_path_00_snap_geom_iu_tgr', 'core_path_10_split_geom_iu_tgr',
+                              'core_path_10_elevation_iu_tgr')
 
     def add_arguments(self, parser):
         parser.add_argument('file_path', help="File's path of the paths")
@@ -29,6 +36,9 @@ class Command(BaseCommand):
         parser.add_argument('--dry', '-d', action='store_true', dest='dry', default=False,
                             help="Do not change the database, dry run. Show the number of fail"
                                  " and objects potentially created")
+        parser.add_argument('--bulk', '-b', action='store_true', dest='bulk', default=False,
+                            help="Snap and split imported paths in memory and insert them at once,"
+                                 " much faster for large networks")
 
     def handle(self, *args, **options):
         verbosity = options.get('verbosity')
@@ -41,6 +51,7 @@ class Command(BaseCommand):
         comments_columns = options.get('comment')
         fail = options.get('fail')
         dry = options.get('dry')
+        bulk = options.get('bulk')
 
         if dry:
             fail = True
@@ -67,52 +78,138 @@ class Command(BaseCommand):
         self.bbox = Polygon.from_bbox(settings.SPATIAL_EXTENT)
         self.bbox.srid = settings.SRID
 
-        sid = transaction.savepoint()
-
-        for layer in ds:
-            for feat in layer:
-                name = feat.get(name_column) if name_column in layer.fields else ''
-                comment_final_tab = []
-                if comments_columns:
-                    for comment_column in comments_columns:
-                        if comment_column in layer.fields:
-                            comment_final_tab.append(feat.get(comment_column))
-                geom = feat.geom.geos
-                if not isinstance(geom, LineString):
-                    if verbosity > 0:
-                        self.stdout.write("%s's geometry is not a Linestring" % feat)
-                    break
-                self.check_srid(srid, geom)
-                geom.dim = 2
-                if self.should_import(feat, geom):
-                    try:
-                        with transaction.atomic():
-                            comment_final = '</br>'.join(comment_final_tab)
-                            path = Path.objects.create(name=name,
-                                                       structure=structure,
-                                                       geom=geom,
-                                                       comments=comment_final)
-                        counter += 1
+        # Whole import in one transaction, rolled back in dry mode
+        with transaction.atomic():
+            features = []
+
+            for layer in ds:
+                for feat in layer:
+                    name = feat.get(name_column) if name_column in layer.fields else ''
+                    comment_final_tab = []
+                    if comments_columns:
+                        for comment_column in comments_columns:
+                            if comment_column in layer.fields:
+                                comment_final_tab.append(feat.get(comment_column))
+                    geom = feat.geom.geos
+                    if not isinstance(geom, LineString):
                         if verbosity > 0:
-                            self.stdout.write('Create path with pk : {}'.format(path.pk))
-                        if verbosity > 1:
-                            self.stdout.write("The comment %s was added on %s" % (comment_final, name))
-                    except (IntegrityError, InternalError):
-                        if fail:
-                            counter_fail += 1
-                            self.stdout.write('Integrity Error on path : {}, {}'.format(name, geom))
-                        else:
-                            raise
+                            self.stdout.write("%s's geometry is not a Linestring" % feat)
+                        break
+                    self.check_srid(srid, geom)
+                    geom.dim = 2
+                    if self.should_import(feat, geom):
+                        if bulk:
+                            features.append(('</br>'.join(comment_final_tab), name, geom))
+                            continue
+                        try:
+                            with transaction.atomic():
+                                comment_final = '</br>'.join(comment_final_tab)
+                                path = Path.objects.create(name=name,
+                                                           structure=structure,
+                                                           geom=geom,
+                                                           comments=comment_final)
+                            counter += 1
+                            if verbosity > 0:
+                                self.stdout.write('Create path with pk : {}'.format(path.pk))
+                            if verbosity > 1:
+                                self.stdout.write("The comment %s was added on %s" % (comment_final, name))
+                        except (IntegrityError, InternalError):
+                            if fail:
+                                counter_fail += 1
+                                self.stdout.write('Integrity Error on path : {}, {}'.format(name, geom))
+                            else:
+                                raise
+            if features:
+                counter, counter_fail = self.bulk_import(features, structure, fail, verbosity)
+            if dry:
+                transaction.set_rollback(True)
         if not dry:
-            transaction.savepoint_commit(sid)
             if verbosity >= 2:
                 self.stdout.write(self.style.NOTICE(
                     "{0} objects created, {1} objects failed".format(counter, counter_fail)))
         else:
-            transaction.savepoint_rollback(sid)
             self.stdout.write(self.style.NOTICE(
                 "{0} objects will be create, {1} objects failed;".format(counter, counter_fail)))
 
+    def bulk_import(self, features, structure, fail, verbosity):
+        """ Snap and split features in memory, then load them with a single COPY with snapping,
+        splitting and elevation triggers disabled. These triggers are run afterwards only for
+        paths close to existing ones, and elevation is computed in a single query for others. """
+        distance = settings.PATH_SNAPPING_DISTANCE
+        srid = Path._meta.get_field('geom').srid
+        lines = snap_lines([geom.transform(srid, clone=True) for comment, name, geom in features], distance)
+        counter_fail = 0
+        valid = []
+        for feature, line in zip(features, lines):
+            if line.valid and line.simple:
+                valid.append((feature, line))
+                if verbosity > 1:
+                    self.stdout.write("The comment %s was added on %s" % feature[:2])
+            elif fail:
+                counter_fail += 1
+                self.stdout.write('Integrity Error on path : {}, {}'.format(feature[1], line))
+            else:
+                raise IntegrityError('Invalid geometry on path : {}, {}'.format(feature[1], line))
+        pieces = split_lines([line for feature, line in valid])
+        data = io.StringIO()
+        for i, piece in pieces:
+            comment, name, geom = valid[i][0]
+            data.write('\t'.join([str(i), self.copy_value(name), self.copy_value(comment), piece.hexewkb.decode()]))
+            data.write('\n')
+        data.seek(0)
+        table = Path._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE TEMPORARY TABLE loadpaths_import (idx integer, name text, comments text, geom geometry)")
+            cursor.copy_expert("COPY loadpaths_import FROM STDIN", data)
+            # Triggers are disabled within the import transaction only, which locks the table meanwhile
+            try:
+                # Savepoint, so that triggers can still be enabled again if insertion fails
+                with transaction.atomic():
+                    for trigger in self.bulk_disabled_triggers:
+                        cursor.execute("ALTER TABLE {} DISABLE TRIGGER {}".format(table, trigger))
+                    cursor.execute("""
+                        INSERT INTO {table} (structure_id, name, comments, geom)
+                        SELECT %s, COALESCE(name, ''), COALESCE(comments, ''), geom FROM loadpaths_import ORDER BY idx
+                        RETURNING id
+                    """.format(table=table), [structure.pk])
+                    pks = [pk for pk, in cursor.fetchall()]
+            finally:
+                for trigger in self.bulk_disabled_triggers:
+                    cursor.execute("ALTER TABLE {} ENABLE TRIGGER {}".format(table, trigger))
+            cursor.execute("DROP TABLE loadpaths_import")
+            # Paths connected to existing ones are snapped and split by triggers, one at a time
+            cursor.execute("""
+                SELECT p.id FROM {table} p
+                WHERE p.id = ANY(%s) AND EXISTS (
+                    SELECT 1 FROM {table} o WHERE o.id != ALL(%s) AND ST_DWithin(o.geom, p.geom, %s)
+                )
+                ORDER BY p.id
+            """.format(table=table), [pks, pks, distance])
+            for pk, in cursor.fetchall():
+                cursor.execute("UPDATE {table} SET geom = geom WHERE id = %s".format(table=table), [pk])
+            # Same computation as elevation_path_iu() trigger, for all other paths at once
+            cursor.execute("""
+                UPDATE {table} o
+                SET geom_3d = e.draped, "length" = ST_3DLength(e.draped), slope = e.slope,
+                    min_elevation = e.min_elevation, max_elevation = e.max_elevation,
+                    ascent = e.positive_gain, descent = e.negative_gain
+                FROM {table} s, LATERAL ft_elevation_infos(s.geom, %s) e
+                WHERE s.id = ANY(%s) AND s.geom_3d IS NULL AND o.id = s.id
+            """.format(table=table), [settings.ALTIMETRIC_PROFILE_STEP, pks])
+        bump_versions(Path)
+        if verbosity > 0:
+            for pk in pks:
+                self.stdout.write('Create path with pk : {}'.format(pk))
+        if verbosity > 1:
+            self.stdout.write("{} features split into {} paths".format(len(valid), len(pks)))
+        return len(valid), counter_fail
+
+    def copy_value(self, value):
+        """ Escape a value for COPY text format """
+        if value is None:
+            return '\\N'
+        return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
     def check_srid(self, srid, geom):
         if not geom.srid:
             geom.srid = srid
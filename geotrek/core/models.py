@@ -23,7 +23,7 @@ from geotrek.core.managers import PathManager, PathInvisibleManager, TopologyMan
     TrailManager
 from geotrek.common.mixins.models import (TimeStampedModelMixin, NoDeleteMixin, AddPropertyMixin,
                                           CheckBoxActionMixin, GeotrekMapEntityMixin)
-from geotrek.common.utils import classproperty, simplify_coords, sqlfunction, uniquify
+from geotrek.common.utils import classproperty, simplify_coords, sqlfunction
 from geotrek.zoning.mixins import ZoningPropertiesMixin
 from mapentity.serializers import plain_text
 
@@ -141,6 +141,60 @@ class Path(CheckBoxActionMixin, ZoningPropertiesMixin, AddPropertyMixin, Geotrek
             qs = qs.exclude(pk=exclude.pk)
         return qs.exclude(visible=False).annotate(distance=Distance('geom', point)).order_by('distance')[0]
 
+    @classmethod
+    def closest_interpolated(cls, points, paths=None, exclude=None):
+        """
+        Snap many points at once, in a single query.
+        Returns a list of (path, position, offset) with, for each point, the closest
+        path (see ``closest()``) or the given one in ``paths``, and position and offset
+        of the point along this path (see ``interpolate()``).
+        Will fail if no path in database.
+        """
+        if not points:
+            return []
+        points = [point if point.srid == settings.SRID else point.transform(settings.SRID, clone=True)
+                  for point in points]
+        paths = paths or [None] * len(points)
+        sql = """
+        WITH points AS (
+            SELECT idx, path_id, ST_SetSRID(ST_MakePoint(x, y), %(srid)s) AS geom
+            FROM unnest(%(idx)s::integer[], %(path_id)s::integer[], %(x)s::float8[], %(y)s::float8[])
+                 AS t(idx, path_id, x, y)
+        )
+        SELECT points.idx, COALESCE(snapped.id, closest.id), interpolated.position, interpolated.distance
+        FROM points
+        LEFT JOIN {table} AS snapped ON (snapped.id = points.path_id)
+        LEFT JOIN LATERAL (
+            SELECT id, geom
+            FROM {table}
+            WHERE points.path_id IS NULL AND visible AND NOT draft AND id != %(exclude)s
+            ORDER BY geom <-> points.geom
+            LIMIT 1
+        ) AS closest ON TRUE
+        LEFT JOIN LATERAL ST_InterpolateAlong(COALESCE(snapped.geom, closest.geom), points.geom)
+             AS interpolated(position FLOAT, distance FLOAT) ON TRUE
+        ORDER BY points.idx
+        """.format(table=cls._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, {
+                'srid': settings.SRID,
+                'idx': list(range(len(points))),
+                'path_id': list(paths),
+                'x': [point.x for point in points],
+                'y': [point.y for point in points],
+                'exclude': exclude.pk if exclude and exclude.pk else -1,
+            })
+            rows = cursor.fetchall()
+        closest = cls.include_invisible.in_bulk({pk for idx, pk, position, offset in rows if pk is not None})
+        result = []
+        for idx, pk, position, offset in rows:
+            if pk is None:
+                if paths[idx] is not None:
+                    raise cls.DoesNotExist("Path %s does not exist" % paths[idx])
+                raise IndexError("No path found")
+            result.append((closest[pk], position, offset))
+        return result
+
     @classmethod
     def check_path_not_overlap(cls, geom, pk):
         """
@@ -244,22 +298,21 @@ class Path(CheckBoxActionMixin, ZoningPropertiesMixin, AddPropertyMixin, Geotrek
         r = super().delete(*args, **kwargs)
         if not Path.objects.exists():
             return r
-        for topology in topologies_list:
-            if isinstance(topology.geom, Point):
-                closest = self.closest(topology.geom, self)
-                position, offset = closest.interpolate(topology.geom)
-                new_topology = Topology.objects.create()
-                aggrobj = PathAggregation(topo_object=new_topology,
-                                          start_position=position,
-                                          end_position=position,
-                                          path=closest)
-                aggrobj.save()
-                point = Point(topology.geom.x, topology.geom.y, srid=settings.SRID)
-                new_topology.geom = point
-                new_topology.offset = offset
-                new_topology.position = position
-                new_topology.save()
-                topology.mutate(new_topology)
+        point_topologies = [topology for topology in topologies_list if isinstance(topology.geom, Point)]
+        snapped = self.closest_interpolated([topology.geom for topology in point_topologies], exclude=self)
+        for topology, (closest, position, offset) in zip(point_topologies, snapped):
+            new_topology = Topology.objects.create()
+            aggrobj = PathAggregation(topo_object=new_topology,
+                                      start_position=position,
+                                      end_position=position,
+                                      path=closest)
+            aggrobj.save()
+            point = Point(topology.geom.x, topology.geom.y, srid=settings.SRID)
+            new_topology.geom = point
+            new_topology.offset = offset
+            new_topology.position = position
+            new_topology.save()
+            topology.mutate(new_topology)
         return r
 
     @property
@@ -431,61 +484,75 @@ class Topology(ZoningPropertiesMixin, AddPropertyMixin, AltimetryMixin,
         return aggr
 
     @classmethod
-    def overlapping(cls, queryset, all_objects=None):
-        """ Return a Topology queryset overlapping specified topologies.
+    def overlapping_pks(cls, topologies):
+        """ Primary keys of topologies of this kind overlapping each of the specified topologies,
+        computed in one query. Returns {topology pk: [pk, ...]}, ordered by progression along the topology.
         """
-        if all_objects is None:
-            all_objects = cls.objects.existing()
-        is_generic = all_objects.model.KIND == Topology.KIND
-        single_input = isinstance(queryset, QuerySet)
-
-        if single_input:
-            topology_pks = [str(pk) for pk in queryset.values_list('pk', flat=True)]
+        if isinstance(topologies, QuerySet):
+            pks = list(topologies.values_list('pk', flat=True))
         else:
-            topology_pks = [str(queryset.pk)]
-
-        if len(topology_pks) == 0:
-            return all_objects.filter(pk__in=[])
+            pks = [topology.pk for topology in topologies]
+        overlapping = {pk: [] for pk in pks}
+        if not pks:
+            return overlapping
 
         sql = """
-        WITH topologies AS (SELECT id FROM %(topology_table)s WHERE id IN (%(topology_list)s)),
-        -- Concerned aggregations
-             aggregations AS (SELECT * FROM %(aggregations_table)s a, topologies t
-                              WHERE a.topo_object_id = t.id),
-        -- Concerned paths along with (start, end)
-             paths_aggr AS (SELECT a.start_position AS start, a.end_position AS end, p.id, a.order AS order
-                            FROM %(paths_table)s p, aggregations a
-                            WHERE a.path_id = p.id
-                            ORDER BY a.order)
+        -- Concerned paths along with (start, end), for each source topology
+        WITH paths_aggr AS (SELECT a.topo_object_id AS source, a.start_position AS start, a.end_position AS end,
+                                   a.path_id AS id, a.order AS order
+                            FROM %(aggregations_table)s a
+                            WHERE a.topo_object_id = ANY(%%s))
         -- Retrieve primary keys
-        SELECT t.id
+        SELECT pa.source, t.id
         FROM %(topology_table)s t, %(aggregations_table)s a, paths_aggr pa
         WHERE a.path_id = pa.id AND a.topo_object_id = t.id
           AND least(a.start_position, a.end_position) <= greatest(pa.start, pa.end)
           AND greatest(a.start_position, a.end_position) >= least(pa.start, pa.end)
-          AND %(extra_condition)s
-        ORDER BY (pa.order + CASE WHEN pa.start > pa.end THEN (1 - a.start_position) ELSE a.start_position END);
+          AND (%%s OR t.kind = %%s)
+        ORDER BY pa.source, (pa.order + CASE WHEN pa.start > pa.end THEN (1 - a.start_position) ELSE a.start_position END);
         """ % {
             'topology_table': Topology._meta.db_table,
             'aggregations_table': PathAggregation._meta.db_table,
-            'paths_table': Path._meta.db_table,
-            'topology_list': ','.join(topology_pks),
-            'extra_condition': 'true' if is_generic else "kind = '%s'" % all_objects.model.KIND
         }
 
-        cursor = connection.cursor()
-        cursor.execute(sql)
-        result = cursor.fetchall()
-        pk_list = uniquify([row[0] for row in result])
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [pks, cls.KIND == Topology.KIND, cls.KIND])
+            for source, pk in cursor.fetchall():
+                overlapping[source].append(pk)
+        return {source: list(dict.fromkeys(pks)) for source, pks in overlapping.items()}
+
+    @classmethod
+    def overlapping(cls, queryset, all_objects=None):
+        """ Return a Topology queryset overlapping specified topologies.
+        """
+        if all_objects is None:
+            all_objects = cls.objects.existing()
+        topologies = queryset if isinstance(queryset, QuerySet) else [queryset]
+        overlapping = all_objects.model.overlapping_pks(topologies)
+        pk_list = list(dict.fromkeys(pk for pks in overlapping.values() for pk in pks))
+        if not pk_list:
+            return all_objects.filter(pk__in=[])
 
         # Return a QuerySet and preserve pk list order
-        # http://stackoverflow.com/a/1310188/141895
-        ordering = 'CASE %s END' % ' '.join(['WHEN %s.id=%s THEN %s' % (Topology._meta.db_table, id_, i)
-                                             for i, id_ in enumerate(pk_list)])
+        ordering = 'array_position(%%s::integer[], %s.id)' % Topology._meta.db_table
         queryset = all_objects.filter(pk__in=pk_list).extra(
-            select={'ordering': ordering}, order_by=('ordering',))
+            select={'ordering': ordering}, select_params=[pk_list], order_by=('ordering',))
         return queryset
 
+    @classmethod
+    def prefetch_overlapping(cls, topologies, to_attr, queryset=None):
+        """ Set to_attr of each topology to the list of objects of this kind overlapping it,
+        ordered as overlapping() would, using one query for all topologies.
+        """
+        topologies = list(topologies)
+        overlapping = cls.overlapping_pks(topologies)
+        if queryset is None:
+            queryset = cls.objects.existing()
+        objects = queryset.in_bulk({pk for pks in overlapping.values() for pk in pks})
+        for topology in topologies:
+            setattr(topology, to_attr, [objects[pk] for pk in overlapping[topology.pk] if pk in objects])
+        return topologies
+
     def mutate(self, other):
         """
         Take alls attributes of the other topology specified and
@@ -613,29 +680,37 @@ class Topology(ZoningPropertiesMixin, AddPropertyMixin, AltimetryMixin,
         Receives a point (lng, lat) with API_SRID, and returns
         a topology objects with a computed path aggregation.
         """
-        # Find closest path
         point = Point(lng, lat, srid=settings.API_SRID)
-        point.transform(settings.SRID)
-        if snap is None:
-            closest = Path.closest(point)
-            position, offset = closest.interpolate(point)
-        else:
-            closest = Path.objects.get(pk=snap)
-            position, offset = closest.interpolate(point)
-            offset = 0
-        # We can now instantiante a Topology object
-        topology = Topology(kind=kind, offset=offset)
-        aggr = PathAggregation(
-            topo_object=topology,
-            path=closest,
-            start_position=position,
-            end_position=position
-        )
-        topology.aggregations = [aggr]
-        closest.aggregations.add(aggr)
-        point = Point(point.x, point.y, srid=settings.SRID)
-        topology.geom = point
-        return topology
+        return cls.topologypoints([point], snaps=[snap], kind=kind)[0]
+
+    @classmethod
+    def topologypoints(cls, points, snaps=None, kind=None):
+        """
+        Receives points, and optionally for each of them the path to snap on, and returns
+        topology objects with computed path aggregations.
+        All points are snapped on paths in a single query.
+        """
+        points = [point.transform(settings.SRID, clone=True) for point in points]
+        snaps = snaps or [None] * len(points)
+        # Find closest paths
+        snapped = Path.closest_interpolated(points, paths=snaps)
+        topologies = []
+        for point, snap, (closest, position, offset) in zip(points, snaps, snapped):
+            if snap is not None:
+                offset = 0
+            # We can now instantiante a Topology object
+            topology = Topology(kind=kind, offset=offset)
+            aggr = PathAggregation(
+                topo_object=topology,
+                path=closest,
+                start_position=position,
+                end_position=position
+            )
+            topology.aggregations = [aggr]
+            closest.aggregations.add(aggr)
+            topology.geom = Point(point.x, point.y, srid=settings.SRID)
+            topologies.append(topology)
+        return topologies
 
     @classmethod
     def deserialize(cls, serialized):
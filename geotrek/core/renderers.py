@@ -0,0 +1,12 @@
+from rest_framework.renderers import BaseRenderer
+
+
+class GraphCSRRenderer(BaseRenderer):
+    """ Graph of paths as compressed adjacency arrays (see ``PathGraph.serialize_csr``) """
+    media_type = 'application/octet-stream'
+    format = 'bin'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
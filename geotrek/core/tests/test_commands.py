@@ -6,9 +6,10 @@ from django.contrib.gis.geos import LineString, MultiLineString, Point, GEOSGeom
 from django.core.management import call_command
 from django.core.management.base import CommandError
 from django.test import TestCase, override_settings
-from django.db import connection, IntegrityError
+from django.db import connection, DataError, IntegrityError
 
 from geotrek.authent.models import Structure
+from geotrek.core.management.commands.loadpaths import Command
 from geotrek.core.models import Path, PathAggregation
 from geotrek.core.tests.factories import PathFactory, TopologyFactory
 from geotrek.trekking.tests.factories import POIFactory, TrekFactory
@@ -231,6 +232,47 @@ class LoadPathsCommandTest(TestCase):
         self.assertEqual(value.name, 'lulu')
         self.assertEqual(value.structure, self.structure)
 
+    @override_settings(SRID=4326, SPATIAL_EXTENT=(-1, -1, 1, 5))
+    def test_load_paths_bulk(self):
+        call_command('loadpaths', self.filename, '--bulk', srid=4326, comment=['comment', 'foo'], verbosity=0)
+        self.assertEqual(Path.objects.count(), 1)
+        value = Path.objects.first()
+        self.assertEqual(value.name, 'lulu')
+        self.assertEqual(value.comments, 'Comment 2</br>foo2')
+        self.assertEqual(value.structure, self.structure)
+        self.assertIsNotNone(value.geom_3d)
+
+    @override_settings(SRID=4326, SPATIAL_EXTENT=(-2, -1, 5, 5))
+    def test_load_paths_bulk_split(self):
+        filename = os.path.join(os.path.dirname(__file__), 'data', 'paths_crossing.geojson')
+        call_command('loadpaths', filename, '--bulk', srid=4326, verbosity=0)
+        # A and B are split where they cross, C touches B by its extremity
+        self.assertQuerysetEqual(Path.objects.order_by('name').values_list('name', flat=True),
+                                 ['A', 'A', 'B', 'B', 'C'], transform=None)
+        self.assertFalse(Path.objects.filter(geom_3d__isnull=True).exists())
+
+    @override_settings(SRID=4326, SPATIAL_EXTENT=(-1, -1, 1, 5))
+    @mock.patch('geotrek.core.management.commands.loadpaths.Command.copy_value', return_value='x' * 300)
+    def test_load_paths_bulk_insert_fails_triggers_enabled(self, mocked_copy_value):
+        # Name longer than 250 characters, insertion fails
+        with self.assertRaises(DataError):
+            call_command('loadpaths', self.filename, '--bulk', srid=4326, verbosity=0)
+        self.assertEqual(Path.objects.count(), 0)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT tgname, tgenabled FROM pg_trigger WHERE tgname = ANY(%s)",
+                           [list(Command.bulk_disabled_triggers)])
+            triggers = dict(cursor.fetchall())
+        self.assertEqual(set(triggers), set(Command.bulk_disabled_triggers))
+        self.assertEqual(set(triggers.values()), {'O'})
+
+    @override_settings(SRID=4326, SPATIAL_EXTENT=(-1, 0, 4, 2))
+    def test_load_paths_bulk_fail_with_dry(self):
+        filename = os.path.join(os.path.dirname(__file__), 'data', 'bad_path.geojson')
+        output = StringIO()
+        call_command('loadpaths', filename, '-i', '--bulk', dry=True, verbosity=2, stdout=output)
+        self.assertIn('0 objects will be create, 1 objects failed;', output.getvalue())
+        self.assertEqual(Path.objects.count(), 0)
+
 
 @skipIf(not settings.TREKKING_TOPOLOGY_ENABLED, 'Test with dynamic segmentation only')
 class ReorderTopologiesPathAggregationTest(TestCase):
@@ -1,13 +1,19 @@
+import gzip
+import json
+import struct
+from array import array
+from datetime import timedelta
 from unittest import skipIf
 
 from django.conf import settings
-from django.contrib.gis.geos import LineString
+from django.contrib.gis.geos import LineString, Point
+from django.core.cache import caches
 from django.test import TestCase
 from django.urls import reverse
 from mapentity.tests.factories import UserFactory
 
-from geotrek.core.graph import graph_edges_nodes_of_qs
-from geotrek.core.models import Path
+from geotrek.core.graph import graph_edges_nodes_of_qs, PathGraph, PathRouter, update_graph_of_qs
+from geotrek.core.models import Path, Topology
 from geotrek.core.tests.factories import PathFactory
 
 
@@ -96,3 +102,198 @@ class SimpleGraph(TestCase):
         PathFactory(geom=LineString((0, 0), (1, 1)))
         response = self.client.get(self.url)
         self.assertNotEqual(response['Cache-Control'], None)
+
+    def test_json_graph_incremental_update(self):
+        path_1 = PathFactory(geom=LineString((0, 0), (1, 1)))
+        response = self.client.get(self.url)
+        version = int(response['X-Graph-Version'])
+        path_2 = PathFactory(geom=LineString((1, 1), (2, 2)))
+        response = self.client.get(self.url)
+        graph = response.json()
+        self.assertEqual(int(response['X-Graph-Version']), version + 1)
+        self.assertEqual(graph['edges'][str(path_1.pk)]['nodes_id'], [1, 2])
+        self.assertEqual(graph['edges'][str(path_2.pk)]['nodes_id'], [2, 3])
+        self.assertDictEqual(graph['nodes'], {'1': {'2': path_1.pk},
+                                              '2': {'1': path_1.pk, '3': path_2.pk},
+                                              '3': {'2': path_2.pk}})
+
+        path_2.delete()
+        graph = self.client.get(self.url).json()
+        self.assertEqual(list(graph['edges'].keys()), [str(path_1.pk)])
+        self.assertDictEqual(graph['nodes'], {'1': {'2': path_1.pk}, '2': {'1': path_1.pk}})
+
+    def test_json_graph_diff(self):
+        path_1 = PathFactory(geom=LineString((0, 0), (1, 1)))
+        response = self.client.get(self.url)
+        version = response['X-Graph-Version']
+        epoch = response['X-Graph-Epoch']
+        path_2 = PathFactory(geom=LineString((1, 1), (2, 2)))
+        diff = self.client.get(self.url, {'since': version, 'epoch': epoch}).json()
+        self.assertEqual(diff['epoch'], epoch)
+        self.assertEqual(diff['version'], int(version) + 1)
+        self.assertEqual(list(diff['edges'].keys()), [str(path_2.pk)])
+        self.assertEqual(diff['removed_edges'], [])
+        self.assertDictEqual(diff['nodes'], {'2': {'1': path_1.pk, '3': path_2.pk}, '3': {'2': path_2.pk}})
+
+    def test_json_graph_diff_other_epoch(self):
+        PathFactory(geom=LineString((0, 0), (1, 1)))
+        response = self.client.get(self.url)
+        version = response['X-Graph-Version']
+        # Graph built again from scratch, its node ids may not be the same
+        graph = self.client.get(self.url, {'since': version, 'epoch': 'other'}).json()
+        self.assertEqual(set(graph.keys()), {'edges', 'nodes'})
+        graph = self.client.get(self.url, {'since': version}).json()
+        self.assertEqual(set(graph.keys()), {'edges', 'nodes'})
+
+    def test_graph_update_late_commit(self):
+        path_1 = PathFactory(geom=LineString((0, 0), (1, 1)))
+        graph = update_graph_of_qs(PathGraph(), Path.objects.all(), Path.no_draft_latest_updated())
+        # Another path was committed meanwhile with a later timestamp
+        graph.latest += timedelta(hours=1)
+        path_2 = PathFactory(geom=LineString((1, 1), (2, 2)))
+        path_1.geom = LineString((0, 0), (0, 1), (1, 1))
+        path_1.save()
+        update_graph_of_qs(graph, Path.objects.all(), graph.latest)
+        self.assertEqual(set(graph.edges), {path_1.pk, path_2.pk})
+        self.assertEqual(graph.edges[path_1.pk]['length'], Path.objects.get(pk=path_1.pk).length)
+        self.assertEqual(graph.version, 2)
+
+    def test_graph_update_since(self):
+        path_1 = PathFactory(geom=LineString((0, 0), (1, 1)))
+        path_2 = PathFactory(geom=LineString((1, 1), (2, 2)))
+        graph = update_graph_of_qs(PathGraph(), Path.objects.all(), Path.no_draft_latest_updated())
+        path_1.geom = LineString((0, 0), (0, 1), (1, 1))
+        path_1.save()
+        with self.assertNumQueries(2):
+            # timestamps of paths updated since, extremities of changed ones
+            update_graph_of_qs(graph, Path.objects.all(), Path.no_draft_latest_updated(), since=graph.latest)
+        self.assertEqual(set(graph.edges), {path_1.pk, path_2.pk})
+        self.assertEqual(graph.edges[path_1.pk]['length'], Path.objects.get(pk=path_1.pk).length)
+        self.assertEqual(graph.version, 2)
+
+    def test_json_graph_not_written_while_locked(self):
+        PathFactory(geom=LineString((0, 0), (1, 1)))
+        response = self.client.get(self.url)
+        epoch = response['X-Graph-Epoch']
+        PathFactory(geom=LineString((1, 1), (2, 2)))
+        cache = caches['fat']
+        cache.add('path_graph_lock', True)
+        try:
+            response = self.client.get(self.url)
+        finally:
+            cache.delete('path_graph_lock')
+        # Served from a copy of its own, cached graph is left to the worker holding the lock
+        self.assertNotEqual(response['X-Graph-Epoch'], epoch)
+        self.assertEqual(len(response.json()['edges']), 2)
+        self.assertEqual(cache.get('path_graph').epoch, epoch)
+
+    def test_json_graph_diff_unknown_version(self):
+        PathFactory(geom=LineString((0, 0), (1, 1)))
+        graph = self.client.get(self.url, {'since': 1000}).json()
+        self.assertEqual(set(graph.keys()), {'edges', 'nodes'})
+
+    def test_json_graph_gzip(self):
+        PathFactory(geom=LineString((0, 0), (1, 1)))
+        graph = self.client.get(self.url).json()
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertDictEqual(json.loads(gzip.decompress(response.content)), graph)
+
+    def test_json_graph_gzip_refused(self):
+        PathFactory(geom=LineString((0, 0), (1, 1)))
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip;q=0, br;q=0, identity')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(set(response.json().keys()), {'edges', 'nodes'})
+
+    def test_csr_graph(self):
+        path_1 = PathFactory(geom=LineString((0, 0), (1, 0)))
+        path_2 = PathFactory(geom=LineString((1, 0), (1, 2)))
+        response = self.client.get(reverse('core:path-drf-graph-bin'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        content = response.content
+        magic, version, nb_nodes, nb_edges, size = struct.unpack_from('<4sIIII', content)
+        self.assertEqual((magic, version, nb_nodes, nb_edges, size), (b'GTG1', int(response['X-Graph-Version']), 3, 2, 4))
+
+        def read(typecode, count, offset):
+            values = array(typecode)
+            values.frombytes(content[offset:offset + count * values.itemsize])
+            return list(values), offset + count * values.itemsize
+
+        node_ids, offset = read('i', nb_nodes, 20)
+        offsets, offset = read('I', nb_nodes + 1, offset)
+        neighbours, offset = read('I', size, offset)
+        neighbour_edges, offset = read('i', size, offset)
+        edge_ids, offset = read('i', nb_edges, offset)
+        extremities, offset = read('I', 2 * nb_edges, offset)
+        lengths, offset = read('d', nb_edges, offset)
+        self.assertEqual(offset, len(content))
+        self.assertEqual(node_ids, [1, 2, 3])
+        self.assertEqual(offsets, [0, 1, 3, 4])
+        self.assertEqual(neighbours, [1, 0, 2, 1])
+        self.assertEqual(neighbour_edges, [path_1.pk, path_1.pk, path_2.pk, path_2.pk])
+        self.assertEqual(edge_ids, [path_1.pk, path_2.pk])
+        self.assertEqual(extremities, [0, 1, 1, 2])
+        self.assertAlmostEqual(lengths[0], 1)
+        self.assertAlmostEqual(lengths[1], 2)
+
+
+@skipIf(not settings.TREKKING_TOPOLOGY_ENABLED, 'Test with dynamic segmentation only')
+class RouteTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+        cls.url = reverse('core:path-drf-route')
+        cls.path_1 = PathFactory(geom=LineString((0, 0), (100, 0)))
+        cls.path_2 = PathFactory(geom=LineString((100, 0), (100, 100)))
+        cls.path_3 = PathFactory(geom=LineString((100, 100), (0, 100)))
+
+    def setUp(self):
+        self.client.force_login(user=self.user)
+
+    def get_route(self, *coords):
+        steps = []
+        for x, y in coords:
+            point = Point(x, y, srid=settings.SRID).transform(settings.API_SRID, clone=True)
+            steps.append({'lat': point.y, 'lng': point.x})
+        return self.client.get(self.url, {'steps': json.dumps(steps)})
+
+    def test_route_router(self):
+        graph = graph_edges_nodes_of_qs(Path.objects.order_by('id'))
+        router = PathRouter(graph['edges'])
+        topology, length = router.route([(self.path_1.pk, 0.5), (self.path_3.pk, 0.5)])
+        self.assertEqual(topology, [{
+            'offset': 0,
+            'paths': [self.path_1.pk, self.path_2.pk, self.path_3.pk],
+            'positions': {'0': [0.5, 1.0], '1': [0.0, 1.0], '2': [0.0, 0.5]},
+        }])
+        self.assertAlmostEqual(length, 200)
+
+    def test_route_same_path(self):
+        response = self.get_route((20, 0), (70, 0))
+        self.assertEqual(response.status_code, 200)
+        route = response.json()
+        self.assertEqual(route['topology'][0]['paths'], [self.path_1.pk])
+        self.assertAlmostEqual(route['length'], 50, places=1)
+
+    def test_route_deserialize(self):
+        response = self.get_route((50, 0), (100, 50), (50, 100))
+        self.assertEqual(response.status_code, 200)
+        route = response.json()
+        self.assertEqual(len(route['topology']), 2)
+        self.assertAlmostEqual(route['length'], 200, places=1)
+        topology = Topology.deserialize(route['topology'])
+        self.assertSetEqual({aggr.path.pk for aggr in topology.aggregations.all()},
+                            {self.path_1.pk, self.path_2.pk, self.path_3.pk})
+
+    def test_route_invalid_steps(self):
+        response = self.client.get(self.url, {'steps': 'foo'})
+        self.assertEqual(response.status_code, 400)
+        response = self.get_route((50, 0))
+        self.assertEqual(response.status_code, 400)
+
+    def test_route_not_connected(self):
+        PathFactory(geom=LineString((1000, 1000), (1100, 1000)))
+        response = self.get_route((50, 0), (1050, 1000))
+        self.assertEqual(response.status_code, 404)
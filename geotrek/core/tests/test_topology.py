@@ -840,6 +840,26 @@ class TopologyDerialization(TestCase):
         self.assertAlmostEqual(pagg.start_position, 0.5, places=6)
         self.assertAlmostEqual(pagg.end_position, 0.5, places=6)
 
+    def test_topologypoints_batch(self):
+        p1 = PathFactory.create(geom=LineString((0, 0), (100, 0)))
+        p2 = PathFactory.create(geom=LineString((0, 100), (100, 100)))
+        points = [Point(25, 10, srid=settings.SRID), Point(50, 80, srid=settings.SRID),
+                  Point(75, -20, srid=settings.SRID)]
+        with self.assertNumQueries(2):
+            snapped = Path.closest_interpolated(points)
+        for point, (path, position, offset) in zip(points, snapped):
+            self.assertEqual(path, Path.closest(point))
+            expected_position, expected_offset = path.interpolate(point)
+            self.assertAlmostEqual(position, expected_position, places=6)
+            self.assertAlmostEqual(offset, expected_offset, places=6)
+        self.assertEqual([path for path, position, offset in snapped], [p1, p2, p1])
+        topologies = Topology.topologypoints(points, snaps=[None, p1.pk, None])
+        self.assertEqual([t.aggregations.get().path for t in topologies], [p1, p1, p1])
+        self.assertAlmostEqual(abs(topologies[0].offset), 10, places=6)
+        self.assertEqual(topologies[1].offset, 0)
+        self.assertAlmostEqual(topologies[1].aggregations.get().start_position, 0.5, places=6)
+        self.assertAlmostEqual(topologies[2].aggregations.get().end_position, 0.75, places=6)
+
     def test_deserialize_serialize(self):
         path = PathFactory.create(geom=LineString((1, 1), (2, 2), (2, 0)))
         before = TopologyFactory.create(offset=1, paths=[(path, 0.5, 0.5)])
@@ -904,3 +924,17 @@ class TopologyOverlappingTest(TestCase):
         from geotrek.trekking.models import Trek
         overlaps = Topology.overlapping(Trek.objects.all())
         self.assertEqual(list(overlaps), [])
+
+    def test_overlapping_pks_of_several_topologies(self):
+        overlaps = Topology.overlapping_pks(Topology.objects.filter(pk__in=[self.topo1.pk, self.topo2.pk]))
+        self.assertEqual(overlaps, {
+            self.topo1.pk: [self.topo1.pk, self.point2.pk, self.point3.pk, self.point1.pk, self.topo2.pk],
+            self.topo2.pk: [self.topo2.pk, self.point1.pk, self.point3.pk, self.point2.pk, self.topo1.pk],
+        })
+
+    def test_prefetch_overlapping(self):
+        topo1, topo2 = Topology.objects.filter(pk__in=[self.topo1.pk, self.topo2.pk]).order_by('pk')
+        with self.assertNumQueries(2):
+            Topology.prefetch_overlapping([topo1, topo2], 'overlaps')
+        self.assertEqual(topo1.overlaps, list(Topology.overlapping(self.topo1)))
+        self.assertEqual(topo2.overlaps, list(Topology.overlapping(self.topo2)))
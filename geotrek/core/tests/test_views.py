@@ -14,6 +14,7 @@ from django.test import TestCase
 from mapentity.tests.factories import UserFactory
 
 from geotrek.common.tests import CommonTest
+from geotrek.common.versions import get_subset_version, get_version
 
 from geotrek.authent.tests.factories import PathManagerFactory, StructureFactory
 from geotrek.authent.tests.base import AuthentFixturesTest
@@ -581,10 +582,8 @@ class PathViewsTest(CommonTest):
 
         # We check the content was created and cached with no_draft key
         # We check that any cached content can be found with no_draft (we still didn't ask for it)
-        last_update = Path.no_draft_latest_updated()
-        last_update_draft = Path.latest_updated()
-        geojson_lookup = 'en_path_%s_nodraft_json_layer' % last_update.strftime('%y%m%d%H%M%S%f')
-        geojson_lookup_last_update_draft = 'en_path_%s_json_layer' % last_update_draft.strftime('%y%m%d%H%M%S%f')
+        geojson_lookup = 'en_path_%s_nodraft_json_layer' % get_subset_version(Path, 'nodraft')
+        geojson_lookup_last_update_draft = 'en_path_%s_json_layer' % get_version(Path)
         content = cache.get(geojson_lookup)
         content_draft = cache.get(geojson_lookup_last_update_draft)
 
@@ -624,10 +623,8 @@ class PathViewsTest(CommonTest):
 
         # We check the content was created and cached without no_draft key
         # We check that any cached content can be found without no_draft (we still didn't ask for it)
-        last_update_no_draft = Path.no_draft_latest_updated()
-        last_update = Path.latest_updated()
-        geojson_lookup_no_draft = 'en_path_%s_nodraft_json_layer' % last_update_no_draft.strftime('%y%m%d%H%M%S%f')
-        geojson_lookup = 'en_path_%s_json_layer' % last_update.strftime('%y%m%d%H%M%S%f')
+        geojson_lookup_no_draft = 'en_path_%s_nodraft_json_layer' % get_subset_version(Path, 'nodraft')
+        geojson_lookup = 'en_path_%s_json_layer' % get_version(Path)
         content_no_draft = cache.get(geojson_lookup_no_draft)
         content = cache.get(geojson_lookup)
 
@@ -1,3 +1,4 @@
+import json
 import logging
 from collections import defaultdict
 
@@ -5,6 +6,7 @@ from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import permission_required
 from django.contrib.gis.db.models.functions import Transform
+from django.contrib.gis.geos import Point
 from django.core.cache import caches
 from django.db.models import Sum, Prefetch
 from django.http import HttpResponseRedirect
@@ -12,6 +14,7 @@ from django.http.response import HttpResponse
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.utils.decorators import method_decorator
+from django.utils.cache import patch_vary_headers
 from django.utils.translation import gettext as _
 from django.views.decorators.cache import cache_control
 from django.views.decorators.http import last_modified as cache_last_modified
@@ -30,15 +33,36 @@ from geotrek.common.mixins.views import CustomColumnsMixin
 from geotrek.common.mixins.forms import FormsetMixin
 from geotrek.common.permissions import PublicOrReadPermMixin
 from geotrek.common.viewsets import GeotrekMapentityViewSet
+from geotrek.common.versions import get_subset_version, get_version
 from . import graph as graph_lib
 from .filters import PathFilterSet, TrailFilterSet
 from .forms import PathForm, TrailForm, CertificationTrailFormSet
 from .models import AltimetryMixin, Path, Trail, Topology, CertificationTrail
+from .renderers import GraphCSRRenderer
 from .serializers import PathSerializer, PathGeojsonSerializer, TrailSerializer, TrailGeojsonSerializer
 
 logger = logging.getLogger(__name__)
 
 
+def accepted_encodings(accept_encoding):
+    """ Return quality value of each encoding listed in Accept-Encoding header """
+    accepted = {}
+    for item in accept_encoding.split(','):
+        encoding, *params = [part.strip() for part in item.split(';')]
+        if not encoding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _sep, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[encoding.lower()] = quality
+    return accepted
+
+
 class CreateFromTopologyMixin:
     def on_topology(self):
         pk = self.request.GET.get('topology')
@@ -238,19 +262,11 @@ class PathViewSet(GeotrekMapentityViewSet):
         """Used by the ``view_cache_response_content`` decorator."""
         language = self.request.LANGUAGE_CODE
         no_draft = self.request.GET.get('_no_draft')
-        if no_draft:
-            latest_saved = Path.no_draft_latest_updated()
-        else:
-            latest_saved = Path.latest_updated()
-        geojson_lookup = None
-
-        if latest_saved:
-            geojson_lookup = '%s_path_%s%s_json_layer' % (
-                language,
-                latest_saved.strftime('%y%m%d%H%M%S%f'),
-                '_nodraft' if no_draft else ''
-            )
-        return geojson_lookup
+        return '%s_path_%s%s_json_layer' % (
+            language,
+            get_subset_version(Path, 'nodraft') if no_draft else get_version(Path),
+            '_nodraft' if no_draft else ''
+        )
 
     def get_queryset(self):
         qs = self.model.objects.all()
@@ -281,24 +297,103 @@ class PathViewSet(GeotrekMapentityViewSet):
     @method_decorator(cache_last_modified(lambda x: Path.no_draft_latest_updated()))
     @action(methods=['GET'], detail=False, url_path='graph.json', renderer_classes=[JSONRenderer, BrowsableAPIRenderer])
     def graph(self, request, *args, **kwargs):
-        """ Return a graph of the path. """
-        cache = caches['fat']
-        key = 'path_graph_json'
-
-        result = cache.get(key)
-        latest = Path.no_draft_latest_updated()
+        """ Return a graph of the path, or its changes since version given by ``since`` and ``epoch`` parameters. """
+        graph = self.get_graph()
+        data = None
+        since = request.GET.get('since')
+        if since:
+            try:
+                data = graph.diff(int(since), request.GET.get('epoch'))
+            except ValueError:
+                pass
+        if data is None and request.accepted_renderer.format == 'json':
+            return self.encoded_graph_response(graph, 'json', 'application/json')
+        response = Response(data if data is not None else graph.serialize())
+        response['X-Graph-Epoch'] = graph.epoch
+        response['X-Graph-Version'] = graph.version
+        return response
 
-        if result and latest:
-            cache_latest, graph = result
-            # Not empty and still valid
-            if cache_latest and cache_latest >= latest:
-                return Response(graph)
+    @method_decorator(cache_control(max_age=0, must_revalidate=True))
+    @method_decorator(cache_last_modified(lambda x: Path.no_draft_latest_updated()))
+    @action(methods=['GET'], detail=False, url_path='graph.bin', renderer_classes=[GraphCSRRenderer])
+    def graph_bin(self, request, *args, **kwargs):
+        """ Return the graph of the path as compressed adjacency arrays (see ``PathGraph.serialize_csr``). """
+        return self.encoded_graph_response(self.get_graph(), 'csr', 'application/octet-stream')
+
+    def encoded_graph_response(self, graph, fmt, content_type):
+        """ Serve the pre-encoded graph, compressed as accepted by client """
+        encodings = graph.encoded[fmt]
+        accepted = accepted_encodings(self.request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        encoding = next((encoding for encoding in ('br', 'gzip')
+                         if encoding in encodings and accepted.get(encoding, accepted.get('*', 0)) > 0), 'identity')
+        response = HttpResponse(encodings[encoding], content_type=content_type)
+        if encoding != 'identity':
+            response['Content-Encoding'] = encoding
+        patch_vary_headers(response, ('Accept-Encoding',))
+        response['X-Graph-Epoch'] = graph.epoch
+        response['X-Graph-Version'] = graph.version
+        return response
 
-        # cache does not exist or is not up-to-date, rebuild the graph and cache it
-        graph = graph_lib.graph_edges_nodes_of_qs(Path.objects.exclude(draft=True))
+    @action(methods=['GET'], detail=False, url_path='route', renderer_classes=[JSONRenderer])
+    def route(self, request, *args, **kwargs):
+        """ Return the shortest route through ``steps`` (JSON list of lat/lng), as a serialized topology. """
+        try:
+            steps = json.loads(request.GET.get('steps', ''))
+            points = [Point(float(step['lng']), float(step['lat']), srid=settings.API_SRID) for step in steps]
+        except (ValueError, TypeError, KeyError):
+            points = []
+        if len(points) < 2:
+            return Response({'error': _("At least two steps with lat and lng are required")}, status=400)
+        try:
+            snapped = Path.closest_interpolated(points)
+        except IndexError:
+            return Response({'error': _("No path found")}, status=404)
+        waypoints = [(closest.pk, position) for closest, position, offset in snapped]
+        result = self.get_graph().router().route(waypoints)
+        if result is None:
+            return Response({'error': _("No route found")}, status=404)
+        topology, length = result
+        return Response({'topology': topology, 'length': length})
+
+    def get_graph(self):
+        """ Return the graph of non-draft paths, up-to-date.
+        Only one worker at a time writes the cached graph, so that an epoch and a version
+        always designate the same graph.
+        """
+        cache = caches['fat']
+        key = 'path_graph'
+        lock_key = 'path_graph_lock'
 
-        cache.set(key, (latest, graph))
-        return Response(graph)
+        graph = cache.get(key)
+        latest = Path.no_draft_latest_updated()
+        # Bumped once changes are committed, even when they are older than latest update
+        version = get_version(Path)
+
+        if graph is not None and not graph.is_stale(version, latest) and graph.encoded_version == graph.version:
+            return graph
+        if not cache.add(lock_key, True, 60):
+            # Another worker is writing the cached graph, bring a copy up-to-date apart from it
+            graph = graph or graph_lib.PathGraph()
+            graph.fork()
+            self.update_graph(graph, version, latest)
+            graph.encode()
+            return graph
+        try:
+            # Cached graph may have been written meanwhile
+            graph = cache.get(key) or graph_lib.PathGraph()
+            if graph.is_stale(version, latest):
+                self.update_graph(graph, version, latest)
+            graph.encode()
+            cache.set(key, graph)
+        finally:
+            cache.delete(lock_key)
+        return graph
+
+    def update_graph(self, graph, version, latest):
+        # Paths can only be added or removed along with a new version, otherwise only look at latest updates
+        since = graph.latest if graph.source_version == version else None
+        graph_lib.update_graph_of_qs(graph, Path.objects.exclude(draft=True), latest, since=since)
+        graph.source_version = version
 
     @method_decorator(permission_required('core.change_path'))
     @action(methods=['POST'], detail=False, renderer_classes=[JSONRenderer])
@@ -24,6 +24,7 @@ from geotrek.common.tests import (CommonTest, GeotrekAPITestCase,
 from geotrek.common.utils.testdata import (get_dummy_uploaded_file,
                                            get_dummy_uploaded_image,
                                            get_dummy_uploaded_image_svg)
+from geotrek.common.versions import get_version
 from geotrek.feedback import models as feedback_models
 from geotrek.maintenance.tests.factories import (
     InfrastructureInterventionFactory, ReportInterventionFactory)
@@ -91,8 +92,7 @@ class ReportSerializationOptimizeTests(TestCase):
         self.assertEqual(len(response.json()['features']), 4)
 
         # We check the content was created and cached
-        last_update_status = feedback_models.Report.latest_updated()
-        geojson_lookup = f"fr_report_{last_update_status.isoformat()}_{self.user.pk}_geojson_layer"
+        geojson_lookup = f"fr_report_{get_version(feedback_models.Report)}_{self.user.pk}_geojson_layer"
         cache_content = cache.get(geojson_lookup)
 
         self.assertEqual(response.content, cache_content.content)
@@ -21,6 +21,7 @@ from geotrek.common.mixins.api import APIViewSet
 from geotrek.common.mixins.views import CustomColumnsMixin
 from geotrek.common.models import Attachment, FileType
 from geotrek.common.viewsets import GeotrekMapentityViewSet
+from geotrek.common.versions import get_version
 from . import models as feedback_models, serializers as feedback_serializers
 from .filters import ReportFilterSet, ReportNoEmailFilterSet
 from .forms import ReportForm
@@ -160,15 +161,11 @@ class ReportViewSet(GeotrekMapentityViewSet):
     def view_cache_key(self):
         """ Used by the ``view_cache_response_content`` decorator. """
         language = get_language()
-        geojson_lookup = None
-        latest_saved = feedback_models.Report.latest_updated()
-        if latest_saved:
-            geojson_lookup = '%s_report_%s_%s_geojson_layer' % (
-                language,
-                latest_saved.isoformat(),
-                self.request.user.pk if settings.SURICATE_WORKFLOW_ENABLED else ''
-            )
-        return geojson_lookup
+        return '%s_report_%s_%s_geojson_layer' % (
+            language,
+            get_version(feedback_models.Report),
+            self.request.user.pk if settings.SURICATE_WORKFLOW_ENABLED else ''
+        )
 
 
 class ReportAPIViewSet(APIViewSet):
@@ -1,12 +1,13 @@
 import os
 from datetime import datetime
+from django.apps import apps
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.gis.db import models
 from django.contrib.gis.geos import GeometryCollection
 from django.contrib.postgres.indexes import GistIndex
-from django.db.models import Q
+from django.db.models import Case, OuterRef, Q, Subquery, When
 from django.utils.translation import gettext_lazy as _
 
 from geotrek.altimetry.models import AltimetryMixin
@@ -15,7 +16,7 @@ from geotrek.common.mixins.models import (TimeStampedModelMixin, NoDeleteMixin,
                                           GeotrekMapEntityMixin, get_uuid_duplication)
 from geotrek.common.models import Organism
 from geotrek.common.utils import classproperty
-from geotrek.core.models import Topology, Path, Trail
+from geotrek.core.models import Topology, Path, PathAggregation, Trail
 from geotrek.maintenance.managers import InterventionManager, ProjectManager
 from geotrek.zoning.mixins import ZoningPropertiesMixin
 
@@ -174,6 +175,18 @@ class Intervention(ZoningPropertiesMixin, AddPropertyMixin, GeotrekMapEntityMixi
                 return self.target.paths.all()
         return Path.objects.none()
 
+    @classmethod
+    def target_topologies(cls, interventions):
+        """ Topologies targeted by interventions, signages of targeted blades included, as a subquery
+        """
+        topology_models = [model for model in apps.get_models() if issubclass(model, Topology)]
+        topology_types = ContentType.objects.get_for_models(*topology_models).values()
+        q = Q(pk__in=interventions.filter(target_type__in=topology_types).values('target_id'))
+        if 'geotrek.signage' in settings.INSTALLED_APPS:
+            blades = interventions.filter(target_type=ContentType.objects.get_for_model(Blade)).values('target_id')
+            q |= Q(pk__in=Blade.objects.filter(pk__in=blades).values('signage'))
+        return Topology.objects.filter(q)
+
     @property
     def trails(self):
         s = []
@@ -447,25 +460,17 @@ class Project(ZoningPropertiesMixin, AddPropertyMixin, GeotrekMapEntityMixin, Ti
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._geom = None
+        self._geom_collected = False
 
     @property
     def paths(self):
-        s = []
-        for i in self.interventions.existing():
-            if hasattr(i, 'paths'):
-                s += i.paths
-        return Path.objects.filter(pk__in=[p.pk for p in set(s)])
+        topologies = Intervention.target_topologies(self.interventions.existing())
+        return Path.objects.filter(pk__in=PathAggregation.objects.filter(topo_object__in=topologies).values('path'))
 
     @property
     def trails(self):
-        s = []
-        for i in self.interventions.existing():
-            if i.target and hasattr(i.target, 'paths'):
-                for p in i.target.paths.all():
-                    for t in p.trails.all():
-                        s.append(t.pk)
-
-        return Trail.objects.filter(pk__in=s)
+        return Trail.objects.existing().filter(
+            pk__in=PathAggregation.objects.filter(path__in=self.paths).values('topo_object'))
 
     @property
     def signages(self):
@@ -476,7 +481,7 @@ class Project(ZoningPropertiesMixin, AddPropertyMixin, GeotrekMapEntityMixin, Ti
     @property
     def infrastructures(self):
         from geotrek.infrastructure.models import Infrastructure
-        target_ids = list(self.interventions.existing().filter(target_type=ContentType.objects.get_for_model(Infrastructure)).values_list('target_id', flat=True))
+        target_ids = self.interventions.existing().filter(target_type=ContentType.objects.get_for_model(Infrastructure)).values_list('target_id', flat=True)
         return list(Infrastructure.objects.filter(topo_object__in=target_ids))
 
     @classproperty
@@ -487,23 +492,54 @@ class Project(ZoningPropertiesMixin, AddPropertyMixin, GeotrekMapEntityMixin, Ti
         c.name = 'geom'
         return c
 
+    @classmethod
+    def collect_geoms(cls, projects):
+        """ Merge interventions targets geometries of each project into a collection, in one query.
+        Returns a dict of collections by project pk, without projects having no geometry.
+        """
+        interventions = Intervention.objects.existing().filter(
+            project__in=[project.pk for project in projects], target_id__isnull=False).order_by()
+        whens = []
+        for target_type in interventions.values_list('target_type', flat=True).distinct():
+            model = ContentType.objects.get_for_id(target_type).model_class()
+            if model is None:
+                continue
+            lookup = 'topology__geom' if model._meta.model_name == 'blade' else 'geom'
+            targets = model._base_manager.filter(pk=OuterRef('target_id')).values(lookup)[:1]
+            whens.append(When(target_type=target_type, then=Subquery(targets)))
+        if not whens:
+            return {}
+        target_geom = Case(*whens, output_field=models.GeometryField(srid=settings.SRID))
+        geoms = {}
+        for project, collection in interventions.values_list('project').annotate(geom=models.Collect(target_geom)):
+            if collection is None:
+                continue
+            flattened = []
+            for geom in collection:
+                if isinstance(geom, GeometryCollection):
+                    flattened.extend(geom)
+                else:
+                    flattened.append(geom)
+            geoms[project] = GeometryCollection(*flattened, srid=settings.SRID)
+        return geoms
+
+    @classmethod
+    def prefetch_geom(cls, projects):
+        """ Set geometry of a list of projects at once """
+        projects = list(projects)
+        geoms = cls.collect_geoms(projects)
+        for project in projects:
+            project._geom = geoms.get(project.pk)
+            project._geom_collected = True
+        return projects
+
     @property
     def geom(self):
         """ Merge all interventions geometry into a collection
         """
-        if self._geom is None:
-            interventions = Intervention.objects.existing().filter(project=self)
-            geoms = []
-            for i in interventions:
-                geom = i.geom
-                if geom is not None:
-                    if isinstance(geom, GeometryCollection):
-                        for sub_geom in geom:
-                            geoms.append(sub_geom)
-                    else:
-                        geoms.append(geom)
-            if geoms:
-                self._geom = GeometryCollection(*geoms, srid=settings.SRID)
+        if self._geom is None and not self._geom_collected:
+            self._geom = self.collect_geoms([self]).get(self.pk)
+            self._geom_collected = True
         return self._geom
 
     @property
@@ -576,20 +612,22 @@ class Project(ZoningPropertiesMixin, AddPropertyMixin, GeotrekMapEntityMixin, Ti
 
     def edges_by_attr(self, interventionattr):
         """ Return related topology objects of project, by aggregating the same attribute
-        on its interventions.
+        on its interventions. Targets are loaded at once, and attribute is computed once by target.
         (See geotrek.land.models)
         """
         pks = []
         modelclass = Topology
-        for i in self.interventions.all():
+        targets = set()
+        for i in self.interventions.all().prefetch_related('target'):
+            if (i.target_type_id, i.target_id) in targets:
+                continue
+            targets.add((i.target_type_id, i.target_id))
             attr_value = getattr(i, interventionattr)
             if isinstance(attr_value, list):
                 pks += [o.pk for o in attr_value]
             else:
                 modelclass = attr_value.model
-                topologies = attr_value.values('id')
-                for topology in topologies:
-                    pks.append(topology['id'])
+                pks += attr_value.values_list('pk', flat=True)
         return modelclass.objects.filter(pk__in=pks)
 
     @classmethod
@@ -1,6 +1,7 @@
 from drf_dynamic_fields import DynamicFieldsMixin
 from mapentity.serializers import MapentityGeojsonModelSerializer
 from rest_framework import serializers
+from rest_framework_gis.serializers import GeoFeatureModelListSerializer
 
 from .models import Intervention, Project
 
@@ -34,7 +35,14 @@ class ProjectSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
         fields = "__all__"
 
 
+class ProjectGeojsonListSerializer(GeoFeatureModelListSerializer):
+    def to_representation(self, data):
+        # Geometries of all projects at once, instead of querying interventions and targets of each one
+        return super().to_representation(Project.prefetch_geom(data))
+
+
 class ProjectGeojsonSerializer(MapentityGeojsonModelSerializer):
     class Meta(MapentityGeojsonModelSerializer.Meta):
         model = Project
         fields = ["id", "name"]
+        list_serializer_class = ProjectGeojsonListSerializer
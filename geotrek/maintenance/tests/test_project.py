@@ -5,8 +5,9 @@ from unittest import skipIf
 
 from geotrek.infrastructure.tests.factories import InfrastructureFactory
 from geotrek.signage.tests.factories import SignageFactory
+from geotrek.maintenance.models import Project
 from geotrek.maintenance.tests.factories import InterventionFactory, ProjectFactory
-from geotrek.core.tests.factories import TopologyFactory
+from geotrek.core.tests.factories import TopologyFactory, TrailFactory
 from geotrek.land.tests.factories import (SignageManagementEdgeFactory, WorkManagementEdgeFactory,
                                           CompetenceEdgeFactory)
 
@@ -147,3 +148,51 @@ class ProjectLandTest(TestCase):
     def test_project_has_competence_management(self):
         self.assertIn(self.competencemgt, self.intervention.competence_edges)
         self.assertIn(self.competencemgt, self.project.competence_edges)
+
+
+class ProjectAggregationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        if settings.TREKKING_TOPOLOGY_ENABLED:
+            cls.infra = InfrastructureFactory.create()
+            cls.sign = SignageFactory.create()
+        else:
+            cls.infra = InfrastructureFactory.create(geom="SRID=2154;POINT(700000 6600000)")
+            cls.sign = SignageFactory.create(geom="SRID=2154;POINT(700100 6600000)")
+        cls.project1 = ProjectFactory.create()
+        cls.project1.interventions.add(InterventionFactory.create(target=cls.infra))
+        cls.project1.interventions.add(InterventionFactory.create(target=cls.sign))
+        cls.project2 = ProjectFactory.create()
+        cls.project2.interventions.add(InterventionFactory.create(target=cls.sign))
+        cls.project3 = ProjectFactory.create()
+
+    def test_geom_is_collected_in_one_query(self):
+        Project.collect_geoms([self.project1])  # Load content types cache
+        project = Project.objects.get(pk=self.project1.pk)
+        with self.assertNumQueries(2):
+            geom = project.geom
+        self.assertEqual(len(geom), 2)
+        self.assertCountEqual([g.wkt for g in geom], [self.infra.geom.wkt, self.sign.geom.wkt])
+        with self.assertNumQueries(0):
+            self.assertEqual(project.geom, geom)
+
+    def test_prefetch_geom(self):
+        Project.collect_geoms([self.project1])  # Load content types cache
+        projects = list(Project.objects.filter(pk__in=[self.project1.pk, self.project2.pk, self.project3.pk]))
+        with self.assertNumQueries(2):
+            Project.prefetch_geom(projects)
+        with self.assertNumQueries(0):
+            geoms = {project.pk: project.geom for project in projects}
+        self.assertEqual(len(geoms[self.project1.pk]), 2)
+        self.assertEqual([g.wkt for g in geoms[self.project2.pk]], [self.sign.geom.wkt])
+        self.assertIsNone(geoms[self.project3.pk])
+
+    @skipIf(not settings.TREKKING_TOPOLOGY_ENABLED, 'Test with dynamic segmentation only')
+    def test_paths_and_trails_in_one_query(self):
+        paths = [self.infra.paths.get(), self.sign.paths.get()]
+        trail = TrailFactory.create(paths=[paths[0]])
+        list(self.project2.paths)  # Load content types cache
+        with self.assertNumQueries(1):
+            self.assertCountEqual(self.project1.paths, paths)
+        with self.assertNumQueries(1):
+            self.assertEqual(list(self.project1.trails), [trail])
@@ -332,7 +332,16 @@ CACHES = {
         'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
         'LOCATION': os.path.join(CACHE_ROOT, 'api_v2'),
         'TIMEOUT': 2592000,  # 30 days
-    }
+    },
+    # Elevation profiles and charts, stored once per 3D geometry and ALTIMETRIC_* settings
+    'altimetry': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(CACHE_ROOT, 'altimetry'),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
 }
 
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
@@ -441,6 +450,7 @@ ALTIMETRIC_PROFILE_FONT = 'ubuntu'
 ALTIMETRIC_PROFILE_MIN_YSCALE = 1200  # Minimum y scale (in meters)
 ALTIMETRIC_AREA_MAX_RESOLUTION = 150  # Maximum number of points (by width/height)
 ALTIMETRIC_AREA_MARGIN = 0.15
+ALTIMETRIC_PROFILE_PRECOMPUTE = False  # Compute elevation profiles and charts in background (celery) after save
 
 # Let this be defined at instance-level
 LEAFLET_CONFIG = {
@@ -760,6 +770,7 @@ THUMBNAIL_COPYRIGHT_FORMAT = ""
 # You can also add legend
 
 THUMBNAIL_COPYRIGHT_SIZE = 15
+THUMBNAILS_PRECOMPUTE = False  # Generate thumbnails of pictures in background (celery) after upload or import
 PAPERCLIP_MAX_ATTACHMENT_WIDTH = 1280
 PAPERCLIP_MAX_ATTACHMENT_HEIGHT = 1280
 PAPERCLIP_MIN_IMAGE_UPLOAD_WIDTH = None
@@ -42,6 +42,10 @@ CACHES['api_v2'] = {
     'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     'LOCATION': 'api_v2',
 }
+CACHES['altimetry'] = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'altimetry',
+}
 
 
 class DisableMigrations():
@@ -18,6 +18,7 @@ class Command(BaseCommand):
     help = 'Load a layer with point geometries in te structure model\n'
     can_import_settings = True
     counter = 0
+    chunk_size = 1000
 
     def add_arguments(self, parser):
         parser.add_argument('point_layer')
@@ -134,6 +135,7 @@ class Command(BaseCommand):
                         "Change your --code-field option"))
                     break
 
+                features = []
                 for feature in layer:
                     feature_geom = feature.geom
                     name = feature.get(field_name) if field_name in available_fields else options.get('name_default')
@@ -161,8 +163,14 @@ class Command(BaseCommand):
                     eid = feature.get(field_eid) if field_eid in available_fields else None
                     code = feature.get(field_code) if field_code in available_fields else options.get('code_default')
 
-                    self.create_signage(feature_geom, name, type, condition, structure, description, year,
-                                        verbosity, eid, use_structure, code)
+                    features.append((feature_geom, name, type, condition, structure, description, year,
+                                     verbosity, eid, use_structure, code))
+
+                for i in range(0, len(features), self.chunk_size):
+                    chunk = features[i:i + self.chunk_size]
+                    topologies = self.snap_geometries([feature[0] for feature in chunk])
+                    for feature, topology in zip(chunk, topologies):
+                        self.create_signage(*feature, topology=topology)
 
             transaction.savepoint_commit(sid)
             if verbosity >= 2:
@@ -173,8 +181,24 @@ class Command(BaseCommand):
             transaction.savepoint_rollback(sid)
             raise
 
+    def snap_geometries(self, geometries):
+        """ Compute topologies of all point geometries, with a single query """
+        if not settings.TREKKING_TOPOLOGY_ENABLED:
+            return [None] * len(geometries)
+        points = []
+        for geometry in geometries:
+            if geometry.geom_type != 'Point':
+                raise GEOSException('Invalid Geometry type.')
+            geometry = geometry.transform(settings.API_SRID, clone=True)
+            geometry.coord_dim = 2
+            points.append(Point(geometry.x, geometry.y, srid=settings.API_SRID))
+        try:
+            return Topology.topologypoints(points)
+        except IndexError:
+            raise GEOSException('Invalid Geometry type.')
+
     def create_signage(self, geometry, name, type,
-                       condition, structure, description, year, verbosity, eid, use_structure, code):
+                       condition, structure, description, year, verbosity, eid, use_structure, code, topology=None):
 
         infra_type, created = SignageType.objects.get_or_create(label=type,
                                                                 structure=structure if use_structure else None)
@@ -210,14 +234,9 @@ class Command(BaseCommand):
             else:
                 infra = Signage.objects.create(**fields_without_eid)
         if settings.TREKKING_TOPOLOGY_ENABLED:
-            try:
-                geometry = geometry.transform(settings.API_SRID, clone=True)
-                geometry.coord_dim = 2
-                serialized = '{"lng": %s, "lat": %s}' % (geometry.x, geometry.y)
-                topology = Topology.deserialize(serialized)
-                infra.mutate(topology)
-            except IndexError:
-                raise GEOSException('Invalid Geometry type.')
+            if topology is None:
+                topology = self.snap_geometries([geometry])[0]
+            infra.mutate(topology)
         else:
             if geometry.geom_type != 'Point':
                 raise GEOSException('Invalid Geometry type.')
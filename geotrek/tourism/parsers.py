@@ -54,6 +54,7 @@ class TouristicContentMixin:
 class ApidaeParser(AttachmentParserMixin, ApidaeBaseParser):
     """Parser to import "anything" from APIDAE"""
     eid = 'eid'
+    bulk_size = 100
     fields = {
         'name': 'nom.libelleFr',
     }
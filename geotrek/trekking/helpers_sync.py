@@ -2,7 +2,6 @@ from django.conf import settings
 from django.db.models import Q
 
 import os
-from zipfile import ZipFile
 
 from geotrek.common import views as common_views
 from geotrek.trekking import views
@@ -41,32 +40,35 @@ class SyncRando:
         if self.global_sync.portal:
             treks = treks.filter(Q(portal__name=self.global_sync.portal) | Q(portal=None))
 
+        treks = list(treks)
+        # Profiles served by profile.json and profile.png views, computed at once
+        models.Trek.prefetch_elevation_data(treks)
         for trek in treks:
             self.sync_detail(lang, trek)
 
     def sync_detail(self, lang, trek):
         zipname = os.path.join('zip', 'treks', lang, '{pk}.zip'.format(pk=trek.pk))
-        zipfullname = os.path.join(self.global_sync.tmp_root, zipname)
-        self.global_sync.mkdirs(zipfullname)
-        self.trek_zipfile = ZipFile(zipfullname, 'w')
+        self.trek_zipfile = self.global_sync.open_zip(zipname)
+        sources = self.get_sources(trek)
 
         self.global_sync.sync_json(lang, common_views.ParametersView, 'parameters', zipfile=self.global_sync.zipfile)
         self.global_sync.sync_json(lang, common_views.ThemeViewSet, 'themes', as_view_args=[{'get': 'list'}],
                                    zipfile=self.global_sync.zipfile)
-        self.sync_trek_pois(lang, trek, zipfile=self.global_sync.zipfile)
+        self.sync_trek_pois(lang, trek, zipfile=self.global_sync.zipfile, sources=sources)
         if self.global_sync.with_infrastructures:
             self.sync_trek_infrastructures(lang, trek)
         if self.global_sync.with_signages:
             self.sync_trek_signages(lang, trek)
         self.sync_trek_services(lang, trek, zipfile=self.global_sync.zipfile)
-        self.sync_trek_gpx(lang, trek)
-        self.sync_trek_kml(lang, trek)
+        self.sync_trek_gpx(lang, trek, sources=sources)
+        self.sync_trek_kml(lang, trek, sources=sources)
         self.global_sync.sync_metas(lang, views.TrekMeta, trek)
-        self.global_sync.sync_metas(lang, common_views.Meta)
         if settings.USE_BOOKLET_PDF:
-            self.global_sync.sync_pdf(lang, trek, views.TrekDocumentBookletPublic.as_view(model=type(trek)))
+            self.global_sync.sync_pdf(lang, trek, views.TrekDocumentBookletPublic.as_view(model=type(trek)),
+                                      sources=sources)
         else:
-            self.global_sync.sync_pdf(lang, trek, views.TrekDocumentPublic.as_view(model=type(trek)))
+            self.global_sync.sync_pdf(lang, trek, views.TrekDocumentPublic.as_view(model=type(trek)),
+                                      sources=sources)
         self.global_sync.sync_profile_json(lang, trek)
         if not self.global_sync.skip_profile_png:
             self.global_sync.sync_profile_png(lang, trek, zipfile=self.global_sync.zipfile)
@@ -94,6 +96,15 @@ class SyncRando:
 
         self.global_sync.close_zip(self.trek_zipfile, zipname)
 
+    def get_sources(self, trek):
+        """ Trek and related objects whose updates imply to generate again trek files """
+        sources = self.global_sync.get_sources(trek)
+        for poi in trek.published_pois:
+            sources += self.global_sync.get_sources(poi)
+        sources += list(trek.children)
+        sources += list(trek.information_desks.all())
+        return sources
+
     def sync_trek_sensitiveareas(self, lang, trek):
         params = {'format': 'geojson', 'practices': 'Terrestre'}
 
@@ -154,19 +165,19 @@ class SyncRando:
         name = os.path.join('api', lang, 'treks', str(trek.pk), 'signages.geojson')
         self.global_sync.sync_view(lang, view, name, params=params, zipfile=zipfile, pk=trek.pk)
 
-    def sync_trek_pois(self, lang, trek, zipfile=None):
+    def sync_trek_pois(self, lang, trek, zipfile=None, sources=None):
         params = {'format': 'geojson'}
         view = views.TrekPOIViewSet.as_view({'get': 'list'})
         name = os.path.join('api', lang, 'treks', str(trek.pk), 'pois.geojson')
-        self.global_sync.sync_view(lang, view, name, params=params, zipfile=zipfile, pk=trek.pk)
+        self.global_sync.sync_view(lang, view, name, params=params, zipfile=zipfile, pk=trek.pk, sources=sources)
 
     def sync_trek_services(self, lang, trek, zipfile=None):
         view = views.TrekServiceViewSet.as_view({'get': 'list'})
         name = os.path.join('api', lang, 'treks', str(trek.pk), 'services.geojson')
         self.global_sync.sync_view(lang, view, name, params={'format': 'geojson'}, zipfile=zipfile, pk=trek.pk)
 
-    def sync_trek_gpx(self, lang, obj):
-        self.global_sync.sync_object_view(lang, obj, views.TrekGPXDetail.as_view(), '{obj.slug}.gpx')
+    def sync_trek_gpx(self, lang, obj, sources=None):
+        self.global_sync.sync_object_view(lang, obj, views.TrekGPXDetail.as_view(), '{obj.slug}.gpx', sources=sources)
 
-    def sync_trek_kml(self, lang, obj):
-        self.global_sync.sync_object_view(lang, obj, views.TrekKMLDetail.as_view(), '{obj.slug}.kml')
+    def sync_trek_kml(self, lang, obj, sources=None):
+        self.global_sync.sync_object_view(lang, obj, views.TrekKMLDetail.as_view(), '{obj.slug}.kml', sources=sources)
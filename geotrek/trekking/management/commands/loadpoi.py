@@ -14,6 +14,7 @@ class Command(BaseCommand):
     help = 'Load a layer with point geometries in a model\n'
     can_import_settings = True
     counter = 0
+    chunk_size = 1000
 
     def add_arguments(self, parser):
         parser.add_argument('point_layer')
@@ -60,14 +61,21 @@ class Command(BaseCommand):
                         "Set it with --type-field, or set a default value with --type-default"))
                     break
 
+                features = []
                 for feature in layer:
                     feature_geom = feature.geom
                     name = feature.get(field_name) if field_name in available_fields else options.get('name_default')
                     poitype = feature.get(field_poitype) if field_poitype in available_fields else options.get('type_default')
                     description = feature.get(field_description) if field_description in available_fields else ""
-                    self.create_poi(feature_geom, name, poitype, description)
-                    if verbosity >= 2:
-                        self.stdout.write(self.style.NOTICE("{} POI created.".format(name)))
+                    features.append((feature_geom, name, poitype, description))
+
+                for i in range(0, len(features), self.chunk_size):
+                    chunk = features[i:i + self.chunk_size]
+                    topologies = self.snap_geometries([feature_geom for feature_geom, *fields in chunk])
+                    for (feature_geom, name, poitype, description), topology in zip(chunk, topologies):
+                        self.create_poi(feature_geom, name, poitype, description, topology=topology)
+                        if verbosity >= 2:
+                            self.stdout.write(self.style.NOTICE("{} POI created.".format(name)))
 
             transaction.savepoint_commit(sid)
             if verbosity >= 2:
@@ -78,16 +86,25 @@ class Command(BaseCommand):
             transaction.savepoint_rollback(sid)
             raise
 
-    def create_poi(self, geometry, name, poitype, description):
+    def snap_geometries(self, geometries):
+        """ Compute topologies of all point geometries, with a single query """
+        if not settings.TREKKING_TOPOLOGY_ENABLED:
+            return [None] * len(geometries)
+        points = []
+        for geometry in geometries:
+            geometry = geometry.transform(settings.API_SRID, clone=True)
+            geometry.coord_dim = 2
+            points.append(Point(geometry.x, geometry.y, srid=settings.API_SRID))
+        return Topology.topologypoints(points)
+
+    def create_poi(self, geometry, name, poitype, description, topology=None):
         poitype, created = POIType.objects.get_or_create(label=poitype)
         poi = POI.objects.create(name=name, type=poitype, description=description)
         if settings.TREKKING_TOPOLOGY_ENABLED:
             # Use existing topology helpers to transform a Point(x, y)
             # to a path aggregation (topology)
-            geometry = geometry.transform(settings.API_SRID, clone=True)
-            geometry.coord_dim = 2
-            serialized = '{"lng": %s, "lat": %s}' % (geometry.x, geometry.y)
-            topology = Topology.deserialize(serialized)
+            if topology is None:
+                topology = self.snap_geometries([geometry])[0]
             # Move deserialization aggregations to the POI
             poi.mutate(topology)
         else:
@@ -7,6 +7,7 @@ from django.contrib.gis.db import models
 from django.contrib.gis.db.models.functions import Transform, LineLocatePoint
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
+from django.db import connection
 from django.db.models import F
 from django.template.defaultfilters import slugify
 from django.utils.translation import get_language, gettext, gettext_lazy as _
@@ -354,6 +355,9 @@ class Trek(Topology, StructureRelated, PicturesMixin, PublishableMixin, GeotrekM
 
     @classmethod
     def topology_treks(cls, topology):
+        if hasattr(topology, '_treks'):
+            # Loaded by Trek.prefetch_topology_treks()
+            return topology._treks
         if settings.TREKKING_TOPOLOGY_ENABLED:
             qs = cls.overlapping(topology)
         else:
@@ -363,8 +367,58 @@ class Trek(Topology, StructureRelated, PicturesMixin, PublishableMixin, GeotrekM
 
     @classmethod
     def published_topology_treks(cls, topology):
+        if hasattr(topology, '_published_treks'):
+            # Loaded by Trek.prefetch_topology_treks()
+            return topology._published_treks
         return cls.topology_treks(topology).filter(published=True)
 
+    @classmethod
+    def topologies_treks(cls, topologies, queryset=None):
+        """ Treks of several topologies, resolved in one query.
+        Returns {topology pk: [Trek, ...]}, treks being ordered as in topology_treks().
+        """
+        topologies = list(topologies)
+        if not topologies:
+            return {}
+        if queryset is None:
+            queryset = cls.objects.existing()
+        if settings.TREKKING_TOPOLOGY_ENABLED:
+            overlapping = cls.overlapping_pks(topologies)
+            treks = queryset.in_bulk({pk for trek_pks in overlapping.values() for pk in trek_pks})
+            return {
+                source_pk: [treks[pk] for pk in trek_pks if pk in treks]
+                for source_pk, trek_pks in overlapping.items()
+            }
+        sql = """
+        SELECT s.id, t.id
+        FROM %(topology_table)s s
+        JOIN %(topology_table)s t ON t.kind = %%s AND ST_Intersects(t.geom, ST_Buffer(s.geom, %%s))
+        WHERE s.id = ANY(%%s);
+        """ % {
+            'topology_table': Topology._meta.db_table,
+        }
+        overlapping = {topology.pk: set() for topology in topologies}
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [cls.KIND, settings.TREK_POI_INTERSECTION_MARGIN, list(overlapping)])
+            for source_pk, trek_pk in cursor.fetchall():
+                overlapping[source_pk].add(trek_pk)
+        # Keep default ordering of treks
+        treks = list(queryset.filter(pk__in={pk for trek_pks in overlapping.values() for pk in trek_pks}))
+        return {
+            source_pk: [trek for trek in treks if trek.pk in trek_pks]
+            for source_pk, trek_pks in overlapping.items()
+        }
+
+    @classmethod
+    def prefetch_topology_treks(cls, topologies, queryset=None):
+        """ Load treks and published treks of several topologies at once """
+        topologies = list(topologies)
+        treks = cls.topologies_treks(topologies, queryset=queryset)
+        for topology in topologies:
+            topology._treks = treks.get(topology.pk, [])
+            topology._published_treks = [trek for trek in topology._treks if trek.published]
+        return topologies
+
     # Rando v1 compat
     @property
     def usages(self):
@@ -770,8 +824,54 @@ class POI(StructureRelated, PicturesMixin, PublishableMixin, GeotrekMapEntityMix
 
     @classmethod
     def published_topology_pois(cls, topology):
+        if hasattr(topology, '_published_pois'):
+            # Loaded by POI.prefetch_published_pois()
+            return topology._published_pois
         return cls.topology_pois(topology).filter(published=True)
 
+    @classmethod
+    def published_topologies_pois(cls, topologies, queryset=None):
+        """ Published POIs of several topologies, resolved in one query.
+        Returns {topology pk: [POI, ...]}, POIs being ordered as in published_pois property.
+        """
+        pks = [topology.pk for topology in topologies]
+        if not pks:
+            return {}
+        if settings.TREKKING_TOPOLOGY_ENABLED:
+            overlapping = cls.overlapping_pks(topologies)
+        else:
+            sql = """
+            SELECT s.id, t.id
+            FROM %(topology_table)s s
+            JOIN %(topology_table)s t ON t.kind = %%s AND ST_Intersects(t.geom, ST_Buffer(s.geom, %%s))
+            WHERE s.id = ANY(%%s)
+            ORDER BY s.id, CASE WHEN GeometryType(s.geom) = 'LINESTRING' THEN ST_LineLocatePoint(s.geom, t.geom) END, t.id;
+            """ % {
+                'topology_table': Topology._meta.db_table,
+            }
+            overlapping = {pk: [] for pk in pks}
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [cls.KIND, settings.TREK_POI_INTERSECTION_MARGIN, pks])
+                for source_pk, poi_pk in cursor.fetchall():
+                    overlapping[source_pk].append(poi_pk)
+        if queryset is None:
+            queryset = cls.objects.existing()
+        pois = queryset.filter(published=True).in_bulk({pk for poi_pks in overlapping.values() for pk in poi_pks})
+        excluded = set(Trek.pois_excluded.through.objects.filter(trek__in=pks).values_list('trek_id', 'poi_id'))
+        return {
+            source_pk: [pois[pk] for pk in dict.fromkeys(poi_pks) if pk in pois and (source_pk, pk) not in excluded]
+            for source_pk, poi_pks in overlapping.items()
+        }
+
+    @classmethod
+    def prefetch_published_pois(cls, topologies, queryset=None):
+        """ Load published_pois of several topologies at once """
+        topologies = list(topologies)
+        pois = cls.published_topologies_pois(topologies, queryset=queryset)
+        for topology in topologies:
+            topology._published_pois = pois.get(topology.pk, [])
+        return topologies
+
     def distance(self, to_cls):
         return settings.TOURISM_INTERSECTION_MARGIN
 
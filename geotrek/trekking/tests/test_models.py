@@ -14,7 +14,7 @@ from geotrek.zoning.tests.factories import DistrictFactory, CityFactory
 from geotrek.trekking.tests.factories import (POIFactory, TrekFactory,
                                               TrekWithPOIsFactory, ServiceFactory,
                                               RatingFactory, RatingScaleFactory)
-from geotrek.trekking.models import Trek, OrderedTrekChild
+from geotrek.trekking.models import POI, Trek, OrderedTrekChild
 
 
 class TrekTest(TranslationResetMixin, TestCase):
@@ -237,6 +237,66 @@ class RelatedObjectsTest(TranslationResetMixin, TestCase):
         self.assertCountEqual(service.treks, [trek])
         self.assertCountEqual(trek.districts, [d1])
 
+    @skipIf(not settings.TREKKING_TOPOLOGY_ENABLED, 'Test with dynamic segmentation only')
+    def test_published_pois_of_several_treks(self):
+        p1 = PathFactory.create(geom=LineString((0, 0), (4, 4)))
+        p2 = PathFactory.create(geom=LineString((4, 4), (8, 8)))
+        trek = TrekFactory.create(paths=[(p1, 0.5, 1), (p2, 0, 1)])
+        trek2 = TrekFactory.create(paths=[(p2, 1, 0)])
+        poi = POIFactory.create(paths=[(p1, 0.6, 0.6)], published=True)
+        poi2 = POIFactory.create(paths=[(p2, 0.4, 0.4)], published=True)
+        poi3 = POIFactory.create(paths=[(p2, 0.8, 0.8)], published=True)
+        POIFactory.create(paths=[(p2, 0.5, 0.5)], published=False)
+        trek2.pois_excluded.add(poi2.pk)
+
+        pois = POI.published_topologies_pois([trek, trek2])
+        self.assertEqual(pois, {trek.pk: [poi, poi2, poi3], trek2.pk: [poi3]})
+        self.assertEqual(pois[trek.pk], list(trek.published_pois))
+
+    @skipIf(not settings.TREKKING_TOPOLOGY_ENABLED, 'Test with dynamic segmentation only')
+    def test_prefetch_treks_of_several_pois(self):
+        p1 = PathFactory.create(geom=LineString((0, 0), (4, 4)))
+        p2 = PathFactory.create(geom=LineString((4, 4), (8, 8)))
+        trek = TrekFactory.create(paths=[(p1, 0.5, 1), (p2, 0, 1)], published=True)
+        trek2 = TrekFactory.create(paths=[(p2, 1, 0)], published=False)
+        poi = POIFactory.create(paths=[(p1, 0.6, 0.6)])
+        poi2 = POIFactory.create(paths=[(p2, 0.4, 0.4)])
+
+        treks = Trek.topologies_treks([poi, poi2])
+        self.assertEqual(treks, {poi.pk: [trek], poi2.pk: [trek, trek2]})
+        self.assertCountEqual(treks[poi2.pk], poi2.treks)
+        Trek.prefetch_topology_treks([poi, poi2])
+        with self.assertNumQueries(0):
+            self.assertEqual(poi2.treks, [trek, trek2])
+            self.assertEqual(Trek.published_topology_treks(poi2), [trek])
+
+    @skipIf(settings.TREKKING_TOPOLOGY_ENABLED, 'Test without dynamic segmentation only')
+    def test_prefetch_treks_of_several_pois_nds(self):
+        trek = TrekFactory.create(geom=LineString((2, 2), (8, 8)), published=True)
+        trek2 = TrekFactory.create(geom=LineString((8, 8), (5, 5)), published=False)
+        poi = POIFactory.create(geom=Point(2.4, 2.4))
+        poi2 = POIFactory.create(geom=Point(7.4, 7.4))
+
+        treks = Trek.topologies_treks([poi, poi2])
+        self.assertEqual(treks, {poi.pk: list(poi.treks), poi2.pk: list(poi2.treks)})
+        self.assertIn(trek2, treks[poi2.pk])
+        Trek.prefetch_topology_treks([poi, poi2])
+        with self.assertNumQueries(0):
+            self.assertEqual(poi2.treks, treks[poi2.pk])
+            self.assertEqual(Trek.published_topology_treks(poi2), [trek])
+
+    @skipIf(settings.TREKKING_TOPOLOGY_ENABLED, 'Test without dynamic segmentation only')
+    def test_published_pois_of_several_treks_nds(self):
+        trek = TrekFactory.create(geom=LineString((2, 2), (8, 8)))
+        trek2 = TrekFactory.create(geom=LineString((8, 8), (5, 5)))
+        poi = POIFactory.create(geom=Point(2.4, 2.4), published=True)
+        poi2 = POIFactory.create(geom=Point(7.4, 7.4), published=True)
+        POIFactory.create(geom=Point(6, 6), published=False)
+        trek.pois_excluded.add(poi.pk)
+
+        pois = POI.published_topologies_pois([trek, trek2])
+        self.assertEqual(pois, {trek.pk: [poi2], trek2.pk: [poi2, poi]})
+
     @skipIf(settings.TREKKING_TOPOLOGY_ENABLED, 'Test without dynamic segmentation only')
     def test_deleted_pois_nds(self):
         trek = TrekFactory.create(geom=LineString((0, 0), (4, 4)))
@@ -14,6 +14,7 @@ from mapentity.helpers import alphabet_enumeration
 from mapentity.views import (MapEntityList, MapEntityFormat, MapEntityDetail, MapEntityMapImage,
                              MapEntityDocument, MapEntityCreate, MapEntityUpdate, MapEntityDelete, LastModifiedMixin)
 from rest_framework import permissions as rest_permissions, viewsets
+from rest_framework.response import Response
 
 from geotrek.authent.decorators import same_structure_required
 from geotrek.common.forms import AttachmentAccessibilityForm
@@ -160,7 +161,7 @@ class TrekDocumentPublicMixin:
             information_desks = information_desks[:settings.TREK_EXPORT_INFORMATION_DESK_LIST_LIMIT]
 
         context['information_desks'] = information_desks
-        pois = list(trek.published_pois.all())
+        pois = list(trek.published_pois)
         if settings.TREK_EXPORT_POI_LIST_LIMIT > 0:
             pois = pois[:settings.TREK_EXPORT_POI_LIST_LIMIT]
         letters = alphabet_enumeration(len(pois))
@@ -283,6 +284,14 @@ class TrekAPIViewSet(APIViewSet):
 
         return qs
 
+    def list(self, request, *args, **kwargs):
+        treks = list(self.filter_queryset(self.get_queryset()))
+        if settings.TREK_WITH_POIS_PICTURES:
+            # Published POIs of all treks at once, instead of one overlapping query per trek
+            POI.prefetch_published_pois(treks)
+        serializer = self.get_serializer(treks, many=True)
+        return Response(serializer.data)
+
 
 class POIList(CustomColumnsMixin, FlattenPicturesMixin, MapEntityList):
     queryset = POI.objects.existing()
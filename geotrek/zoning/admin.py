@@ -4,15 +4,18 @@ from django.utils.translation import gettext as _
 from leaflet.admin import LeafletGeoAdmin
 
 from geotrek.common.mixins.actions import MergeActionMixin
+from geotrek.common.versions import bump_versions
 from geotrek.zoning import models as zoning_models
 
 
 def publish(modeladmin, request, queryset):
     queryset.update(published=True)
+    bump_versions(queryset.model)
 
 
 def unpublish(modeladmin, request, queryset):
     queryset.update(published=False)
+    bump_versions(queryset.model)
 
 
 publish.short_description = _("Publish (visible on Geotrek-rando)")
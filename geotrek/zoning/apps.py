@@ -5,3 +5,6 @@ from django.utils.translation import gettext_lazy as _
 class ZoningConfig(AppConfig):
     name = 'geotrek.zoning'
     verbose_name = _("Zoning")
+
+    def ready(self):
+        import geotrek.zoning.signals  # NOQA
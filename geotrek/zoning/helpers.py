@@ -0,0 +1,92 @@
+import hashlib
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+
+from geotrek.common.versions import get_versions
+
+from .models import City, District, ObjectZoning, RestrictedArea
+
+# (attribute, zone model, SQL ordering of zones not ordered along a line)
+ZONINGS = (
+    ('cities', City, 'z.name'),
+    ('districts', District, 'z.name'),
+    ('areas', RestrictedArea, 'z.area_type_id, z.name'),
+)
+
+
+def zones_version():
+    """ Changes whenever a city, district or restricted area is added, modified or removed """
+    version = get_versions(*(model for attribute, model, order in ZONINGS))
+    # Stored in ObjectZoning.zones_version
+    return hashlib.md5(version.encode('utf-8')).hexdigest()
+
+
+def intersecting_zones(model, order, geometries):
+    """ Returns primary keys of zones intersecting each geometry, in the same order as intersecting():
+    along the geometry for lines, following zone ordering otherwise """
+    zones = [[] for geometry in geometries]
+    indexes = [i for i, geometry in enumerate(geometries) if geometry]
+    if not indexes:
+        return zones
+    sql = """
+        WITH objects AS (SELECT * FROM unnest(%s::integer[], %s::geometry[]) AS o(id, geom))
+        SELECT o.id, z.{pk}
+        FROM objects o
+        JOIN {table} z ON ST_Intersects(z.geom, o.geom)
+        LEFT JOIN LATERAL ST_Dump(ST_Intersection(o.geom, z.geom)) d ON GeometryType(o.geom) = 'LINESTRING'
+        GROUP BY o.id, z.{pk}
+        ORDER BY o.id, MIN(ST_LineLocatePoint(o.geom, ST_StartPoint(d.geom))), {order}
+    """.format(pk=model._meta.pk.column, table=model._meta.db_table, order=order)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [indexes, [geometries[i].hexewkb.decode() for i in indexes]])
+        for i, pk in cursor.fetchall():
+            zones[i].append(pk)
+    return zones
+
+
+def update_zoning(content_type, objects, version):
+    """ Compute and store zoning of objects in one query per kind of zone """
+    geometries = [obj.zoning_property.geom for obj in objects]
+    zonings = [ObjectZoning(content_type=content_type, object_id=obj.pk, date_update=obj.date_update,
+                            zones_version=version) for obj in objects]
+    for attribute, model, order in ZONINGS:
+        for zoning, pks in zip(zonings, intersecting_zones(model, order, geometries)):
+            setattr(zoning, attribute, pks)
+    ObjectZoning.objects.filter(content_type=content_type, object_id__in=[obj.pk for obj in objects]).delete()
+    ObjectZoning.objects.bulk_create(zonings, ignore_conflicts=True)
+    return zonings
+
+
+def prefetch_zoning(objects):
+    """ Load cities, districts and restricted areas of a list of objects at once.
+    Zoning is read from ObjectZoning, and computed again in batch for objects or zones modified since. """
+    objects = [obj for obj in objects if obj.pk is not None]
+    if not objects:
+        return
+    version = zones_version()
+    zonings = []
+    by_model = {}
+    for obj in objects:
+        by_model.setdefault(type(obj), []).append(obj)
+    for model, model_objects in by_model.items():
+        content_type = ContentType.objects.get_for_model(model)
+        existing = ObjectZoning.objects.filter(content_type=content_type,
+                                               object_id__in=[obj.pk for obj in model_objects])
+        existing = {zoning.object_id: zoning for zoning in existing}
+        stale = [obj for obj in model_objects
+                 if obj.pk not in existing
+                 or existing[obj.pk].date_update != obj.date_update
+                 or existing[obj.pk].zones_version != version]
+        if stale:
+            existing.update({zoning.object_id: zoning for zoning in update_zoning(content_type, stale, version)})
+        zonings += [(obj, existing[obj.pk]) for obj in model_objects]
+    for attribute, model, order in ZONINGS:
+        pks = {pk for obj, zoning in zonings for pk in getattr(zoning, attribute)}
+        zones = model.objects.defer('geom')
+        if model is RestrictedArea:
+            zones = zones.select_related('area_type')
+        zones = zones.in_bulk(pks)
+        for obj, zoning in zonings:
+            obj._zoning = getattr(obj, '_zoning', {})
+            obj._zoning[attribute] = [zones[pk] for pk in getattr(zoning, attribute) if pk in zones]
@@ -4,6 +4,7 @@ from django.core.cache import cache
 from django.utils.translation import gettext_lazy as _
 
 from geotrek.common.utils import intersecting, uniquify
+from geotrek.common.versions import get_version
 from .models import RestrictedArea, District, City
 
 
@@ -22,11 +23,10 @@ class ZoningPropertiesMixin:
 
     @property
     def areas(self):
-        last_update_and_count = RestrictedArea.last_update_and_count
-        last_update_iso_format = last_update_and_count['last_update'].isoformat() if last_update_and_count[
-            'last_update'] else 'no-data'
-        count = last_update_and_count['count']
-        cache_string = f"areas:{self.pk}:{self.date_update.isoformat()}:{last_update_iso_format}:{count}"
+        if hasattr(self, '_zoning'):
+            # Loaded by geotrek.zoning.helpers.prefetch_zoning()
+            return self._zoning['areas']
+        cache_string = f"areas:{self.pk}:{self.date_update.isoformat()}:{get_version(RestrictedArea)}"
         cache_key = hashlib.md5(cache_string.encode("utf-8")).hexdigest()
         if cache_key in cache:
             return cache.get(cache_key)
@@ -39,10 +39,9 @@ class ZoningPropertiesMixin:
 
     @property
     def districts(self):
-        last_update_and_count = District.last_update_and_count
-        last_update_iso_format = last_update_and_count['last_update'].isoformat() if last_update_and_count['last_update'] else 'no-data'
-        count = last_update_and_count['count']
-        cache_string = f"districts:{self.pk}:{self.date_update.isoformat()}:{last_update_iso_format}:{count}"
+        if hasattr(self, '_zoning'):
+            return self._zoning['districts']
+        cache_string = f"districts:{self.pk}:{self.date_update.isoformat()}:{get_version(District)}"
         cache_key = hashlib.md5(cache_string.encode("utf-8")).hexdigest()
         if cache_key in cache:
             return cache.get(cache_key)
@@ -55,11 +54,9 @@ class ZoningPropertiesMixin:
 
     @property
     def cities(self):
-        last_update_and_count = City.last_update_and_count
-        last_update_iso_format = last_update_and_count['last_update'].isoformat() if last_update_and_count[
-            'last_update'] else 'no-data'
-        count = last_update_and_count['count']
-        cache_string = f"areas:{self.pk}:{self.date_update.isoformat()}:{last_update_iso_format}:{count}"
+        if hasattr(self, '_zoning'):
+            return self._zoning['cities']
+        cache_string = f"cities:{self.pk}:{self.date_update.isoformat()}:{get_version(City)}"
         cache_key = hashlib.md5(cache_string.encode("utf-8")).hexdigest()
         data = cache.get(cache_key)
         if data:
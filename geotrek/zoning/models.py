@@ -5,7 +5,9 @@
 
 """
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.gis.db import models
+from django.contrib.postgres.fields import ArrayField
 from django.contrib.postgres.indexes import GistIndex
 from django.utils.translation import gettext_lazy as _
 
@@ -73,3 +75,17 @@ class District(TimeStampedModelMixin, models.Model):
 
     def __str__(self):
         return self.name
+
+
+class ObjectZoning(models.Model):
+    """ Zones intersecting an object, precomputed in batch (see geotrek.zoning.helpers.prefetch_zoning) """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    date_update = models.DateTimeField()
+    zones_version = models.CharField(max_length=32)
+    cities = ArrayField(models.CharField(max_length=6), default=list)
+    districts = ArrayField(models.IntegerField(), default=list)
+    areas = ArrayField(models.IntegerField(), default=list)
+
+    class Meta:
+        unique_together = ('content_type', 'object_id')
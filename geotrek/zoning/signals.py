@@ -0,0 +1,14 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .mixins import ZoningPropertiesMixin
+from .models import ObjectZoning
+
+
+@receiver(post_delete)
+def delete_object_zoning(sender, instance, *args, **kwargs):
+    """ after deletion of an object, remove its precomputed zoning """
+    if issubclass(sender, ZoningPropertiesMixin):
+        ObjectZoning.objects.filter(content_type=ContentType.objects.get_for_model(sender),
+                                    object_id=instance.pk).delete()
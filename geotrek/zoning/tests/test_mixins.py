@@ -1,8 +1,11 @@
 from django.conf import settings
 from django.test import TestCase
 
+from geotrek.core.models import Path
 from geotrek.core.tests.factories import PathFactory
 from geotrek.trekking.tests.factories import TrekFactory
+from geotrek.zoning.helpers import prefetch_zoning
+from geotrek.zoning.models import ObjectZoning
 from geotrek.zoning.tests.factories import CityFactory, DistrictFactory, RestrictedAreaFactory
 
 
@@ -89,3 +92,35 @@ class ZoningPropertiesMixinTest(TestCase):
         self.assertEqual(len(self.path.areas), 2)
         self.assertQuerysetEqual(self.path.published_areas, [repr(area), repr(self.area)])
         self.assertEqual(len(self.path.published_areas), 2)
+
+    def test_prefetch_zoning(self):
+        city = CityFactory.create(published=False, geom=self.geom_2_wkt)
+        paths = [self.path, PathFactory.create(geom='SRID=2154;LINESTRING(1100000 1200000, 200000 300000)')]
+
+        prefetch_zoning(paths)
+        self.assertEqual(ObjectZoning.objects.count(), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(paths[0].cities, [self.city, city])
+            self.assertEqual(paths[1].cities, [city, self.city])
+            self.assertEqual(paths[0].districts, [self.district])
+            self.assertEqual(paths[1].published_areas, [self.area])
+
+        # Precomputed zoning is used as long as objects and zones are not modified
+        paths = list(Path.objects.filter(pk__in=[path.pk for path in paths]).order_by('pk'))
+        # Zones version, precomputed zoning and zones of each kind
+        with self.assertNumQueries(7):
+            prefetch_zoning(paths)
+        self.assertEqual(paths[0].cities, [self.city, city])
+
+        city.delete()
+        paths = list(Path.objects.filter(pk__in=[path.pk for path in paths]).order_by('pk'))
+        prefetch_zoning(paths)
+        self.assertEqual(paths[0].cities, [self.city])
+        self.assertEqual(ObjectZoning.objects.count(), 2)
+
+    def test_zoning_deleted_along_with_object(self):
+        path = PathFactory.create(geom='SRID=2154;LINESTRING(200000 300000, 900000 300000)')
+        prefetch_zoning([self.path, path])
+        self.assertEqual(ObjectZoning.objects.count(), 2)
+        path.delete()
+        self.assertEqual(list(ObjectZoning.objects.values_list('object_id', flat=True)), [self.path.pk])